@@ -18,6 +18,14 @@ class AstDatasetCreatorArguments:
         parser.add_argument('--recompute_l2g', action='store_true', default=False, help="")
         parser.add_argument('--remove_type_annotations', action='store_true', default=False, help="")
         parser.add_argument('--seed', type=int, default=None, help="")
+        parser.add_argument('--workers', type=int, default=1,
+                            help="Number of processes for extracting environments in parallel")
+        parser.add_argument('--incremental', action='store_true', default=False,
+                            help="Reuse extraction results for environments that did not change since the previous "
+                                 "build into the same output directory")
+        parser.add_argument('--parse_cache_dir', type=str, default=None,
+                            help="Directory for the persistent cache of AST edges. Modules with the same source are "
+                                 "parsed only once across builds and packages")
 
         self.parser = parser
         self.add_positional_argument()
@@ -1,6 +1,9 @@
+import re
 from os import urandom
 from time import time_ns
 
+import xxhash
+
 
 class IdentifierPool:
     """
@@ -35,4 +38,77 @@ class IntIdentifierPool(IdentifierPool):
         # candidate = str(int(urandom(10).hex(), 16))
         # while len(candidate) < 19:
         #     candidate = str(int(urandom(10).hex(), 16))
-        # return candidate[:19]
\ No newline at end of file
+        # return candidate[:19]
+
+
+def hash64(value: str) -> int:
+    """
+    Deterministic 64-bit hash of a string. Unlike the built-in `hash`, the result does not change between runs.
+    """
+    return xxhash.xxh3_64_intdigest(value.encode("utf-8"))
+
+
+def hash128(value: str) -> str:
+    """
+    Deterministic 128-bit hash of a string as a hex string. Has the same width as MD5 hex digest.
+    """
+    return xxhash.xxh3_128_hexdigest(value.encode("utf-8"))
+
+
+class DeterministicIdentifierPool:
+    """
+    Creates identifiers from a counter that starts from the hash of the seed. Identifiers have the same format as
+    identifiers from `IdentifierPool`, but generating them requires no system calls, and the same seed produces the
+    same sequence of identifiers. The seed should be unique for every source file, e.g. package name and file id.
+    """
+    _mask = (1 << 64) - 1
+    identifier_pattern = re.compile("0x[0-9a-f]{16}")
+
+    def __init__(self, seed, num_identifiers=0):
+        """
+        :param seed: seed for the sequence of identifiers
+        :param num_identifiers: number of identifiers that were already created from this seed
+        """
+        self._base = hash64(str(seed))
+        self._counter = num_identifiers
+
+    @property
+    def num_identifiers(self):
+        return self._counter
+
+    def get_new_identifier(self):
+        identifier = "0x" + format((self._base + self._counter) & self._mask, "016x")
+        self._counter += 1
+        return identifier
+
+    def translate(self, text, target):
+        """
+        Replace identifiers created by this pool with identifiers that the target pool creates at the same positions
+        of the sequence. Other text is not changed.
+        :param text: string that contains identifiers, e.g. node name
+        :param target: DeterministicIdentifierPool with a different seed
+        :return: string with translated identifiers
+        """
+        def replace(match):
+            position = (int(match.group()[2:], 16) - self._base) & self._mask
+            if position >= self._counter:
+                return match.group()
+            return "0x" + format((target._base + position) & self._mask, "016x")
+
+        return self.identifier_pattern.sub(replace, text)
+
+
+class CounterIdentifierPool:
+    """
+    Creates identifiers from a counter. Identifiers are decimal strings with 19 digits, same as identifiers from
+    `IntIdentifierPool`. Identifiers are unique only within the pool.
+    """
+    _first = 10 ** 18
+
+    def __init__(self):
+        self._counter = 0
+
+    def get_new_identifier(self):
+        identifier = str(self._first + self._counter)
+        self._counter += 1
+        return identifier
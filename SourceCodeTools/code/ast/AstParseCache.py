@@ -0,0 +1,182 @@
+import logging
+import os
+import pickle
+import sqlite3
+import zlib
+from hashlib import blake2b
+from os.path import join
+
+from SourceCodeTools.code.IdentifierPool import DeterministicIdentifierPool
+
+
+def _create_edges(ast_processor_class, source, identifier_seed):
+    try:
+        ast_processor = ast_processor_class(source, identifier_seed=identifier_seed)
+    except:
+        return None, None
+    try: # TODO recursion error does not appear consistently. The issue is probably with library versions...
+        edges = ast_processor.get_edges(as_dataframe=False)
+    except RecursionError:
+        return None, None
+    return ast_processor, edges
+
+
+def get_ast_edges(ast_processor_class, source, identifier_seed=None, parse_cache=None):
+    """
+    Create AST edges with `ast_processor_class(source, identifier_seed=identifier_seed).get_edges(as_dataframe=False)`.
+    :param ast_processor_class: subclass of AstGraphGenerator
+    :param source: source code of a module
+    :param identifier_seed: seed for identifiers of AST nodes
+    :param parse_cache: AstParseCache, edges are created without caching when None
+    :return: list of edges or None if the source cannot be processed
+    """
+    if parse_cache is not None:
+        return parse_cache.get_edges(ast_processor_class, source, identifier_seed)
+    _, edges = _create_edges(ast_processor_class, source, identifier_seed)
+    return edges
+
+
+class AstParseCache:
+    """
+    Persistent cache for AST edges created from module sources. Entries are stored in an SQLite database and keyed on
+    the hash of the source, the version of the AST generator, and the class that creates edges, so that unchanged
+    modules and identical modules from different packages are parsed only once across dataset builds.
+
+    Node names contain identifiers that depend on the identifier seed (package and file). Cached edges are created
+    with a seed derived from the key and identifiers are translated to the requested seed when entries are read.
+
+    The database connection is opened lazily in every process, the cache can be passed to worker processes.
+    """
+
+    filename = "ast_parse_cache.sqlite"
+    format_version = 1
+
+    def __init__(self, cache_dir):
+        """
+        :param cache_dir: directory for the cache database, created if does not exist
+        """
+        self.cache_dir = cache_dir
+        self.path = join(cache_dir, self.filename)
+        os.makedirs(cache_dir, exist_ok=True)
+
+        self.hits = 0
+        self.misses = 0
+        self._connection = None
+        self._pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_connection"] = None
+        state["_pid"] = None
+        return state
+
+    @property
+    def connection(self):
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(self.path, timeout=60)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS parse_cache (key TEXT PRIMARY KEY, value BLOB)")
+            self._connection.commit()
+            self._pid = os.getpid()
+        return self._connection
+
+    def make_key(self, ast_processor_class, source):
+        key = blake2b(digest_size=16)
+        key.update(
+            f"{self.format_version}\x00{ast_processor_class.__module__}.{ast_processor_class.__qualname__}\x00"
+            f"{ast_processor_class.version}\x00".encode("utf-8")
+        )
+        key.update(source.encode("utf-8"))
+        return key.hexdigest()
+
+    def _read(self, key):
+        row = self.connection.execute("SELECT value FROM parse_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        return pickle.loads(zlib.decompress(row[0]))
+
+    def _write(self, key, value):
+        value = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        self.connection.execute("INSERT OR REPLACE INTO parse_cache (key, value) VALUES (?, ?)", (key, value))
+        self.connection.commit()
+
+    @staticmethod
+    def _translate_identifiers(edges, source_pool, target_pool):
+        # nodes are shared between edges, and scope nodes are copies with the same name, translate every object and
+        # every name once
+        nodes = {}
+        for edge in edges:
+            for node in (edge["src"], edge["dst"], edge.get("scope", None)):
+                while node is not None and id(node) not in nodes:
+                    nodes[id(node)] = node
+                    node = getattr(node, "scope", None)
+
+        translated_names = {}
+        for node in nodes.values():
+            name = node.name
+            if isinstance(name, str) and "0x" in name:
+                if name not in translated_names:
+                    translated_names[name] = source_pool.translate(name, target_pool)
+                node.name = translated_names[name]
+
+    def get_edges(self, ast_processor_class, source, identifier_seed=None):
+        """
+        Same as `get_ast_edges` without cache. Sources that cannot be processed are not cached.
+        """
+        key = self.make_key(ast_processor_class, source)
+
+        cached = self._read(key)
+        if cached is not None:
+            self.hits += 1
+            num_identifiers, edges = cached
+        else:
+            self.misses += 1
+            ast_processor, edges = _create_edges(ast_processor_class, source, identifier_seed=key)
+            if edges is None:
+                return None
+            num_identifiers = ast_processor.identifier_pool.num_identifiers
+            self._write(key, (num_identifiers, edges))
+
+        if identifier_seed is None:
+            # same as AstGraphGenerator without seed, identifiers are random
+            identifier_seed = os.urandom(8).hex()
+
+        self._translate_identifiers(
+            edges, DeterministicIdentifierPool(key, num_identifiers), DeterministicIdentifierPool(identifier_seed)
+        )
+        return edges
+
+    def pop_counters(self):
+        """
+        Return the number of cache hits and misses and reset counters. Used to collect counters from worker processes.
+        :return: tuple (hits, misses)
+        """
+        counters = (self.hits, self.misses)
+        self.hits = self.misses = 0
+        return counters
+
+    def add_counters(self, hits, misses):
+        """
+        Add counters collected from another process.
+        """
+        self.hits += hits
+        self.misses += misses
+
+    def log_statistics(self, reset=True):
+        """
+        Write the number of cache hits and misses to the log.
+        :param reset: reset counters after logging
+        """
+        total = self.hits + self.misses
+        if total > 0:
+            logging.info(
+                f"AST parse cache: {self.hits} hits, {self.misses} misses ({100 * self.hits / total:.1f}% hit rate)"
+            )
+        if reset:
+            self.hits = self.misses = 0
+
+    def close(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -5,10 +5,12 @@ from enum import Enum
 from itertools import chain
 from pprint import pprint
 from time import time_ns
+from array import array
 from collections.abc import Iterable
+import numpy as np
 import pandas as pd
 # import os
-from SourceCodeTools.code.IdentifierPool import IdentifierPool
+from SourceCodeTools.code.IdentifierPool import IdentifierPool, DeterministicIdentifierPool
 
 
 class PythonNodeEdgeDefinitions:
@@ -317,6 +319,8 @@ class PythonSharedNodes:
 
 
 class GNode:
+    __slots__ = ("name", "type", "scope", "string", "id", "global_name", "global_id", "global_type", "name_scope")
+
     def __init__(self, **kwargs):
         self.string = None
         for k, v in kwargs.items():
@@ -326,33 +330,148 @@ class GNode:
         return self.name == other.name and self.type == other.type
 
     def __repr__(self):
-        return self.__dict__.__repr__()
+        return {k: getattr(self, k) for k in self.__slots__ if hasattr(self, k)}.__repr__()
 
     def __hash__(self):
         return (self.name, self.type).__hash__()
 
+    def __copy__(self):
+        new_node = GNode.__new__(GNode)
+        for k in self.__slots__:
+            if hasattr(self, k):
+                setattr(new_node, k, getattr(self, k))
+        return new_node
+
     def setprop(self, key, value):
         setattr(self, key, value)
 
 
 class GEdge:
-    def __init__(self, src, dst, type, scope=None, line=None, end_line=None, col_offset=None, end_col_offset=None):
+    __slots__ = (
+        "src", "dst", "type", "scope", "line", "end_line", "col_offset", "end_col_offset",
+        "var_line", "var_end_line", "var_col_offset", "var_end_col_offset"
+    )
+
+    position_fields = ("line", "end_line", "col_offset", "end_col_offset")
+    var_position_fields = ("var_line", "var_end_line", "var_col_offset", "var_end_col_offset")
+
+    def __init__(
+            self, src, dst, type, scope=None, line=None, end_line=None, col_offset=None, end_col_offset=None,
+            var_line=None, var_end_line=None, var_col_offset=None, var_end_col_offset=None
+    ):
         self.src = src
         self.dst = dst
         self.type = type
-        self.line = line
         self.scope = scope
+        self.line = line
         self.end_line = end_line
         self.col_offset = col_offset
         self.end_col_offset = end_col_offset
+        self.var_line = var_line
+        self.var_end_line = var_end_line
+        self.var_col_offset = var_col_offset
+        self.var_end_col_offset = var_end_col_offset
 
     def __getitem__(self, item):
-        return self.__dict__[item]
+        return getattr(self, item)
+
+    @property
+    def positions(self):
+        return self.line, self.end_line, self.col_offset, self.end_col_offset
+
+    @property
+    def var_positions(self):
+        return self.var_line, self.var_end_line, self.var_col_offset, self.var_end_col_offset
+
+    def to_dict(self):
+        """
+        :return: dictionary representation of the edge. Position fields are included only when they are known.
+        """
+        edge = {"src": self.src, "dst": self.dst, "type": self.type, "scope": self.scope}
+        if self.line is not None:
+            edge.update(zip(self.position_fields, self.positions))
+        if self.var_line is not None:
+            edge.update(zip(self.var_position_fields, self.var_positions))
+        return edge
+
+
+class EdgeColumns:
+    """
+    Column storage for edges. Edge types are interned and stored as integer codes, positions are stored in integer
+    arrays with masks for missing values. Converts to the same DataFrame as `pd.DataFrame([edge.to_dict() ...])`
+    without creating a dictionary for every edge.
+    """
+    def __init__(self):
+        self.src = []
+        self.dst = []
+        self.scope = []
+        self.type_codes = array("i")
+        self.type_vocabulary = {}
+        self.positions = {field: array("i") for field in GEdge.position_fields + GEdge.var_position_fields}
+        self.has_positions = array("b")
+        self.has_var_positions = array("b")
+        # position groups in the order of the first appearance, defines the order of columns
+        self.position_groups = []
+
+    def __len__(self):
+        return len(self.src)
+
+    def _append_positions(self, fields, values, mask):
+        known = values[0] is not None
+        mask.append(known)
+        if known and fields not in self.position_groups:
+            self.position_groups.append(fields)
+        for field, value in zip(fields, values):
+            self.positions[field].append(value if known else 0)
+
+    def append(self, edge):
+        self.src.append(edge.src)
+        self.dst.append(edge.dst)
+        self.scope.append(edge.scope)
+        self.type_codes.append(self.type_vocabulary.setdefault(edge.type, len(self.type_vocabulary)))
+        self._append_positions(GEdge.position_fields, edge.positions, self.has_positions)
+        self._append_positions(GEdge.var_position_fields, edge.var_positions, self.has_var_positions)
+
+    def extend(self, edges):
+        for edge in edges:
+            self.append(edge)
+
+    def to_dataframe(self):
+        if len(self) == 0:
+            return pd.DataFrame()
+
+        types = np.empty(len(self.type_vocabulary), dtype=object)
+        for type_, code in self.type_vocabulary.items():
+            types[code] = type_
+
+        columns = {
+            "src": self.src,
+            "dst": self.dst,
+            "type": types[np.frombuffer(self.type_codes, dtype=np.int32)],
+            "scope": self.scope,
+        }
+        for fields in self.position_groups:
+            known = self.has_positions if fields == GEdge.position_fields else self.has_var_positions
+            missing = np.frombuffer(known, dtype=np.int8) == 0
+            for field in fields:
+                columns[field] = pd.arrays.IntegerArray(
+                    np.frombuffer(self.positions[field], dtype=np.int32).copy(), missing
+                )
+        return pd.DataFrame(columns)
 
 
 class AstGraphGenerator(object):
-
-    def __init__(self, source, add_reverse_edges=True):
+    # increase when the graph produced for the same source changes, invalidates entries in AstParseCache
+    version = 1
+
+    def __init__(self, source, add_reverse_edges=True, identifier_seed=None):
+        """
+        :param source: source code of a module
+        :param add_reverse_edges: add reverse edge for every edge
+        :param identifier_seed: seed for node identifiers, should be unique for every source file (e.g. package and
+            file id). When provided, parsing the same source produces the same node names. Otherwise, identifiers
+            are random.
+        """
         self.source = source.split("\n")  # lines of the source code
         self.root = ast.parse(source)
         self.current_condition = []
@@ -360,7 +479,14 @@ class AstGraphGenerator(object):
         self.scope = []
         self._add_reverse_edges = add_reverse_edges
 
-        self._identifier_pool = IdentifierPool()
+        if identifier_seed is not None:
+            self._identifier_pool = DeterministicIdentifierPool(identifier_seed)
+        else:
+            self._identifier_pool = IdentifierPool()
+
+    @property
+    def identifier_pool(self):
+        return self._identifier_pool
 
     def get_source_from_ast_range(self, node, strip=True):
         start_line = node.lineno
@@ -392,14 +518,12 @@ class AstGraphGenerator(object):
 
     def get_name(self, *, node=None, name=None, type=None, add_random_identifier=False):
 
-        random_identifier = self._identifier_pool.get_new_identifier()
-
         if node is not None:
-            name = f"{node.__class__.__name__}_{random_identifier}"
+            name = f"{node.__class__.__name__}_{self._identifier_pool.get_new_identifier()}"
             type = node.__class__.__name__
         else:
             if add_random_identifier:
-                name = f"{name}_{random_identifier}"
+                name = f"{name}_{self._identifier_pool.get_new_identifier()}"
 
         if hasattr(node, "lineno"):
             node_string = self.get_source_from_ast_range(node, strip=False)
@@ -422,8 +546,10 @@ class AstGraphGenerator(object):
                 break  # to avoid going through nested definitions
 
         if not as_dataframe:
-            return edges
-        df = pd.DataFrame(edges)
+            return [edge.to_dict() for edge in edges]
+        edge_columns = EdgeColumns()
+        edge_columns.extend(edges)
+        df = edge_columns.to_dataframe()
         return df.astype({col: "Int32" for col in df.columns if col not in {"src", "dst", "type"}})
 
     def parse(self, node):
@@ -455,43 +581,23 @@ class AstGraphGenerator(object):
             # raise Exception()
             # return [type(node)]
 
+    @staticmethod
+    def get_positions(node):
+        if node is not None and hasattr(node, "lineno"):
+            return node.lineno - 1, node.end_lineno - 1, node.col_offset, node.end_col_offset
+        return None, None, None, None
+
     def add_edge(
             self, edges, src, dst, type, scope=None,
             position_node=None, var_position_node=None
     ):
-        edges.append({
-            "src": src, "dst": dst, "type": type, "scope": scope,
-        })
-
-        def get_positions(node):
-            if node is not None and hasattr(node, "lineno"):
-                line = node.lineno-1
-                end_line = node.end_lineno - 1
-                col_offset = node.col_offset
-                end_col_offset = node.end_col_offset
-            else:
-                line = end_line = col_offset = end_col_offset = None
-            return line, end_line, col_offset, end_col_offset
-
-        line, end_line, col_offset, end_col_offset = get_positions(position_node)
-
-        if line is not None:
-            edges[-1].update({
-                "line": line, "end_line": end_line, "col_offset": col_offset, "end_col_offset": end_col_offset
-            })
-
-        var_line, var_end_line, var_col_offset, var_end_col_offset = get_positions(var_position_node)
-
-        if var_line is not None:
-            edges[-1].update({
-                "var_line": var_line, "var_end_line": var_end_line, "var_col_offset": var_col_offset, "var_end_col_offset": var_end_col_offset
-            })
+        edges.append(GEdge(
+            src, dst, type, scope, *self.get_positions(position_node), *self.get_positions(var_position_node)
+        ))
 
         reverse_type = PythonNodeEdgeDefinitions.reverse_edge_exceptions.get(type, type + "_rev")
         if self._add_reverse_edges is True and reverse_type is not None:
-            edges.append({
-                "src": dst, "dst": src, "type": reverse_type, "scope": scope
-            })
+            edges.append(GEdge(dst, src, reverse_type, scope))
 
     def parse_body(self, nodes):
         edges = []
@@ -1,6 +1,7 @@
 import hashlib
 import os
 import sqlite3
+from copy import copy
 
 import pandas as pd
 from tqdm import tqdm
@@ -100,42 +101,170 @@ def return_chunks(chunks, additional_dtypes):
         yield chunk
 
 
-def read_nodes(node_path, as_chunks=False):
-    dtypes = {
-        "id": "int32",
-        "serialized_name": "string",
+node_dtypes = {
+    "id": "int32",
+    "serialized_name": "string",
+}
+
+node_additional_dtypes = {
+    'type': 'category',
+    "mentioned_in": "Int32",
+    "string": "string"
+}
+
+edge_dtypes = {
+    "id": "int32",
+    "source_node_id": "int32",
+    "target_node_id": "int32",
+}
+
+edge_additional_dtypes = {
+    "type": 'category',
+    "mentioned_in": "Int32",
+    "file_id": "Int32"
+}
+
+
+def is_columnar(path):
+    return str(path).endswith(".parquet")
+
+
+def get_parquet_schema(sample, dtypes, additional_dtypes):
+    """
+    Create schema for storing graph tables in parquet format. Ids are stored as int32, columns with category dtype
+    are dictionary encoded.
+    :param sample: DataFrame with columns of the table
+    :param dtypes: dtypes of required columns
+    :param additional_dtypes: dtypes of optional columns
+    :return: pyarrow schema
+    """
+    import pyarrow as pa
+
+    arrow_types = {
+        "int32": pa.int32(),
+        "Int32": pa.int32(),
+        "string": pa.string(),
+        "category": pa.dictionary(pa.int32(), pa.string()),
     }
+    all_dtypes = copy(dtypes)
+    all_dtypes.update(additional_dtypes)
 
-    nodes_chunks = unpersist(node_path, dtype=dtypes, chunksize=100000)
+    inferred = pa.Schema.from_pandas(sample, preserve_index=False)
 
-    additional_dtypes = {
-        'type': 'category',
-        "mentioned_in": "Int32",
-        "string": "string"
-    }
-
-    if as_chunks is False:
-        return grow_with_chunks(nodes_chunks, additional_dtypes)
+    fields = []
+    for field in inferred:
+        if field.name in all_dtypes:
+            fields.append(pa.field(field.name, arrow_types[all_dtypes[field.name]]))
+        else:
+            fields.append(field)
+    return pa.schema(fields)
+
+
+def write_columnar(chunks, path, dtypes, additional_dtypes, row_group_size=100000):
+    """
+    Write graph table into parquet file.
+    :param chunks: iterable of DataFrames
+    :param path: output path
+    :param dtypes: dtypes of required columns
+    :param additional_dtypes: dtypes of optional columns
+    :param row_group_size: maximum number of rows in a row group
+    :return: Nothing
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    writer = None
+    for chunk in chunks:
+        if writer is None:
+            schema = get_parquet_schema(chunk, dtypes, additional_dtypes)
+            writer = pq.ParquetWriter(path, schema)
+        # categories differ between chunks, dictionary is created for every row group
+        categorical = [col for col, type_ in additional_dtypes.items() if type_ == "category" and col in chunk.columns]
+        chunk = chunk.astype({col: "string" for col in categorical})
+        writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False), row_group_size=row_group_size)
+
+    if writer is not None:
+        writer.close()
+
+
+def read_columnar(path, columns=None, types=None, chunksize=100000):
+    """
+    Read table stored in parquet format.
+    :param path: path to parquet file
+    :param columns: list of columns to read, reads all columns if None
+    :param types: values of column `type` to keep. When provided, filter is pushed down to the parquet reader.
+    :param chunksize: number of rows in a chunk
+    :return: generator of DataFrames
+    """
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    if types is None:
+        batches = pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns)
     else:
-        return return_chunks(nodes_chunks, additional_dtypes)
+        # filter is applied while scanning, row groups that do not contain requested types are skipped using column
+        # statistics, and only one batch is kept in memory at a time
+        batches = ds.dataset(path, format="parquet").to_batches(
+            columns=columns, filter=ds.field("type").isin(list(types)), batch_size=chunksize
+        )
+
+    last_index = 0
+    for batch in batches:
+        if batch.num_rows == 0:
+            continue
+        chunk = batch.to_pandas()
+        chunk.index = range(last_index, last_index + len(chunk))
+        last_index += len(chunk)
+        yield chunk
 
 
-def read_edges(edge_path, as_chunks=False):
-    dtypes = {
-        "id": "int32",
-        "source_node_id": "int32",
-        "target_node_id": "int32",
-    }
+def project_and_filter(chunks, columns=None, types=None):
+    for chunk in chunks:
+        if types is not None:
+            chunk = chunk[chunk["type"].isin(types)]
+        if columns is not None:
+            chunk = chunk[columns]
+        yield chunk
 
-    edge_chunks = unpersist(edge_path, dtype=dtypes, chunksize=100000)
 
-    additional_types = {
-        "type": 'category',
-        "mentioned_in": "Int32",
-        "file_id": "Int32"
-    }
+def read_graph_table(path, dtypes, additional_dtypes, as_chunks=False, columns=None, types=None):
+    if columns is not None:
+        dtypes = {col: type_ for col, type_ in dtypes.items() if col in columns}
 
-    if as_chunks:
-        return return_chunks(edge_chunks, additional_types)
+    if is_columnar(path):
+        chunks = return_chunks(read_columnar(path, columns=columns, types=types), dtypes)
+    else:
+        chunks = project_and_filter(unpersist(path, dtype=dtypes, chunksize=100000), columns=columns, types=types)
+
+    if as_chunks is False:
+        return grow_with_chunks(chunks, additional_dtypes)
     else:
-        return grow_with_chunks(edge_chunks, additional_types)
+        return return_chunks(chunks, additional_dtypes)
+
+
+def read_nodes(node_path, as_chunks=False, columns=None, types=None):
+    """
+    Read nodes of the graph.
+    :param node_path: path to nodes, supports all formats of `unpersist` and parquet
+    :param as_chunks: return generator of chunks instead of a single DataFrame
+    :param columns: list of columns to read
+    :param types: node types to keep
+    :return: DataFrame or generator of DataFrames
+    """
+    return read_graph_table(
+        node_path, node_dtypes, node_additional_dtypes, as_chunks=as_chunks, columns=columns, types=types
+    )
+
+
+def read_edges(edge_path, as_chunks=False, columns=None, types=None):
+    """
+    Read edges of the graph.
+    :param edge_path: path to edges, supports all formats of `unpersist` and parquet
+    :param as_chunks: return generator of chunks instead of a single DataFrame
+    :param columns: list of columns to read
+    :param types: edge types to keep
+    :return: DataFrame or generator of DataFrames
+    """
+    return read_graph_table(
+        edge_path, edge_dtypes, edge_additional_dtypes, as_chunks=as_chunks, columns=columns, types=types
+    )
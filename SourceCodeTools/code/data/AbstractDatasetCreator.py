@@ -7,16 +7,34 @@ from abc import abstractmethod
 from collections import defaultdict
 from copy import copy
 from functools import partial
+from multiprocessing import Pool
 from os.path import join
 
 from tqdm import tqdm
 
 from SourceCodeTools.code.annotator_utils import map_offsets
+from SourceCodeTools.code.ast.AstParseCache import AstParseCache
 from SourceCodeTools.code.common import map_columns, read_edges, read_nodes
+from SourceCodeTools.code.data.BuildManifest import BuildManifest
 from SourceCodeTools.code.data.file_utils import get_random_name, unpersist, persist, unpersist_if_present
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_types import special_mapping
 
 
+_extraction_worker_creator = None
+
+
+def _init_extraction_worker(creator):
+    global _extraction_worker_creator
+    _extraction_worker_creator = creator
+
+
+def _extract_environment_in_worker(env_path):
+    result = _extraction_worker_creator.extract_environment(env_path)
+    # parse cache counters of the worker are aggregated in the parent process
+    parse_cache = _extraction_worker_creator.parse_cache
+    return result, parse_cache.pop_counters() if parse_cache is not None else None
+
+
 class AbstractDatasetCreator:
     """
     Merges several environments indexed with Sourcetrail into a single graph.
@@ -49,13 +67,16 @@ class AbstractDatasetCreator:
 
     type_annotation_edge_types = []
 
+    # files in environment directory that are needed to reuse results of the previous extraction
+    files_required_for_reuse = []
+
     environments = None
     edge_priority = dict()
 
     def __init__(
             self, path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False
+            recompute_l2g=False, workers=1, incremental=False, parse_cache_dir=None
     ):
         """
         :param path: path to source code dataset
@@ -73,6 +94,14 @@ class AbstractDatasetCreator:
         :param remove_type_annotations: when True, removes all type annotations from the graph and stores then
             in a file called `type_annotations.bz2`
         :param recompute_l2g: when True, run merging operation again, without extrcting AST nodes and edges second time
+        :param workers: number of processes used for extracting environments. Environments are processed
+            sequentially when workers <= 1
+        :param incremental: when True, store fingerprints of environments in the output directory and reuse
+            extraction results for environments that did not change since the previous build. If the previous build
+            differs only by new environments, merged files are updated by appending new environments. Merged nodes
+            and edges are also kept before filtering, filtering passes are repeated over the extended tables.
+        :param parse_cache_dir: directory for the persistent cache of AST edges. Modules that did not change since
+            the previous build, or that appear in several packages, are parsed only once. Cache is disabled when None.
         """
         self.indexed_path = path
         self.lang = lang
@@ -85,6 +114,13 @@ class AbstractDatasetCreator:
         self.track_offsets = track_offsets
         self.remove_type_annotations = remove_type_annotations
         self.recompute_l2g = recompute_l2g
+        self.workers = workers
+        self.incremental = incremental
+        self.parse_cache = AstParseCache(parse_cache_dir) if parse_cache_dir is not None else None
+
+        self.manifest = None
+        self.unchanged_environments = set()
+        self.append_to_merged = False
 
         self.path = path
         self._prepare_environments()
@@ -103,7 +139,16 @@ class AbstractDatasetCreator:
         self.local2global_cache_filename = os.path.join(self.tmp_dir, "local2global_cache.db")
         self.local2global_cache = shelve.open(self.local2global_cache_filename)
 
+    def __getstate__(self):
+        # shelve cannot be pickled, worker copies do not need it
+        state = self.__dict__.copy()
+        state.pop("local2global_cache", None)
+        state["_is_worker_copy"] = True
+        return state
+
     def __del__(self):
+        if getattr(self, "_is_worker_copy", False):
+            return
         self.local2global_cache.close()
         shutil.rmtree(self.tmp_dir)
         # os.remove(self.local2global_cache_filename) # TODO nofile on linux, need to check
@@ -119,7 +164,10 @@ class AbstractDatasetCreator:
         temp_edges = join(os.path.dirname(edges_path), "temp_" + os.path.basename(edges_path))
 
         for ind, edges in enumerate(read_edges(edges_path, as_chunks=True)):
+            # ids are positions in the merged table and are not reassigned after removing edges, so that ids stay
+            # the same when new environments are appended during incremental builds
             edges["id"] = range(last_id, len(edges) + last_id)
+            last_id = len(edges) + last_id
 
             edge_bank = defaultdict(list)
             ids_to_remove = set()
@@ -142,9 +190,6 @@ class AbstractDatasetCreator:
                 edges["id"].apply(lambda id_: id_ not in ids_to_remove)
             ]
 
-            edges["id"] = range(last_id, len(edges) + last_id)
-            last_id = len(edges) + last_id
-
             kwargs = self.get_writing_mode(temp_edges.endswith("csv"), first_written=ind != 0)
             persist(edges, temp_edges, **kwargs)
 
@@ -182,13 +227,28 @@ class AbstractDatasetCreator:
 
     def compact_mapping_for_l2g(self, global_nodes, filename):
         if len(global_nodes) > 0:
+            if self.manifest is not None:
+                # keep ids stable between incremental builds
+                mapping = self.create_compact_mapping(
+                    global_nodes, existing_mapping=self.manifest.read_compact_mapping(filename)
+                )
+                self.manifest.write_compact_mapping(mapping, filename)
+            else:
+                mapping = self.create_compact_mapping(global_nodes)
             self.update_l2g_file(
-                mapping=self.create_compact_mapping(global_nodes), filename=filename
+                mapping=mapping, filename=filename
             )
 
     @staticmethod
-    def create_compact_mapping(node_ids):
-        return dict(zip(node_ids, range(len(node_ids))))
+    def create_compact_mapping(node_ids, existing_mapping=None):
+        if existing_mapping is None:
+            return dict(zip(node_ids, range(len(node_ids))))
+
+        mapping = copy(existing_mapping)
+        next_id = max(mapping.values()) + 1 if len(mapping) > 0 else 0
+        new_ids = sorted(id_ for id_ in node_ids if id_ not in mapping)
+        mapping.update(zip(new_ids, range(next_id, next_id + len(new_ids))))
+        return mapping
 
     def update_l2g_file(self, mapping, filename):
         for env_path in tqdm(self.environments, desc=f"Fixing {filename}"):
@@ -218,6 +278,9 @@ class AbstractDatasetCreator:
             persist(table, path)
 
     def write_type_annotation_flag(self, edges, output_dir):
+        if edges is None:
+            # extraction results are reused, the flag is already written
+            return
         if len(self.type_annotation_edge_types) > 0:
             query_str = " or ".join(f"type == '{edge_type}'" for edge_type in self.type_annotation_edge_types)
             if len(edges.query(query_str)) > 0:
@@ -226,7 +289,7 @@ class AbstractDatasetCreator:
 
     def write_local(self, dir, local2global=None, local2global_with_ast=None, **kwargs):
 
-        if not self.recompute_l2g:
+        if not self.reuse_extracted(dir):
             for var_name, var_ in kwargs.items():
                 self.persist_if_not_none(var_, dir, var_name + ".bz2")
 
@@ -270,22 +333,35 @@ class AbstractDatasetCreator:
                 kwargs["header"] = False
         return kwargs
 
+    @staticmethod
+    def get_unique_keys(table, columns):
+        # values are compared as strings, dtypes of tables read from merged files can differ from local files
+        return zip(*(table[col_name].astype("string") for col_name in columns))
+
     def create_global_file(
             self, local_file, local2global_file, columns, output_path, message, ensure_unique_with=None,
             columns_special=None
     ):
         assert output_path.endswith("json") or output_path.endswith("csv")
 
+        if self.append_to_merged:
+            environments = self.manifest_environments(self.manifest.get_new_environments())
+            first_written = os.path.isfile(output_path)
+        else:
+            environments = self.get_environments_for_merging()
+            first_written = False
+
         if ensure_unique_with is not None:
             unique_values = set()
+            if first_written:
+                for existing in unpersist(output_path, chunksize=100000):
+                    unique_values.update(self.get_unique_keys(existing, ensure_unique_with))
         else:
             unique_values = None
 
-        first_written = False
-
         for ind, env_path in tqdm(
-                enumerate(self.environments), desc=message, leave=True,
-                dynamic_ncols=True, total=len(self.environments)
+                enumerate(environments), desc=message, leave=True,
+                dynamic_ncols=True, total=len(environments)
         ):
             mapped_local = self.read_mapped_local(
                 env_path, local_file, local2global_file, columns, columns_special=columns_special
@@ -293,7 +369,7 @@ class AbstractDatasetCreator:
 
             if mapped_local is not None:
                 if unique_values is not None:
-                    unique_verify = list(zip(*(mapped_local[col_name] for col_name in ensure_unique_with)))
+                    unique_verify = list(self.get_unique_keys(mapped_local, ensure_unique_with))
 
                     mapped_local = mapped_local.loc[
                         map(lambda x: x not in unique_values, unique_verify)
@@ -349,20 +425,50 @@ class AbstractDatasetCreator:
         os.remove(nodes_path)
         os.rename(temp_nodes, nodes_path)
 
-    def join_files(self, files, local2global_filename, output_dir):
+    @staticmethod
+    def get_unpruned_path(path):
+        return join(os.path.dirname(path), "unpruned_" + os.path.basename(path))
+
+    def join_files(self, files, local2global_filename, output_dir, filtered_outputs=None):
+        """
+        Merge local files of environments.
+        :param files: names of local files, see `merging_specification`
+        :param local2global_filename: name of local2global file
+        :param output_dir: directory for merged files
+        :param filtered_outputs: paths of merged files that are filtered in place after merging. For incremental
+            builds, these files are also stored before filtering and the filtering is repeated on the copy, so that
+            the result of appending new environments is the same as for merging all environments again.
+        :return: Nothing
+        """
+        if filtered_outputs is None:
+            filtered_outputs = []
+
         for file in files:
             params = copy(self.merging_specification[file])
-            params["output_path"] = join(output_dir, params.pop("output_path"))
-            self.create_global_file(file, local2global_filename, message=f"Merging {file}", **params)
+            output_path = join(output_dir, params.pop("output_path"))
+
+            if self.manifest is not None and output_path in filtered_outputs:
+                unpruned_path = self.get_unpruned_path(output_path)
+                self.create_global_file(
+                    file, local2global_filename, output_path=unpruned_path, message=f"Merging {file}", **params
+                )
+                if os.path.isfile(unpruned_path):
+                    shutil.copyfile(unpruned_path, output_path)
+            else:
+                self.create_global_file(
+                    file, local2global_filename, output_path=output_path, message=f"Merging {file}", **params
+                )
 
     def merge_graph_without_ast(self, output_path):
-        self.join_files(self.files_for_merging, "local2global.bz2", output_path)
-
         get_path = partial(join, output_path)
 
         nodes_path = get_path("common_nodes.json")
         edges_path = get_path("common_edges.json")
 
+        self.join_files(
+            self.files_for_merging, "local2global.bz2", output_path, filtered_outputs=[nodes_path, edges_path]
+        )
+
         self.filter_orphaned_nodes(
             nodes_path,
             edges_path,
@@ -383,14 +489,16 @@ class AbstractDatasetCreator:
             )
 
     def merge_graph_with_ast(self, output_path):
-
-        self.join_files(self.files_for_merging_with_ast, "local2global_with_ast.bz2", output_path)
-
         get_path = partial(join, output_path)
 
         nodes_path = get_path("common_nodes.json")
         edges_path = get_path("common_edges.json")
 
+        self.join_files(
+            self.files_for_merging_with_ast, "local2global_with_ast.bz2", output_path,
+            filtered_outputs=[nodes_path, edges_path]
+        )
+
         if self.remove_type_annotations:
             self.filter_type_edges(nodes_path, edges_path)
 
@@ -434,6 +542,110 @@ class AbstractDatasetCreator:
     def extract_node_names(nodes, min_count):
         pass
 
+    def get_build_settings(self):
+        """
+        :return: settings that affect the content of the dataset. Stored in the build manifest.
+        """
+        return {
+            "creator": self.__class__.__name__,
+            "lang": self.lang,
+            "bpe_tokenizer": BuildManifest.compute_fingerprint([self.bpe_tokenizer]) if self.bpe_tokenizer else None,
+            "create_subword_instances": self.create_subword_instances,
+            "connect_subwords": self.connect_subwords,
+            "only_with_annotations": self.only_with_annotations,
+            "track_offsets": self.track_offsets,
+            "remove_type_annotations": self.remove_type_annotations,
+            # version of the layout of merged files, builds with a different layout cannot be extended
+            "merge_format": 2,
+        }
+
+    @abstractmethod
+    def get_environment_input_files(self, env_path):
+        """
+        :param env_path: path to environment
+        :return: list of files that determine the result of extraction for the environment
+        """
+        pass
+
+    def manifest_environments(self, env_names):
+        env_names = set(env_names)
+        return [env_path for env_path in self.get_environments_for_merging() if os.path.basename(env_path) in env_names]
+
+    def get_environments_for_merging(self):
+        """
+        :return: environments in the order they are merged. For incremental builds, the order of the previous build
+            is preserved and new environments go last, otherwise environments are merged in the order of
+            `self.environments`.
+        """
+        if self.manifest is None:
+            return self.environments
+        order = {env_name: ind for ind, env_name in enumerate(self.manifest.get_environment_order())}
+        return sorted(self.environments, key=lambda env_path: order.get(os.path.basename(env_path), len(order)))
+
+    def prepare_incremental_build(self, output_directory):
+        """
+        Compute fingerprints of environments and compare them with the previous build.
+        :param output_directory: directory where the dataset is stored
+        :return: Nothing
+        """
+        self.manifest = BuildManifest(output_directory, self.get_build_settings())
+
+        for env_path in tqdm(self.environments, desc="Computing fingerprints"):
+            self.manifest.add_environment(os.path.basename(env_path), self.get_environment_input_files(env_path))
+
+        self.unchanged_environments = set(
+            env_path for env_path in self.environments
+            if self.manifest.is_unchanged(os.path.basename(env_path)) and
+            all(os.path.isfile(join(env_path, file)) for file in self.files_required_for_reuse)
+        )
+        self.append_to_merged = self.manifest.can_append()
+
+        logging.info(
+            f"Incremental build: {len(self.manifest.get_new_environments())} new, "
+            f"{len(self.manifest.get_changed_environments())} changed, "
+            f"{len(self.manifest.get_removed_environments())} removed environments, "
+            f"{len(self.unchanged_environments)} environments reuse previous extraction"
+        )
+        if self.manifest.has_previous_build and not self.append_to_merged:
+            logging.info("Existing environments changed, merged files will be rewritten")
+
+    def reuse_extracted(self, env_path):
+        """
+        :return: True if local files for this environment should be read instead of extracting them again
+        """
+        return self.recompute_l2g or env_path in self.unchanged_environments
+
+    def extract_environments(self):
+        """
+        Run `extract_environment` for every environment. When `workers` > 1, environments are processed by a process
+        pool. Results are returned in the order of `self.environments` regardless of the number of workers, so that
+        the parent process can fold them together deterministically. Parse cache statistics for all environments are
+        logged after the last environment.
+        :return: generator of values returned by `extract_environment`
+        """
+        if self.workers is None or self.workers <= 1:
+            for env_path in self.environments:
+                yield self.extract_environment(env_path)
+        else:
+            with Pool(self.workers, initializer=_init_extraction_worker, initargs=(self,)) as pool:
+                for result, parse_cache_counters in pool.imap(_extract_environment_in_worker, self.environments):
+                    if parse_cache_counters is not None:
+                        self.parse_cache.add_counters(*parse_cache_counters)
+                    yield result
+
+        if self.parse_cache is not None:
+            self.parse_cache.log_statistics()
+
+    @abstractmethod
+    def extract_environment(self, env_path):
+        """
+        Process a single environment and write local files into the environment directory. Should not modify the
+        state of the dataset creator because it can be executed in a worker process.
+        :param env_path: path to environment
+        :return: global ids of nodes from the environment or None if the environment was skipped
+        """
+        pass
+
     @abstractmethod
     def do_extraction(self):
         pass
@@ -442,17 +654,23 @@ class AbstractDatasetCreator:
     def merge(self, output_directory):
         pass
 
+        no_ast_path, with_ast_path = self.create_output_dirs(output_directory)
+
+        if self.incremental:
+            self.prepare_incremental_build(output_directory)
+
         if self.extract:
             logging.info("Extracting...")
             self.do_extraction()
 
-        no_ast_path, with_ast_path = self.create_output_dirs(output_directory)
-
         if not self.only_with_annotations:
             self.merge_graph_without_ast(no_ast_path)
 
         self.merge_graph_with_ast(with_ast_path)
 
+        if self.manifest is not None:
+            self.manifest.save()
+
     @abstractmethod
     def visualize_func(self, nodes, edges, output_path):
         pass
\ No newline at end of file
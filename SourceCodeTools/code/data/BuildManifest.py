@@ -0,0 +1,118 @@
+import hashlib
+import os
+from os.path import join
+
+import pandas as pd
+
+from SourceCodeTools.code.data.file_utils import write_mapping_to_json, read_mapping_from_json, persist, \
+    unpersist_if_present
+
+
+class BuildManifest:
+    """
+    Stores fingerprints of environments that were used to build a dataset. Fingerprints are compared between builds
+    to find environments that did not change, so that their extraction results can be reused.
+    """
+
+    manifest_filename = "build_manifest.json"
+
+    def __init__(self, output_directory, settings):
+        """
+        :param output_directory: directory where the dataset is stored
+        :param settings: dictionary with dataset creator settings that affect the output. When settings differ from
+            the previous build, all environments are considered changed.
+        """
+        self.directory = output_directory
+        self.path = join(output_directory, self.manifest_filename)
+        self.settings = settings
+        self.fingerprints = dict()
+        self.previous_fingerprints = dict()
+        self.has_previous_build = False
+
+        if os.path.isfile(self.path):
+            previous = read_mapping_from_json(self.path)
+            if previous["settings"] == settings:
+                self.previous_fingerprints = previous["environments"]
+                self.has_previous_build = True
+
+    @staticmethod
+    def compute_fingerprint(paths, block_size=2 ** 20):
+        """
+        Compute hash over the content of several files. Missing files are part of the fingerprint as well.
+        :param paths: list of file paths
+        :param block_size: size of block for reading files
+        :return: hex digest
+        """
+        fingerprint = hashlib.md5()
+        for path in paths:
+            fingerprint.update(os.path.basename(path).encode("utf-8"))
+            if not os.path.isfile(path):
+                fingerprint.update(b"\x00missing")
+                continue
+            with open(path, "rb") as source:
+                for block in iter(lambda: source.read(block_size), b""):
+                    fingerprint.update(block)
+        return fingerprint.hexdigest()
+
+    def add_environment(self, env_name, paths):
+        self.fingerprints[env_name] = self.compute_fingerprint(paths)
+
+    def is_unchanged(self, env_name):
+        return env_name in self.previous_fingerprints and \
+               self.previous_fingerprints[env_name] == self.fingerprints.get(env_name, None)
+
+    def get_new_environments(self):
+        return [env for env in self.fingerprints if env not in self.previous_fingerprints]
+
+    def get_changed_environments(self):
+        return [
+            env for env in self.fingerprints
+            if env in self.previous_fingerprints and not self.is_unchanged(env)
+        ]
+
+    def get_environment_order(self):
+        """
+        :return: names of current environments. Environments from the previous build go first in their previous
+            order, followed by new environments, so that merged files can be extended by appending.
+        """
+        previous = [env for env in self.previous_fingerprints if env in self.fingerprints]
+        new = [env for env in self.fingerprints if env not in self.previous_fingerprints]
+        return previous + new
+
+    def get_removed_environments(self):
+        return [env for env in self.previous_fingerprints if env not in self.fingerprints]
+
+    def can_append(self):
+        """
+        :return: True if the previous build exists and the current build only adds new environments. In this case,
+            merged files can be updated by appending slices of new environments.
+        """
+        return self.has_previous_build and \
+               len(self.get_changed_environments()) == 0 and \
+               len(self.get_removed_environments()) == 0
+
+    def get_compact_mapping_path(self, l2g_filename):
+        return join(self.directory, "compact_ids_" + l2g_filename)
+
+    def read_compact_mapping(self, l2g_filename):
+        """
+        Read mapping from long global ids to compact ids that was used in the previous build.
+        :param l2g_filename: name of local2global file the mapping was created for
+        :return: dictionary or None if the previous build does not exist
+        """
+        if not self.has_previous_build:
+            return None
+        mapping = unpersist_if_present(self.get_compact_mapping_path(l2g_filename))
+        if mapping is None:
+            return None
+        return dict(zip(mapping["global_id"], mapping["compact_id"]))
+
+    def write_compact_mapping(self, mapping, l2g_filename):
+        persist(
+            pd.DataFrame({"global_id": list(mapping.keys()), "compact_id": list(mapping.values())}),
+            self.get_compact_mapping_path(l2g_filename)
+        )
+
+    def save(self):
+        environments = {env: self.fingerprints[env] for env in self.get_environment_order()}
+        write_mapping_to_json({"settings": self.settings, "environments": environments}, self.path)
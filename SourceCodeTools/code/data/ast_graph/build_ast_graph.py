@@ -1,4 +1,3 @@
-import hashlib
 import logging
 import os.path
 import shutil
@@ -12,13 +11,15 @@ from tqdm import tqdm
 
 from SourceCodeTools.cli_arguments import AstDatasetCreatorArguments
 from SourceCodeTools.code.ast import has_valid_syntax
+from SourceCodeTools.code.ast.AstParseCache import get_ast_edges
 from SourceCodeTools.code.common import read_nodes, read_edges
 from SourceCodeTools.code.data.AbstractDatasetCreator import AbstractDatasetCreator
 from SourceCodeTools.code.data.ast_graph.extract_node_names import extract_node_names
 from SourceCodeTools.code.data.ast_graph.filter_type_edges import filter_type_edges, filter_type_edges_with_chunks
 from SourceCodeTools.code.data.file_utils import persist, unpersist, unpersist_if_present
 from SourceCodeTools.code.data.ast_graph.draw_graph import visualize
-from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes
+from SourceCodeTools.code.IdentifierPool import hash128
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes, EdgeColumns
 from SourceCodeTools.code.annotator_utils import adjust_offsets2, map_offsets, to_offsets, get_cum_lens
 from SourceCodeTools.code.data.ast_graph.local2global import get_local2global
 from SourceCodeTools.nlp.string_tools import get_byte_to_char_map
@@ -161,7 +162,7 @@ class NodeIdResolver:
         self.new_nodes = []
 
     def get_node_id(self, type_name):
-        return hashlib.md5(type_name.encode('utf-8')).hexdigest()
+        return hash128(type_name)
 
     def resolve_node_id(self, node, **kwargs):
         """
@@ -247,7 +248,9 @@ class AstProcessor(AstGraphGenerator):
         edges.extend(all_edges)
 
         if as_dataframe:
-            df = pd.DataFrame(edges)
+            edge_columns = EdgeColumns()
+            edge_columns.extend(edges)
+            df = edge_columns.to_dataframe()
             df = df.astype({col: "Int32" for col in df.columns if col not in {"src", "dst", "type"}})
 
             body = "\n".join(self.source)
@@ -291,29 +294,15 @@ class AstProcessor(AstGraphGenerator):
                     except:
                         return None
 
-                if "line" in edge:
-                    edge["offsets"] = into_offset(
-                        (edge["line"], edge["end_line"], edge["col_offset"], edge["end_col_offset"])
-                    )
-                    edge.pop("line")
-                    edge.pop("end_line")
-                    edge.pop("col_offset")
-                    edge.pop("end_col_offset")
-                else:
-                    edge["offsets"] = None
-                if "var_line" in edge:
-                    edge["var_offsets"] = into_offset(
-                        (edge["var_line"], edge["var_end_line"], edge["var_col_offset"], edge["var_end_col_offset"])
-                    )
-                    edge.pop("var_line")
-                    edge.pop("var_end_line")
-                    edge.pop("var_col_offset")
-                    edge.pop("var_end_col_offset")
-
-            for edge in edges:
-                format_offsets(edge)
+                formatted = {
+                    "src": edge.src, "dst": edge.dst, "type": edge.type, "scope": edge.scope,
+                    "offsets": into_offset(edge.positions) if edge.line is not None else None
+                }
+                if edge.var_line is not None:
+                    formatted["var_offsets"] = into_offset(edge.var_positions)
+                return formatted
 
-            return edges
+            return [format_offsets(edge) for edge in edges]
 
 
 def standardize_new_edges(edges, node_resolver, mention_tokenizer):
@@ -348,14 +337,11 @@ def standardize_new_edges(edges, node_resolver, mention_tokenizer):
     return edges
 
 
-def process_code_without_index(source_code, node_resolver, mention_tokenizer, track_offsets=False):
-    try:
-        ast_processor = AstProcessor(source_code)
-    except:
-        return None, None, None
-    try: # TODO recursion error does not appear consistently. The issue is probably with library versions...
-        edges = ast_processor.get_edges(as_dataframe=False)
-    except RecursionError:
+def process_code_without_index(
+        source_code, node_resolver, mention_tokenizer, track_offsets=False, identifier_seed=None, parse_cache=None
+):
+    edges = get_ast_edges(AstProcessor, source_code, identifier_seed=identifier_seed, parse_cache=parse_cache)
+    if edges is None:
         return None, None, None
 
     if len(edges) == 0:
@@ -398,7 +384,8 @@ def process_code_without_index(source_code, node_resolver, mention_tokenizer, tr
 
 
 def build_ast_only_graph(
-        source_codes, bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False
+        source_codes, bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False,
+        parse_cache=None
 ):
     node_resolver = NodeIdResolver()
     mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
@@ -413,7 +400,8 @@ def build_ast_only_graph(
             continue
 
         edges, ast_offsets = process_code_without_index(
-            source_code, node_resolver, mention_tokenizer, track_offsets=track_offsets
+            source_code, node_resolver, mention_tokenizer, track_offsets=track_offsets,
+            identifier_seed=f"{package}:{source_code_id}", parse_cache=parse_cache
         )
 
         if ast_offsets is not None:
@@ -606,20 +594,26 @@ class AstDatasetCreator(AbstractDatasetCreator):
 
     type_annotation_edge_types = ['annotation_for', 'returned_by']
 
+    files_required_for_reuse = ["nodes_with_ast.bz2"]
+
     def __init__(
             self, path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False, chunksize=10000, keep_frac=1.0, seed=None
+            recompute_l2g=False, chunksize=10000, keep_frac=1.0, seed=None, workers=1, incremental=False,
+            parse_cache_dir=None
     ):
         self.chunksize = chunksize
         self.keep_frac = keep_frac
         self.seed = seed
         super().__init__(
             path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
-            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g
+            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g, workers, incremental,
+            parse_cache_dir
         )
 
     def __del__(self):
+        if getattr(self, "_is_worker_copy", False):
+            return
         # TODO use /tmp and add flag for overriding temp folder location
         if hasattr(self, "temp_path") and os.path.isdir(self.temp_path):
             shutil.rmtree(self.temp_path)
@@ -653,44 +647,53 @@ class AstDatasetCreator(AbstractDatasetCreator):
         logging.info("Filter type edges")
         filter_type_edges_with_chunks(nodes_path, edges_path, kwarg_fn=self.get_writing_mode)
 
-    def do_extraction(self):
-        global_nodes_with_ast = set()
+    def get_environment_input_files(self, env_path):
+        return [join(env_path, "source_code.bz2")]
 
-        for env_path in self.environments:
-            logging.info(f"Found {os.path.basename(env_path)}")
+    def extract_environment(self, env_path):
+        logging.info(f"Found {os.path.basename(env_path)}")
 
-            if not self.recompute_l2g:
+        if not self.reuse_extracted(env_path):
 
-                source_code = unpersist(join(env_path, "source_code.bz2"))
+            source_code = unpersist(join(env_path, "source_code.bz2"))
 
-                nodes_with_ast, edges_with_ast, offsets = build_ast_only_graph(
-                    zip(source_code["package"], source_code["id"], source_code["filecontent"]), self.bpe_tokenizer,
-                    create_subword_instances=self.create_subword_instances, connect_subwords=self.connect_subwords,
-                    lang=self.lang, track_offsets=self.track_offsets
-                )
+            nodes_with_ast, edges_with_ast, offsets = build_ast_only_graph(
+                zip(source_code["package"], source_code["id"], source_code["filecontent"]), self.bpe_tokenizer,
+                create_subword_instances=self.create_subword_instances, connect_subwords=self.connect_subwords,
+                lang=self.lang, track_offsets=self.track_offsets, parse_cache=self.parse_cache
+            )
 
-            else:
-                nodes_with_ast = unpersist_if_present(join(env_path, "nodes_with_ast.bz2"))
+        else:
+            nodes_with_ast = unpersist_if_present(join(env_path, "nodes_with_ast.bz2"))
 
-                if nodes_with_ast is None:
-                    continue
+            if nodes_with_ast is None:
+                return None
 
-                edges_with_ast = offsets = source_code = None
+            edges_with_ast = offsets = source_code = None
 
-            local2global_with_ast = get_local2global(
-                global_nodes=global_nodes_with_ast, local_nodes=nodes_with_ast
-            )
+        local2global_with_ast = get_local2global(
+            global_nodes=None, local_nodes=nodes_with_ast
+        )
 
-            global_nodes_with_ast.update(local2global_with_ast["global_id"])
+        self.write_type_annotation_flag(edges_with_ast, env_path)
 
-            self.write_type_annotation_flag(edges_with_ast, env_path)
+        self.write_local(
+            env_path,
+            local2global_with_ast=local2global_with_ast,
+            nodes_with_ast=nodes_with_ast, edges_with_ast=edges_with_ast, offsets=offsets,
+            filecontent_with_package=source_code,
+        )
 
-            self.write_local(
-                env_path,
-                local2global_with_ast=local2global_with_ast,
-                nodes_with_ast=nodes_with_ast, edges_with_ast=edges_with_ast, offsets=offsets,
-                filecontent_with_package=source_code,
-            )
+        return local2global_with_ast["global_id"].tolist()
+
+    def do_extraction(self):
+        global_nodes_with_ast = set()
+
+        for env_global_nodes_with_ast in self.extract_environments():
+            if env_global_nodes_with_ast is None:
+                continue
+
+            global_nodes_with_ast.update(env_global_nodes_with_ast)
 
         self.compact_mapping_for_l2g(global_nodes_with_ast, "local2global_with_ast.bz2")
 
@@ -707,14 +710,20 @@ class AstDatasetCreator(AbstractDatasetCreator):
 
     def merge(self, output_directory):
 
+        with_ast_path = self.create_output_dirs(output_directory)
+
+        if self.incremental:
+            self.prepare_incremental_build(output_directory)
+
         if self.extract:
             logging.info("Extracting...")
             self.do_extraction()
 
-        with_ast_path = self.create_output_dirs(output_directory)
-
         self.merge_graph_with_ast(with_ast_path)
 
+        if self.manifest is not None:
+            self.manifest.save()
+
     def visualize_func(self, nodes, edges, output_path):
         visualize(nodes, edges, output_path)
 
@@ -731,6 +740,7 @@ if __name__ == "__main__":
     dataset = AstDatasetCreator(
         args.source_code, args.language, args.bpe_tokenizer, args.create_subword_instances,
         args.connect_subwords, args.only_with_annotations, args.do_extraction, args.visualize, args.track_offsets,
-        args.remove_type_annotations, args.recompute_l2g, args.chunksize, args.keep_frac, args.seed
+        args.remove_type_annotations, args.recompute_l2g, args.chunksize, args.keep_frac, args.seed,
+        args.workers, args.incremental, args.parse_cache_dir
     )
     dataset.merge(args.output_directory)
\ No newline at end of file
@@ -0,0 +1,75 @@
+import gc
+import os
+import shutil
+from glob import glob
+from os.path import join
+
+import pandas as pd
+
+from SourceCodeTools.code.data.BuildManifest import BuildManifest
+from SourceCodeTools.code.data.ast_graph.build_ast_graph import AstDatasetCreator
+from SourceCodeTools.code.data.file_utils import unpersist
+
+
+def read_example_sources():
+    sources = []
+    for path in sorted(glob("res/python_testdata/example_code/*/*.py")):
+        sources.append({
+            "package": os.path.basename(os.path.dirname(path)),
+            "id": len(sources),
+            "filecontent": open(path).read()
+        })
+    return pd.DataFrame(sources)
+
+
+def build(source_path, output_path):
+    creator = AstDatasetCreator(
+        source_path, "python", None, False, False, False, do_extraction=True, track_offsets=True,
+        remove_type_annotations=True, chunksize=1, incremental=True
+    )
+    creator.merge(output_path)
+    append_to_merged = creator.append_to_merged
+    del creator
+    gc.collect()
+    return append_to_merged
+
+
+def read_merged(output_path):
+    return {
+        os.path.basename(path): unpersist(path)
+        for path in sorted(glob(join(output_path, "with_ast", "*.json")))
+    }
+
+
+def test_incremental_build_matches_full_rebuild(tmp_path, monkeypatch):
+    sources = read_example_sources()
+    assert len(sources) > 1
+
+    source_path = str(tmp_path / "source_code.csv")
+    incremental_output = str(tmp_path / "incremental")
+    full_output = str(tmp_path / "full")
+
+    sources.iloc[:-1].to_csv(source_path, index=False)
+    assert build(source_path, incremental_output) is False
+    previous = read_merged(incremental_output)
+    shutil.copytree(incremental_output, full_output)
+
+    sources.to_csv(source_path, index=False)
+    assert build(source_path, incremental_output) is True
+
+    # same build, but merged files are created from all environments
+    monkeypatch.setattr(BuildManifest, "can_append", lambda self: False)
+    assert build(source_path, full_output) is False
+
+    incremental = read_merged(incremental_output)
+    full = read_merged(full_output)
+
+    assert incremental.keys() == full.keys()
+    for name in full:
+        pd.testing.assert_frame_equal(incremental[name], full[name], obj=name)
+
+    # edges from the previous build keep their ids
+    previous_edges = previous["common_edges.json"].set_index("id")
+    current_edges = incremental["common_edges.json"].set_index("id")
+    assert len(current_edges) > len(previous_edges)
+    pd.testing.assert_frame_equal(current_edges.loc[previous_edges.index], previous_edges)
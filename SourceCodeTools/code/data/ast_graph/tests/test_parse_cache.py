@@ -0,0 +1,37 @@
+import gc
+import logging
+
+from SourceCodeTools.code.data.ast_graph.build_ast_graph import AstDatasetCreator
+from SourceCodeTools.code.data.ast_graph.tests.test_incremental_build import read_example_sources
+
+
+def build(source_path, output_path, parse_cache_dir, workers):
+    creator = AstDatasetCreator(
+        source_path, "python", None, False, False, False, do_extraction=True, track_offsets=True,
+        remove_type_annotations=True, chunksize=1, workers=workers, parse_cache_dir=parse_cache_dir
+    )
+    creator.merge(output_path)
+    del creator
+    gc.collect()
+
+
+def get_cache_messages(caplog):
+    return [record.getMessage() for record in caplog.records if record.getMessage().startswith("AST parse cache")]
+
+
+def test_parse_cache_statistics_are_aggregated_from_workers(tmp_path, caplog):
+    sources = read_example_sources()
+    source_path = str(tmp_path / "source_code.csv")
+    parse_cache_dir = str(tmp_path / "parse_cache")
+    sources.to_csv(source_path, index=False)
+
+    with caplog.at_level(logging.INFO):
+        build(source_path, str(tmp_path / "first"), parse_cache_dir, workers=2)
+        first_messages = get_cache_messages(caplog)
+        caplog.clear()
+        build(source_path, str(tmp_path / "second"), parse_cache_dir, workers=2)
+        second_messages = get_cache_messages(caplog)
+
+    # a single message with counters from all workers for every build
+    assert first_messages == [f"AST parse cache: 0 hits, {len(sources)} misses (0.0% hit rate)"]
+    assert second_messages == [f"AST parse cache: {len(sources)} hits, 0 misses (100.0% hit rate)"]
@@ -3,14 +3,19 @@
 from collections import Counter
 from typing import List, Optional
 
+import hashlib
 import pandas
 import numpy
 import pickle
 
 from os.path import join
 
+from SourceCodeTools.code.data.BuildManifest import BuildManifest
 from SourceCodeTools.code.data.dataset.SubwordMasker import SubwordMasker, NodeNameMasker, NodeClfMasker
-from SourceCodeTools.code.data.dataset.reader import load_data
+from SourceCodeTools.code.common import read_edges
+from SourceCodeTools.code.data.dataset.reader import load_data, get_graph_table_path
+from SourceCodeTools.code.data.dataset.EdgeStore import EdgeStore
+from SourceCodeTools.code.data.dataset.DatasetCache import DatasetCache
 from SourceCodeTools.code.data.file_utils import *
 from SourceCodeTools.code.ast.python_ast import PythonSharedNodes
 from SourceCodeTools.nlp.embed.bpe import make_tokenizer, load_bpe_model
@@ -19,6 +24,9 @@ from SourceCodeTools.code.data.sourcetrail.sourcetrail_types import node_types
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_extract_node_names import extract_node_names
 
 
+DATASET_CACHE_REFERENCE = "dataset_cache.json"
+
+
 def filter_dst_by_freq(elements, freq=1):
     counter = Counter(elements["dst"])
     allowed = {item for item, count in counter.items() if count >= freq}
@@ -96,8 +104,8 @@ class SourceGraphDataset:
 
         self.use_ns_groups = use_ns_groups
 
-        nodes_path = join(data_path, "common_nodes.json.bz2")
-        edges_path = join(data_path, "common_edges.json.bz2")
+        nodes_path = get_graph_table_path(data_path, "common_nodes")
+        edges_path = get_graph_table_path(data_path, "common_edges")
 
         self.nodes, self.edges = load_data(nodes_path, edges_path)
 
@@ -387,86 +395,93 @@ class SourceGraphDataset:
 
     @property
     def typed_node_counts(self):
+        return {ntype: count for ntype, count in self.nodes['type'].value_counts(sort=False).items() if count > 0}
 
-        typed_node_counts = dict()
+    @staticmethod
+    def _split_edges_by_signature(nodes, edges):
+        """
+        Split edges by signature (src_type, edge_type, dst_type) and map node ids to typed ids. Node types and
+        edge types are converted into integer codes, edges are grouped with a single stable sort over the combined
+        signature code, and the arrays for every signature are slices of the sorted arrays.
+        :param nodes: node table with columns `id`, `type`, and `typed_id`
+        :param edges: edge table with columns `src`, `dst`, and `type`
+        :return: dictionary {(src_type, edge_type, dst_type): (src_typed_ids, dst_typed_ids)} with int32 arrays
+        """
+        node_index = pandas.Index(nodes['id'].to_numpy())
+        node_type_codes, node_type_names = pandas.factorize(nodes['type'])
+        typed_ids = nodes['typed_id'].to_numpy(dtype=numpy.int32)
+
+        src_pos = node_index.get_indexer(edges['src'].to_numpy())
+        dst_pos = node_index.get_indexer(edges['dst'].to_numpy())
+        assert (src_pos != -1).all() and (dst_pos != -1).all(), "Some edges refer to nodes that do not exist"
+
+        edge_type_codes, edge_type_names = pandas.factorize(edges['type'])
+
+        num_node_types = len(node_type_names)
+        num_edge_types = len(edge_type_names)
+
+        signature_codes = node_type_codes[src_pos].astype(numpy.int64)
+        signature_codes *= num_edge_types
+        signature_codes += edge_type_codes
+        signature_codes *= num_node_types
+        signature_codes += node_type_codes[dst_pos]
+
+        # stable sort keeps the original order of edges within every signature
+        order = numpy.argsort(signature_codes, kind="stable")
+        unique_codes, starts = numpy.unique(signature_codes[order], return_index=True)
+        ends = numpy.append(starts[1:], len(order))
+
+        src_typed = typed_ids[src_pos[order]]
+        dst_typed = typed_ids[dst_pos[order]]
+
+        typed_edges = {}
+        for code, start, end in zip(unique_codes, starts, ends):
+            src_type_code, code = divmod(int(code), num_edge_types * num_node_types)
+            edge_type_code, dst_type_code = divmod(code, num_node_types)
+            signature = (
+                node_type_names[src_type_code], edge_type_names[edge_type_code], node_type_names[dst_type_code]
+            )
+            typed_edges[signature] = (src_typed[start: end], dst_typed[start: end])
 
-        unique_types = self.nodes['type'].unique()
+        return typed_edges
 
-        # node_types = dict(zip(self.node_types['int_type'], self.node_types['str_type']))
+    @staticmethod
+    def _split_nodes_by_type(nodes):
+        """
+        Collect node data arrays for every node type. Arrays are ordered by typed id.
+        :param nodes: node table with columns `id`, `type`, `typed_id`, and split masks
+        :return: dictionary {node_type: {field_name: array}}
+        """
+        nodes = nodes[['type', 'typed_id', 'train_mask', 'test_mask', 'val_mask', 'id']].sort_values(
+            'typed_id', kind="stable"
+        )
 
-        for type_id, type in enumerate(unique_types):
-            nodes_of_type = len(self.nodes.query(f"type == '{type}'"))
-            # typed_node_counts[node_types[type]] = nodes_of_type
-            typed_node_counts[type] = nodes_of_type
+        node_data = {}
+        for ntype, ntype_nodes in nodes.groupby('type', sort=False, observed=True):
+            node_data[ntype] = {
+                'train_mask': ntype_nodes['train_mask'].to_numpy(dtype=numpy.bool_),
+                'test_mask': ntype_nodes['test_mask'].to_numpy(dtype=numpy.bool_),
+                'val_mask': ntype_nodes['val_mask'].to_numpy(dtype=numpy.bool_),
+                'typed_id': ntype_nodes['typed_id'].to_numpy(dtype=numpy.int64),
+                'original_id': ntype_nodes['id'].to_numpy(dtype=numpy.int64),
+            }
 
-        return typed_node_counts
+        return node_data
 
     def _create_hetero_graph(self):
 
-        nodes = self.nodes.copy()
-        edges = self.edges.copy()
-        edges = self._add_node_types_to_edges(nodes, edges)
-
-        typed_node_id = dict(zip(nodes['id'], nodes['typed_id']))
-
-        possible_edge_signatures = edges[['src_type', 'type', 'dst_type']].drop_duplicates(
-            ['src_type', 'type', 'dst_type']
-        )
-
-        # node_types = dict(zip(self.node_types['int_type'], self.node_types['str_type']))
-        # edge_types = dict(zip(self.edge_types['int_type'], self.edge_types['str_type']))
-
-        # typed_subgraphs is a dictionary with subset_signature as a key,
-        # the dictionary stores directed edge lists
-        typed_subgraphs = {}
-
-        # node_mapper = lambda old_id: typed_node_id[old_id]
-        # for src_type, type, dst_type, src, dst in edges[['src_type', 'type', 'dst_type', "src", "dst"]].values:
-        #     subgraph_signature = (src_type, type, dst_type)
-        #     if subgraph_signature in typed_subgraphs:
-        #         typed_subgraphs[subgraph_signature].add((node_mapper(src), node_mapper(dst)))
-        #     else:
-        #         typed_subgraphs[subgraph_signature] = {node_mapper(src), node_mapper(dst)}
-
-        for ind, row in possible_edge_signatures.iterrows():  #
-            # subgraph_signature = (node_types[row['src_type']], edge_types[row['type']], node_types[row['dst_type']])
-            subgraph_signature = (row['src_type'], row['type'], row['dst_type'])
-
-            subset = edges.query(
-                f"src_type == '{row['src_type']}' and type == '{row['type']}' and dst_type == '{row['dst_type']}'"
-            )
-
-            typed_subgraphs[subgraph_signature] = list(
-                zip(
-                    subset['src'].map(lambda old_id: typed_node_id[old_id]),
-                    subset['dst'].map(lambda old_id: typed_node_id[old_id])
-                )
-            )
+        # typed_edges is a dictionary with subset_signature as a key,
+        # the dictionary stores arrays of source and destination typed ids
+        typed_edges = self._split_edges_by_signature(self.nodes, self.edges)
 
         logging.info(
-            f"Unique triplet types in the graph: {len(typed_subgraphs.keys())}"
+            f"Unique triplet types in the graph: {len(typed_edges.keys())}"
         )
 
-        import dgl, torch
-        self.g = dgl.heterograph(typed_subgraphs, self.typed_node_counts)
+        node_data = self._split_nodes_by_type(self.nodes)
 
-        # node_types = dict(zip(self.node_types['str_type'], self.node_types['int_type']))
-
-        for ntype in self.g.ntypes:
-            # int_type = node_types[ntype]
-
-            node_data = self.nodes.query(
-                f"type == '{ntype}'"
-            )[[
-                'typed_id', 'train_mask', 'test_mask', 'val_mask', 'id' # 'compact_label',
-            ]].sort_values('typed_id')
-
-            self.g.nodes[ntype].data['train_mask'] = torch.tensor(node_data['train_mask'].values, dtype=torch.bool)
-            self.g.nodes[ntype].data['test_mask'] = torch.tensor(node_data['test_mask'].values, dtype=torch.bool)
-            self.g.nodes[ntype].data['val_mask'] = torch.tensor(node_data['val_mask'].values, dtype=torch.bool)
-            # self.g.nodes[ntype].data['labels'] = torch.tensor(node_data['compact_label'].values, dtype=torch.int64)
-            self.g.nodes[ntype].data['typed_id'] = torch.tensor(node_data['typed_id'].values, dtype=torch.int64)
-            self.g.nodes[ntype].data['original_id'] = torch.tensor(node_data['id'].values, dtype=torch.int64)
+        # int32 arrays are passed to DGL without conversion
+        self.g = EdgeStore(typed_edges, self.typed_node_counts, node_data).to_dgl()
 
     @staticmethod
     def _assess_need_for_self_loops(nodes, edges):
@@ -804,17 +819,13 @@ class SourceGraphDataset:
 
     def load_global_edges_prediction(self):
 
-        nodes_path = join(self.data_path, "common_nodes.json.bz2")
-        edges_path = join(self.data_path, "common_edges.json.bz2")
-
-        _, edges = load_data(nodes_path, edges_path)
+        edges_path = get_graph_table_path(self.data_path, "common_edges")
 
         global_edges = self.get_global_edges()
         global_edges = global_edges - {"defines", "defined_in"}  # these edges are already in AST?
         global_edges.add("global_mention")
 
-        is_global = lambda type: type in global_edges
-        edges = edges.query("type.map(@is_global)", local_dict={"is_global": is_global})
+        edges = read_edges(edges_path, columns=["source_node_id", "target_node_id", "type"], types=global_edges)
 
         edges.rename(
             {
@@ -827,10 +838,9 @@ class SourceGraphDataset:
 
     def load_edge_prediction(self):
 
-        nodes_path = join(self.data_path, "common_nodes.json.bz2")
-        edges_path = join(self.data_path, "common_edges.json.bz2")
+        edges_path = get_graph_table_path(self.data_path, "common_edges")
 
-        _, edges = load_data(nodes_path, edges_path)
+        edges = read_edges(edges_path, columns=["source_node_id", "target_node_id", "type"])
 
         edges.rename(
             {
@@ -973,25 +983,48 @@ class SourceGraphDataset:
 
         return embs_init
 
+    def _get_or_create_masker(self, name, create_fn):
+        """
+        Maskers of datasets loaded from a dataset cache are stored in the cache entry and reused by later runs.
+        """
+        entry_path = getattr(self, "cache_entry_path", None)
+        if entry_path is None:
+            return create_fn()
+        return DatasetCache.get_or_create_masker(entry_path, name, create_fn)
+
+    @staticmethod
+    def _node_name_masker_name(prefix, node2name, tokenizer_path):
+        description = f"{pandas.util.hash_pandas_object(node2name, index=False).sum()}_" \
+                      f"{BuildManifest.compute_fingerprint([tokenizer_path])}"
+        return f"{prefix}_{hashlib.md5(description.encode('utf-8')).hexdigest()}"
+
     def create_subword_masker(self):
         """
         :return: SubwordMasker for all nodes that have subwords. Suitable for token prediction objective.
         """
-        return SubwordMasker(self.nodes, self.edges)
+        return self._get_or_create_masker("subword", lambda: SubwordMasker(self.nodes, self.edges))
 
     def create_variable_name_masker(self, tokenizer_path):
         """
         :param tokenizer_path: path to bpe tokenizer
         :return: SubwordMasker for function nodes. Suitable for variable name use prediction objective
         """
-        return NodeNameMasker(self.nodes, self.edges, self.load_var_use(), tokenizer_path)
+        var_use = self.load_var_use()
+        return self._get_or_create_masker(
+            self._node_name_masker_name("variable_name", var_use, tokenizer_path),
+            lambda: NodeNameMasker(self.nodes, self.edges, var_use, tokenizer_path)
+        )
 
     def create_node_name_masker(self, tokenizer_path):
         """
         :param tokenizer_path: path to bpe tokenizer
         :return: SubwordMasker for function nodes. Suitable for node name use prediction objective
         """
-        return NodeNameMasker(self.nodes, self.edges, self.load_node_names(), tokenizer_path)
+        node_names = self.load_node_names()
+        return self._get_or_create_masker(
+            self._node_name_masker_name("node_name", node_names, tokenizer_path),
+            lambda: NodeNameMasker(self.nodes, self.edges, node_names, tokenizer_path)
+        )
 
     def create_node_clf_masker(self):
         """
@@ -1033,24 +1066,75 @@ class SourceGraphDataset:
 
         return subgraph_mapping
 
+    def __getstate__(self):
+        # graph and tables are large and are stored separately, see `save`
+        state = self.__dict__.copy()
+        for name in ["g", "nodes", "edges", "node_id_to_global_id"]:
+            state[name] = None
+        return state
+
+    def save(self, path):
+        """
+        Store dataset state. Graph structure is stored in `EdgeStore` format and node and edge tables are stored
+        in parquet format next to the pickled dataset.
+        :param path: path to the pickled dataset
+        :return: Nothing
+        """
+        location = os.path.dirname(path)
+        EdgeStore.from_dgl(self.g).save(join(location, "edge_store"))
+        self.nodes.to_parquet(join(location, "dataset_nodes.parquet"))
+        self.edges.to_parquet(join(location, "dataset_edges.parquet"))
+        pickle.dump(self, open(path, "wb"))
+
     @classmethod
     def load(cls, path, args):
+        location = os.path.dirname(path)
         dataset = pickle.load(open(path, "rb"))
         dataset.data_path = args["data_path"]
         if dataset.tokenizer_path is not None:
             dataset.tokenizer_path = args["tokenizer"]
+        if dataset.g is None:
+            dataset.g = EdgeStore.load(join(location, "edge_store")).to_dgl()
+        if dataset.nodes is None:
+            dataset.nodes = pandas.read_parquet(join(location, "dataset_nodes.parquet"))
+            dataset.edges = pandas.read_parquet(join(location, "dataset_edges.parquet"))
+            dataset.node_id_to_global_id = dict(zip(dataset.nodes["id"], dataset.nodes["global_graph_id"]))
         return dataset
 
 
-def read_or_create_gnn_dataset(args, model_base, force_new=False, restore_state=False):
+def read_or_create_gnn_dataset(args, model_base, force_new=False, restore_state=False, dataset_cache=None):
+    """
+    Create dataset or restore it from the model directory.
+    :param args: dictionary with arguments of `SourceGraphDataset`
+    :param model_base: model directory
+    :param force_new: create the dataset even when `restore_state` is set
+    :param restore_state: load the dataset that was stored in the model directory
+    :param dataset_cache: directory with preprocessed datasets shared between runs. When provided, the dataset is
+        loaded from the cache when available, and the model directory only stores a reference to the cache entry.
+    :return: SourceGraphDataset
+    """
+    cache_reference_path = join(model_base, DATASET_CACHE_REFERENCE)
+
     if restore_state and not force_new:
         # i'm not happy with this behaviour that differs based on the flag status
-        dataset = SourceGraphDataset.load(join(model_base, "dataset.pkl"), args)
+        if os.path.isfile(cache_reference_path):
+            entry_path = read_mapping_from_json(cache_reference_path)["entry_path"]
+            dataset = DatasetCache.load_entry(entry_path)
+            dataset.data_path = args["data_path"]
+            if dataset.tokenizer_path is not None:
+                dataset.tokenizer_path = args["tokenizer_path"]
+        else:
+            dataset = SourceGraphDataset.load(join(model_base, "dataset.pkl"), args)
+    elif dataset_cache is not None:
+        dataset, entry_path = DatasetCache(dataset_cache).get_or_create(
+            args, lambda dataset_args: SourceGraphDataset(**dataset_args)
+        )
+        write_mapping_to_json({"entry_path": os.path.abspath(entry_path)}, cache_reference_path)
     else:
         dataset = SourceGraphDataset(**args)
 
         # save dataset state for recovery
-        pickle.dump(dataset, open(join(model_base, "dataset.pkl"), "wb"))
+        dataset.save(join(model_base, "dataset.pkl"))
 
     return dataset
 
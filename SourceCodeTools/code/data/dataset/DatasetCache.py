@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import os
+import pickle
+import shutil
+from os.path import join
+
+import pandas as pd
+
+from SourceCodeTools.code.data.dataset.SubwordMasker import SubwordMasker
+from SourceCodeTools.code.data.dataset.reader import get_graph_table_path
+
+
+class DatasetCache:
+    """
+    Directory with preprocessed graph datasets that can be shared between training runs. Every entry is addressed
+    by a key computed from the size and modification time of graph tables and the arguments of
+    `SourceGraphDataset`. An entry stores the graph in DGL binary format, node and edge tables in parquet format,
+    and the remaining dataset state as a small pickle.
+    """
+
+    # increase when the layout of cache entries or graph construction changes
+    version = 1
+
+    graph_filename = "graph.bin"
+    nodes_filename = "nodes.parquet"
+    edges_filename = "edges.parquet"
+    state_filename = "state.pkl"
+    index_filename = "cache_entry.json"
+    maskers_dirname = "maskers"
+
+    def __init__(self, cache_directory):
+        self.directory = cache_directory
+        if not os.path.isdir(cache_directory):
+            os.makedirs(cache_directory)
+
+    @staticmethod
+    def describe_file(path):
+        """
+        Describe file with its size and modification time. Reading the content of graph tables would take about
+        as long as loading them, tables are replaced as a whole when a dataset is rebuilt.
+        :param path: path to file
+        :return: dictionary or None if the file does not exist
+        """
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+    @classmethod
+    def compute_key(cls, args):
+        """
+        Compute cache key for dataset arguments.
+        :param args: dictionary with arguments of `SourceGraphDataset`
+        :return: hex digest
+        """
+        data_path = args["data_path"]
+        table_paths = [
+            get_graph_table_path(data_path, "common_nodes"),
+            get_graph_table_path(data_path, "common_edges"),
+        ]
+        if args.get("restricted_id_pool", None) is not None:
+            table_paths.append(args["restricted_id_pool"])
+
+        settings = {key: value for key, value in args.items() if key != "data_path"}
+        description = {
+            "version": cls.version,
+            "data_path": os.path.abspath(data_path),
+            "tables": [cls.describe_file(path) for path in table_paths],
+            "settings": settings,
+        }
+
+        return hashlib.md5(json.dumps(description, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get_entry_path(self, key):
+        return join(self.directory, key)
+
+    def contains(self, key):
+        return os.path.isfile(join(self.get_entry_path(key), self.index_filename))
+
+    def save(self, key, dataset):
+        """
+        Store dataset in the cache. Entry is written into a temporary directory first and renamed when complete,
+        so that concurrent runs never see partially written entries.
+        :param key: cache key
+        :param dataset: instance of `SourceGraphDataset`
+        :return: path to the cache entry
+        """
+        import dgl
+
+        entry_path = self.get_entry_path(key)
+        if self.contains(key):
+            return entry_path
+
+        tmp_path = entry_path + f".tmp{os.getpid()}"
+        if os.path.isdir(tmp_path):
+            shutil.rmtree(tmp_path)
+        os.mkdir(tmp_path)
+
+        dgl.save_graphs(join(tmp_path, self.graph_filename), [dataset.g])
+        # index is stored because it is used for sampling
+        dataset.nodes.to_parquet(join(tmp_path, self.nodes_filename))
+        dataset.edges.to_parquet(join(tmp_path, self.edges_filename))
+
+        # graph and tables are excluded from the pickle by `SourceGraphDataset.__getstate__`
+        pickle.dump(dataset, open(join(tmp_path, self.state_filename), "wb"))
+
+        with open(join(tmp_path, self.index_filename), "w") as sink:
+            sink.write(json.dumps({"version": self.version, "key": key}, indent=4))
+
+        try:
+            os.rename(tmp_path, entry_path)
+        except OSError:
+            # another run has stored the same entry
+            shutil.rmtree(tmp_path)
+
+        return entry_path
+
+    @classmethod
+    def load_entry(cls, entry_path):
+        """
+        Load dataset from cache entry.
+        :param entry_path: path to the cache entry
+        :return: instance of `SourceGraphDataset`
+        """
+        import dgl
+
+        dataset = pickle.load(open(join(entry_path, cls.state_filename), "rb"))
+        graphs, _ = dgl.load_graphs(join(entry_path, cls.graph_filename))
+        dataset.g = graphs[0]
+        dataset.nodes = pd.read_parquet(join(entry_path, cls.nodes_filename))
+        dataset.edges = pd.read_parquet(join(entry_path, cls.edges_filename))
+        dataset.node_id_to_global_id = dict(zip(dataset.nodes["id"], dataset.nodes["global_graph_id"]))
+        dataset.cache_entry_path = entry_path
+        return dataset
+
+    def load(self, key):
+        return self.load_entry(self.get_entry_path(key))
+
+    def get_or_create(self, args, create_fn):
+        """
+        Load dataset from the cache or create and store it.
+        :param args: dictionary with arguments of `SourceGraphDataset`
+        :param create_fn: function that creates dataset from `args`
+        :return: dataset and path to the cache entry
+        """
+        key = self.compute_key(args)
+        if self.contains(key):
+            logging.info(f"Loading dataset from cache {self.get_entry_path(key)}")
+            return self.load(key), self.get_entry_path(key)
+
+        dataset = create_fn(args)
+        entry_path = self.save(key, dataset)
+        dataset.cache_entry_path = entry_path
+        logging.info(f"Stored dataset in cache {entry_path}")
+        return dataset, entry_path
+
+    @classmethod
+    def get_or_create_masker(cls, entry_path, name, create_fn):
+        """
+        Load masker stored together with a cache entry or create and store it.
+        :param entry_path: path to the cache entry
+        :param name: masker name, should identify all inputs of the masker except for the dataset
+        :param create_fn: function without arguments that creates masker
+        :return: instance of `SubwordMasker`
+        """
+        maskers_path = join(entry_path, cls.maskers_dirname)
+        if not os.path.isdir(maskers_path):
+            os.makedirs(maskers_path, exist_ok=True)
+
+        masker_path = join(maskers_path, f"{name}.pkl")
+        if os.path.isfile(masker_path):
+            logging.info(f"Loading masker from cache {masker_path}")
+            return SubwordMasker.load(masker_path)
+
+        masker = create_fn()
+        masker.save(masker_path)
+        return masker
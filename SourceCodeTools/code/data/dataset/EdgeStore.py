@@ -0,0 +1,133 @@
+import json
+import os
+from os.path import join
+
+import numpy
+
+
+class EdgeStore:
+    """
+    Compact storage for the structure of a heterogeneous graph. Edges of every signature
+    (src_type, edge_type, dst_type) are stored as a pair of int32 arrays with typed node ids. Node data is stored as
+    one array per node type and field. Arrays are written in `npy` format and memory-mapped when loaded, so that
+    a graph can be opened without parsing the original tables.
+    """
+
+    index_filename = "edge_store.json"
+
+    def __init__(self, typed_edges, num_nodes, node_data=None):
+        """
+        :param typed_edges: dictionary {(src_type, edge_type, dst_type): (src_array, dst_array)}
+        :param num_nodes: dictionary {node_type: number of nodes}
+        :param node_data: dictionary {node_type: {field_name: array}}
+        """
+        self.typed_edges = typed_edges
+        self.num_nodes = num_nodes
+        self.node_data = node_data if node_data is not None else dict()
+
+    @property
+    def num_edges(self):
+        return sum(len(src) for src, _ in self.typed_edges.values())
+
+    @classmethod
+    def from_dgl(cls, g):
+        typed_edges = dict()
+        for signature in g.canonical_etypes:
+            src, dst = g.edges(etype=signature)
+            typed_edges[signature] = (src.numpy().astype(numpy.int32), dst.numpy().astype(numpy.int32))
+
+        num_nodes = {ntype: g.number_of_nodes(ntype) for ntype in g.ntypes}
+
+        node_data = {
+            ntype: {field: data.numpy() for field, data in g.nodes[ntype].data.items()}
+            for ntype in g.ntypes
+        }
+
+        return cls(typed_edges, num_nodes, node_data)
+
+    def save(self, path):
+        if not os.path.isdir(path):
+            os.mkdir(path)
+
+        signatures = []
+        for ind, (signature, (src, dst)) in enumerate(self.typed_edges.items()):
+            numpy.save(join(path, f"edges_{ind}_src.npy"), numpy.asarray(src, dtype=numpy.int32))
+            numpy.save(join(path, f"edges_{ind}_dst.npy"), numpy.asarray(dst, dtype=numpy.int32))
+            signatures.append(list(signature))
+
+        node_fields = dict()
+        for ind, (ntype, fields) in enumerate(self.node_data.items()):
+            node_fields[ntype] = {"ind": ind, "fields": list(fields.keys())}
+            for field, data in fields.items():
+                numpy.save(join(path, f"nodes_{ind}_{field}.npy"), data)
+
+        index = {
+            "signatures": signatures,
+            "num_nodes": self.num_nodes,
+            "node_fields": node_fields
+        }
+
+        with open(join(path, self.index_filename), "w") as sink:
+            sink.write(json.dumps(index, indent=4))
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        :param path: directory with the edge store
+        :param mmap: when True, arrays are memory-mapped in copy-on-write mode instead of being read into memory
+        :return: EdgeStore
+        """
+        mmap_mode = "c" if mmap else None
+
+        with open(join(path, cls.index_filename), "r") as source:
+            index = json.loads(source.read())
+
+        typed_edges = dict()
+        for ind, signature in enumerate(index["signatures"]):
+            typed_edges[tuple(signature)] = (
+                numpy.load(join(path, f"edges_{ind}_src.npy"), mmap_mode=mmap_mode),
+                numpy.load(join(path, f"edges_{ind}_dst.npy"), mmap_mode=mmap_mode)
+            )
+
+        node_data = dict()
+        for ntype, fields in index["node_fields"].items():
+            node_data[ntype] = {
+                field: numpy.load(join(path, f"nodes_{fields['ind']}_{field}.npy"), mmap_mode=mmap_mode)
+                for field in fields["fields"]
+            }
+
+        return cls(typed_edges, index["num_nodes"], node_data)
+
+    @staticmethod
+    def exists(path):
+        return os.path.isfile(join(path, EdgeStore.index_filename))
+
+    def to_dgl(self, idtype=None):
+        """
+        Create DGL heterograph directly from stored arrays.
+        :param idtype: id type of the graph, int32 by default. With int32, tensors share memory with the stored
+            (possibly memory-mapped) arrays. With torch.int64, edge arrays are converted, which creates a copy.
+        :return: DGL heterograph
+        """
+        import dgl
+        import torch
+
+        if idtype is None:
+            idtype = torch.int32
+        np_idtype = numpy.int32 if idtype == torch.int32 else numpy.int64
+
+        data_dict = {
+            signature: (
+                torch.from_numpy(numpy.asarray(src).astype(np_idtype, copy=False)),
+                torch.from_numpy(numpy.asarray(dst).astype(np_idtype, copy=False))
+            )
+            for signature, (src, dst) in self.typed_edges.items()
+        }
+
+        g = dgl.heterograph(data_dict, self.num_nodes, idtype=idtype)
+
+        for ntype, fields in self.node_data.items():
+            for field, data in fields.items():
+                g.nodes[ntype].data[field] = torch.from_numpy(numpy.asarray(data))
+
+        return g
@@ -1,15 +1,21 @@
+import os
+import pickle
+
+import numpy as np
 import pandas as pd
+import torch
 
 
 class SubwordMasker:
     """
-    Masker that tells which node ids are subwords for given nodes.
+    Masker that tells which node ids are subwords for given nodes. For every node type, the lookup is stored in CSR
+    format: `indptr` gives the range of entries for every typed id, and entries store type codes and typed ids
+    of masked nodes.
     """
     def __init__(self, nodes: pd.DataFrame, edges: pd.DataFrame, **kwargs):
         self.instantiate(nodes, edges, **kwargs)
 
     def instantiate(self, nodes, edges, **kwargs):
-        edges = edges.copy()
         if "type_backup" in edges.columns:
             type_col = "type_backup"
         elif "type" in edges.columns:
@@ -17,48 +23,104 @@ class SubwordMasker:
         else:
             raise Exception("Column `type` or `backup_type` not found")
 
-        edges = edges.query(f"{type_col} == 'subword_'")
-        self.lookup = dict()
+        edges = edges[edges[type_col] == "subword_"]
+        self._create_lookup(nodes, key_ids=edges["dst"].to_numpy(), value_ids=edges["src"].to_numpy())
+
+    def _create_lookup(self, nodes, key_ids, value_ids):
+        """
+        Create CSR lookup from pairs of node ids.
+        :param nodes: node table with columns `id`, `type`, and `typed_id`
+        :param key_ids: ids of nodes passed to `get_mask`
+        :param value_ids: ids of nodes that should be masked for corresponding keys
+        """
+        node_type_codes, node_types = pd.factorize(nodes["type"])
+        typed_ids = nodes["typed_id"].to_numpy(dtype=np.int64)
+        self.node_types = list(node_types)
+
+        type_sizes = np.zeros(len(node_types), dtype=np.int64)
+        np.maximum.at(type_sizes, node_type_codes, typed_ids + 1)
+
+        node_index = pd.Index(nodes["id"])
+        key_pos = node_index.get_indexer(key_ids)
+        value_pos = node_index.get_indexer(value_ids)
+        found = (key_pos != -1) & (value_pos != -1)
+        key_pos, value_pos = key_pos[found], value_pos[found]
 
-        node2type = dict(zip(nodes["id"], nodes["type"]))
-        node2typed_id = dict(zip(nodes["id"], nodes["typed_id"]))
-        edges.eval("dst_type = dst.map(@node2type.get)", local_dict={"node2type": node2type}, inplace=True)
-        edges.eval("dst_typed_id = dst.map(@node2typed_id.get)", local_dict={"node2typed_id": node2typed_id}, inplace=True)
-        edges.eval("src_type = src.map(@node2type.get)", local_dict={"node2type": node2type}, inplace=True)
-        edges.eval("src_typed_id = src.map(@node2typed_id.get)", local_dict={"node2typed_id": node2typed_id},
-                   inplace=True)
-
-        for node_type, dst_id, src_type, src_typed_id in edges[["dst_type", "dst_typed_id", "src_type", "src_typed_id"]].values:
-            key = (node_type, dst_id)
-            if key in self.lookup:
-                self.lookup[key].append((src_type, src_typed_id))
-            else:
-                self.lookup[key] = [(src_type, src_typed_id)]
+        key_types, key_typed_ids = node_type_codes[key_pos], typed_ids[key_pos]
+        value_types, value_typed_ids = node_type_codes[value_pos], typed_ids[value_pos]
+
+        self.lookup = dict()
+        for type_code, node_type in enumerate(self.node_types):
+            of_type = key_types == type_code
+            if not of_type.any():
+                continue
+
+            keys = key_typed_ids[of_type]
+            order = np.argsort(keys, kind="stable")
+            counts = np.bincount(keys, minlength=type_sizes[type_code])
+            indptr = np.concatenate([np.zeros(1, dtype=np.int64), np.cumsum(counts)])
+
+            self.lookup[node_type] = (
+                torch.from_numpy(indptr),
+                torch.from_numpy(value_types[of_type][order].astype(np.int64)),
+                torch.from_numpy(value_typed_ids[of_type][order]),
+            )
+
+    @staticmethod
+    def _expand_ranges(starts, lengths):
+        # positions of all entries in ranges [start, start + length)
+        range_offsets = torch.cumsum(lengths, dim=0) - lengths
+        return torch.arange(int(lengths.sum())) + torch.repeat_interleave(starts - range_offsets, lengths)
 
     def get_mask(self, ids):
         """
         Accepts node ids that represent embeddable tokens as an input
-        :param ids:
-        :return:
+        :param ids: dictionary with typed ids for every node type, or list of ids for graphs with single node type
+        :return: dictionary with tensors of unique typed ids that should be masked for every node type
         """
-        if isinstance(ids, dict):
-            for_masking = dict()
-            for node_type, typed_ids in ids.items():
-                for typed_id in typed_ids:
-                    for src_type_, src_id in self.lookup[(node_type, typed_id)]:
-                        if src_type_ in for_masking:
-                            for_masking[src_type_].add(src_id)
-                        else:
-                            for_masking[src_type_] = set(src_id)
-        else:
-            for_masking = set()
-            for typed_id in ids:
-                for src_type_, src_id in self.lookup[("node_", typed_id)]:
-                    for_masking.add(src_id)
-            for_masking = {"node_": list(for_masking)}
+        if not isinstance(ids, dict):
+            ids = {"node_": ids}
+
+        masked_types = []
+        masked_ids = []
+        for node_type, typed_ids in ids.items():
+            if node_type not in self.lookup:
+                continue
+            indptr, value_types, value_typed_ids = self.lookup[node_type]
+
+            typed_ids = torch.as_tensor(typed_ids, dtype=torch.long)
+            starts = indptr[typed_ids]
+            positions = self._expand_ranges(starts, indptr[typed_ids + 1] - starts)
+            masked_types.append(value_types[positions])
+            masked_ids.append(value_typed_ids[positions])
+
+        for_masking = dict()
+        if len(masked_types) == 0:
+            return for_masking
+
+        masked_types = torch.cat(masked_types)
+        masked_ids = torch.cat(masked_ids)
+        for type_code in torch.unique(masked_types).tolist():
+            for_masking[self.node_types[type_code]] = torch.unique(masked_ids[masked_types == type_code])
 
         return for_masking
 
+    def save(self, path):
+        """
+        Store masker on disk. The file is written under a temporary name first, so that concurrent runs never read
+        partially written maskers.
+        :param path: destination file
+        """
+        tmp_path = path + f".tmp{os.getpid()}"
+        with open(tmp_path, "wb") as sink:
+            pickle.dump(self, sink)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def load(path):
+        with open(path, "rb") as source:
+            return pickle.load(source)
+
 
 class NodeNameMasker(SubwordMasker):
     """
@@ -68,39 +130,30 @@ class NodeNameMasker(SubwordMasker):
         super(NodeNameMasker, self).__init__(nodes, edges, node2name=node2name, tokenizer_path=tokenizer_path)
 
     def instantiate(self, nodes, orig_edges, **kwargs):
-        edges = orig_edges.copy()
-        if "type_backup" in edges.columns:
-            type_col = "type_backup"
-        elif "type" in edges.columns:
-            type_col = "type"
-        else:
-            raise Exception("Column `type` or `backup_type` not found")
-
         from SourceCodeTools.nlp.embed.bpe import load_bpe_model, make_tokenizer
         tokenize = make_tokenizer(load_bpe_model(kwargs['tokenizer_path']))
 
         subword_nodes = nodes.query("type_backup == 'subword'")
-        subword2key = dict(zip(subword_nodes["name"], zip(subword_nodes["type"], subword_nodes["typed_id"])))
-
-        node2type = dict(zip(nodes["id"], nodes["type"]))
-        node2typed_id = dict(zip(nodes["id"], nodes["typed_id"]))
+        subword2id = dict(zip(subword_nodes["name"], subword_nodes["id"]))
 
         node2name = kwargs["node2name"]
-        node2name.eval("src_type = src.map(@node2type.get)", local_dict={"node2type": node2type}, inplace=True)
-        node2name.eval("src_typed_id = src.map(@node2typed_id.get)", local_dict={"node2typed_id": node2typed_id},
-                   inplace=True)
-
-        self.lookup = {}
-        for node_type, node_id, var_name in node2name[["src_type", "src_typed_id", "dst"]].values:
-            key = (node_type, node_id)
-            subwords = tokenize(var_name)
-            if key not in self.lookup:
-                self.lookup[key] = []
-
-            # TODO
-            #  Some subwords did not appear in the list of known subwords. Although this is not an issue,
-            #  this can indicate that variable names are not extracted correctly. Need to verify.
-            self.lookup[key].extend([subword2key[sub] for sub in subwords if sub in subword2key])
+
+        # TODO
+        #  Some subwords did not appear in the list of known subwords. Although this is not an issue,
+        #  this can indicate that variable names are not extracted correctly. Need to verify.
+        name_subwords = {
+            name: [subword2id[sub] for sub in tokenize(name) if sub in subword2id]
+            for name in node2name["dst"].unique()
+        }
+
+        key_ids = []
+        value_ids = []
+        for node_id, var_name in node2name[["src", "dst"]].values:
+            subwords = name_subwords[var_name]
+            key_ids.extend([node_id] * len(subwords))
+            value_ids.extend(subwords)
+
+        self._create_lookup(nodes, key_ids=np.array(key_ids, dtype=np.int64), value_ids=np.array(value_ids, dtype=np.int64))
 
 
 class NodeClfMasker(SubwordMasker):
@@ -0,0 +1,141 @@
+import argparse
+import logging
+import time
+import tracemalloc
+
+import numpy
+import pandas
+
+from SourceCodeTools.code.data.dataset.Dataset import SourceGraphDataset
+
+
+def create_synthetic_graph(num_nodes, num_edges, num_node_types, num_edge_types, num_signatures, random_seed=42):
+    """
+    Create node and edge tables with the layout used by `SourceGraphDataset`. Node `i` has type
+    `i % num_node_types` and typed id `i // num_node_types`. Every edge is assigned one of `num_signatures`
+    random signatures, and its ends are sampled among the nodes of corresponding types.
+    :return: nodes, edges
+    """
+    assert num_signatures <= num_node_types * num_edge_types * num_node_types
+
+    rng = numpy.random.default_rng(random_seed)
+
+    node_type_names = numpy.array([f"node_type_{i}" for i in range(num_node_types)], dtype=object)
+    edge_type_names = numpy.array([f"edge_type_{i}" for i in range(num_edge_types)], dtype=object)
+
+    node_ids = numpy.arange(num_nodes, dtype=numpy.int64)
+    nodes = pandas.DataFrame({
+        "id": node_ids,
+        "type": node_type_names[node_ids % num_node_types],
+        "typed_id": node_ids // num_node_types,
+        "train_mask": rng.random(num_nodes) < 0.6,
+        "test_mask": False,
+        "val_mask": False,
+    })
+
+    signature_codes = rng.choice(num_node_types * num_edge_types * num_node_types, num_signatures, replace=False)
+    src_types, rest = numpy.divmod(signature_codes, num_edge_types * num_node_types)
+    edge_types, dst_types = numpy.divmod(rest, num_node_types)
+
+    edge_signature = rng.integers(0, num_signatures, num_edges)
+    src_type = src_types[edge_signature]
+    dst_type = dst_types[edge_signature]
+
+    nodes_per_type = numpy.bincount(node_ids % num_node_types, minlength=num_node_types)
+    src = (rng.random(num_edges) * nodes_per_type[src_type]).astype(numpy.int64) * num_node_types + src_type
+    dst = (rng.random(num_edges) * nodes_per_type[dst_type]).astype(numpy.int64) * num_node_types + dst_type
+
+    edges = pandas.DataFrame({
+        "src": src,
+        "dst": dst,
+        "type": edge_type_names[edge_types[edge_signature]],
+    })
+
+    return nodes, edges
+
+
+def split_edges_query_per_signature(nodes, edges):
+    """
+    Previous implementation of edge splitting in `SourceGraphDataset._create_hetero_graph`. Runs one query over
+    the edge table for every signature and maps node ids through a dictionary.
+    """
+    edges = SourceGraphDataset._add_node_types_to_edges(nodes, edges[['src', 'dst', 'type']])
+
+    typed_node_id = dict(zip(nodes['id'], nodes['typed_id']))
+
+    possible_edge_signatures = edges[['src_type', 'type', 'dst_type']].drop_duplicates(
+        ['src_type', 'type', 'dst_type']
+    )
+
+    typed_edges = {}
+
+    for ind, row in possible_edge_signatures.iterrows():
+        subgraph_signature = (row['src_type'], row['type'], row['dst_type'])
+
+        subset = edges.query(
+            f"src_type == '{row['src_type']}' and type == '{row['type']}' and dst_type == '{row['dst_type']}'"
+        )
+
+        typed_edges[subgraph_signature] = (
+            subset['src'].map(typed_node_id).to_numpy(dtype=numpy.int32),
+            subset['dst'].map(typed_node_id).to_numpy(dtype=numpy.int32)
+        )
+
+    return typed_edges
+
+
+def measure(fn, *args):
+    """
+    :return: result of the function, wall time in seconds, peak memory allocated during the call in bytes
+    """
+    tracemalloc.start()
+    start = time.time()
+    result = fn(*args)
+    elapsed = time.time() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def check_same_edges(reference, candidate):
+    assert set(reference.keys()) == set(candidate.keys())
+    for signature, (src, dst) in reference.items():
+        assert numpy.array_equal(src, candidate[signature][0])
+        assert numpy.array_equal(dst, candidate[signature][1])
+
+
+def run_benchmark(num_nodes, num_edges, num_node_types, num_edge_types, num_signatures, skip_reference=False):
+    logging.info(f"Creating graph with {num_nodes} nodes, {num_edges} edges, and {num_signatures} signatures")
+    nodes, edges = create_synthetic_graph(num_nodes, num_edges, num_node_types, num_edge_types, num_signatures)
+
+    implementations = [("vectorized", SourceGraphDataset._split_edges_by_signature)]
+    if not skip_reference:
+        implementations.append(("query per signature", split_edges_query_per_signature))
+
+    results = {}
+    for name, fn in implementations:
+        typed_edges, elapsed, peak = measure(fn, nodes, edges)
+        results[name] = typed_edges
+        logging.info(f"{name}: {elapsed:.2f} s, peak memory {peak / 2 ** 20:.1f} MiB, {len(typed_edges)} signatures")
+
+    if not skip_reference:
+        check_same_edges(results["query per signature"], results["vectorized"])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare edge splitting used for heterograph construction")
+    parser.add_argument("--num_nodes", default=1000000, type=int)
+    parser.add_argument("--num_edges", default=10000000, type=int)
+    parser.add_argument("--num_node_types", default=10, type=int)
+    parser.add_argument("--num_edge_types", default=40, type=int)
+    parser.add_argument("--num_signatures", default=200, type=int)
+    parser.add_argument("--skip_reference", action="store_true", default=False,
+                        help="Do not run previous implementation")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    run_benchmark(
+        args.num_nodes, args.num_edges, args.num_node_types, args.num_edge_types, args.num_signatures,
+        args.skip_reference
+    )
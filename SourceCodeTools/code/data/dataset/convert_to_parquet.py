@@ -0,0 +1,70 @@
+import argparse
+import logging
+import os
+from os.path import join
+
+from SourceCodeTools.code.common import read_nodes, read_edges, write_columnar, node_dtypes, node_additional_dtypes, \
+    edge_dtypes, edge_additional_dtypes
+from SourceCodeTools.code.data.file_utils import likely_format
+
+
+graph_tables = {
+    "common_nodes": (read_nodes, node_dtypes, node_additional_dtypes),
+    "common_edges": (read_edges, edge_dtypes, edge_additional_dtypes),
+}
+
+supported_extensions = ["json.bz2", "json", "bz2", "csv"]
+
+
+def find_table(dataset_path, table_name):
+    for extension in supported_extensions:
+        path = join(dataset_path, table_name + "." + extension)
+        if os.path.isfile(path):
+            return path
+    return None
+
+
+def convert_table(input_path, output_path, reader, dtypes, additional_dtypes, row_group_size):
+    if likely_format(input_path) == "pkl":
+        # pickled tables cannot be read in chunks
+        chunks = [reader(input_path)]
+    else:
+        chunks = reader(input_path, as_chunks=True)
+
+    write_columnar(chunks, output_path, dtypes, additional_dtypes, row_group_size=row_group_size)
+
+
+def convert_dataset(dataset_path, row_group_size=100000, remove_original=False):
+    """
+    Convert node and edge tables of a graph dataset into parquet format. Parquet files are picked up
+    automatically by `SourceGraphDataset`.
+    :param dataset_path: directory with `common_nodes` and `common_edges` tables
+    :param row_group_size: number of rows in a parquet row group
+    :param remove_original: remove original files after conversion
+    :return: Nothing
+    """
+    for table_name, (reader, dtypes, additional_dtypes) in graph_tables.items():
+        input_path = find_table(dataset_path, table_name)
+        if input_path is None:
+            logging.warning(f"Table {table_name} is not found in {dataset_path}")
+            continue
+
+        output_path = join(dataset_path, table_name + ".parquet")
+        logging.info(f"Converting {input_path} to {output_path}")
+        convert_table(input_path, output_path, reader, dtypes, additional_dtypes, row_group_size)
+
+        if remove_original:
+            os.remove(input_path)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert graph dataset into parquet format")
+    parser.add_argument("dataset_path", help="Directory with common_nodes and common_edges tables")
+    parser.add_argument("--row_group_size", default=100000, type=int, help="Number of rows in a row group")
+    parser.add_argument("--remove_original", action="store_true", default=False,
+                        help="Remove original files after conversion")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    convert_dataset(args.dataset_path, args.row_group_size, args.remove_original)
@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 
 from SourceCodeTools.code.common import read_nodes, read_edges
@@ -5,6 +6,20 @@ from SourceCodeTools.code.data.file_utils import unpersist
 from SourceCodeTools.code.annotator_utils import source_code_graph_alignment
 
 
+def get_graph_table_path(dataset_directory, table_name, default_extension="json.bz2"):
+    """
+    Find the file that stores a graph table. Columnar format is preferred when available.
+    :param dataset_directory: directory with dataset files
+    :param table_name: name of the table without extension, e.g. `common_nodes`
+    :param default_extension: extension to use when parquet file does not exist
+    :return: path to the table
+    """
+    columnar_path = os.path.join(dataset_directory, table_name + ".parquet")
+    if os.path.isfile(columnar_path):
+        return columnar_path
+    return os.path.join(dataset_directory, table_name + "." + default_extension)
+
+
 def load_data(node_path, edge_path, rename_columns=True):
     nodes = read_nodes(node_path)
     edges = read_edges(edge_path)
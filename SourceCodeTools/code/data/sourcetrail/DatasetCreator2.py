@@ -16,10 +16,12 @@ from SourceCodeTools.code.data.sourcetrail.sourcetrail_decode_edge_types import
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_filter_ambiguous_edges import filter_ambiguous_edges
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_parse_bodies2 import process_bodies
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import extract_call_seq
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_add_reverse_edges import add_reverse_edges
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges2 import get_ast_from_modules
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_extract_variable_names import extract_var_names
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_extract_node_names import extract_node_names
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_single_pass import extract_single_pass
 
 
 class DatasetCreator(AbstractDatasetCreator):
@@ -82,16 +84,19 @@ class DatasetCreator(AbstractDatasetCreator):
 
     type_annotation_edge_types = ['annotation_for', 'returned_by']
 
+    files_required_for_reuse = ["nodes.bz2", "nodes_with_ast.bz2"]
+
     def __init__(
             self, path, lang,
             bpe_tokenizer, create_subword_instances,
             connect_subwords, only_with_annotations,
             do_extraction=False, visualize=False, track_offsets=False, remove_type_annotations=False,
-            recompute_l2g=False
+            recompute_l2g=False, workers=1, incremental=False, parse_cache_dir=None
     ):
         super().__init__(
             path, lang, bpe_tokenizer, create_subword_instances, connect_subwords, only_with_annotations,
-            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g
+            do_extraction, visualize, track_offsets, remove_type_annotations, recompute_l2g, workers, incremental,
+            parse_cache_dir
         )
 
         from SourceCodeTools.code.data.sourcetrail.common import UNRESOLVED_SYMBOL
@@ -136,6 +141,12 @@ class DatasetCreator(AbstractDatasetCreator):
             edges.query("target_node_id not in @unsolved", local_dict={"unsolved": unsolved}, inplace=True)
         return nodes, edges
 
+    def get_environment_input_files(self, env_path):
+        return [
+            self.get_csv_name(name, env_path)
+            for name in ["nodes_csv", "edges_csv", "source_location", "occurrence", "filecontent", "element_component"]
+        ]
+
     def read_sourcetrail_files(self, env_path):
         nodes = merge_names(self.get_csv_name("nodes_csv", env_path), exit_if_empty=False)
         edges = decode_edge_types(self.get_csv_name("edges_csv", env_path), exit_if_empty=False)
@@ -179,32 +190,44 @@ class DatasetCreator(AbstractDatasetCreator):
 
         return global_nodes
 
-    def do_extraction(self):
-        global_nodes = set()
-        global_nodes_with_ast = set()
+    def extract_environment(self, env_path):
+        logging.info(f"Found {os.path.basename(env_path)}")
 
-        for env_path in self.environments:
-            logging.info(f"Found {os.path.basename(env_path)}")
+        if not self.is_indexed(env_path):
+            logging.info("Package not indexed")
+            return None
 
-            if not self.is_indexed(env_path):
-                logging.info("Package not indexed")
-                continue
+        if not self.reuse_extracted(env_path):
+
+            nodes, edges, source_location, occurrence, filecontent, element_component = \
+                self.read_sourcetrail_files(env_path)
 
-            if not self.recompute_l2g:
+            if nodes is None:
+                logging.info("Index is empty")
+                return None
 
-                nodes, edges, source_location, occurrence, filecontent, element_component = \
-                    self.read_sourcetrail_files(env_path)
+            edges = filter_ambiguous_edges(edges, element_component)
 
-                if nodes is None:
-                    logging.info("Index is empty")
-                    continue
+            nodes, edges = self.filter_unsolved_symbols(nodes, edges)
 
-                edges = filter_ambiguous_edges(edges, element_component)
+            # occurrences are grouped and indexed once for all extractors
+            occurrence_index = OccurrenceIndex(nodes, edges, source_location, occurrence)
 
-                nodes, edges = self.filter_unsolved_symbols(nodes, edges)
+            if self.lang == "python":
+                edges = add_reverse_edges(edges)
 
-                bodies = process_bodies(nodes, edges, source_location, occurrence, filecontent, self.lang)
-                call_seq = extract_call_seq(nodes, edges, source_location, occurrence)
+                # every module is parsed once, all artifacts are extracted from the shared state
+                bodies, call_seq, ast_nodes, ast_edges, offsets, name_mappings, vars = extract_single_pass(
+                    nodes, edges, source_location, occurrence, filecontent,
+                    self.bpe_tokenizer, self.create_subword_instances, self.connect_subwords, self.lang,
+                    track_offsets=self.track_offsets, occurrence_index=occurrence_index,
+                    package=os.path.basename(env_path), parse_cache=self.parse_cache
+                )
+            else:
+                bodies = process_bodies(
+                    nodes, edges, source_location, occurrence, filecontent, self.lang, occurrence_index=occurrence_index
+                )
+                call_seq = extract_call_seq(nodes, edges, source_location, occurrence, occurrence_index=occurrence_index)
 
                 edges = add_reverse_edges(edges)
 
@@ -212,51 +235,61 @@ class DatasetCreator(AbstractDatasetCreator):
                 ast_nodes, ast_edges, offsets, name_mappings = get_ast_from_modules(
                     nodes, edges, source_location, occurrence, filecontent,
                     self.bpe_tokenizer, self.create_subword_instances, self.connect_subwords, self.lang,
-                    track_offsets=self.track_offsets
+                    track_offsets=self.track_offsets, occurrence_index=occurrence_index,
+                    package=os.path.basename(env_path), parse_cache=self.parse_cache
                 )
 
-                if offsets is not None:
-                    offsets["package"] = os.path.basename(env_path)
-                filecontent["package"] = os.path.basename(env_path)
-
-                # need this check in situations when module has a single file and this file cannot be parsed
-                nodes_with_ast = nodes.append(ast_nodes) if ast_nodes is not None else nodes
-                edges_with_ast = edges.append(ast_edges) if ast_edges is not None else edges
-
                 if bodies is not None:
                     vars = extract_var_names(nodes, bodies, self.lang)
                 else:
                     vars = None
-            else:
-                nodes = unpersist_if_present(join(env_path, "nodes.bz2"))
-                nodes_with_ast = unpersist_if_present(join(env_path, "nodes_with_ast.bz2"))
 
-                if nodes is None or nodes_with_ast is None:
-                    continue
+            if offsets is not None:
+                offsets["package"] = os.path.basename(env_path)
+            filecontent["package"] = os.path.basename(env_path)
 
-                edges = bodies = call_seq = vars = edges_with_ast = offsets = name_mappings = filecontent = None
+            # need this check in situations when module has a single file and this file cannot be parsed
+            nodes_with_ast = nodes.append(ast_nodes) if ast_nodes is not None else nodes
+            edges_with_ast = edges.append(ast_edges) if ast_edges is not None else edges
+        else:
+            nodes = unpersist_if_present(join(env_path, "nodes.bz2"))
+            nodes_with_ast = unpersist_if_present(join(env_path, "nodes_with_ast.bz2"))
 
-            # global_nodes = self.merge_with_global(global_nodes, nodes)
-            # global_nodes_with_ast = self.merge_with_global(global_nodes_with_ast, nodes_with_ast)
+            if nodes is None or nodes_with_ast is None:
+                return None
 
-            local2global = get_local2global(
-                global_nodes=global_nodes, local_nodes=nodes
-            )
-            local2global_with_ast = get_local2global(
-                global_nodes=global_nodes_with_ast, local_nodes=nodes_with_ast
-            )
+            edges = bodies = call_seq = vars = edges_with_ast = offsets = name_mappings = filecontent = None
 
-            global_nodes.update(local2global["global_id"])
-            global_nodes_with_ast.update(local2global_with_ast["global_id"])
+        local2global = get_local2global(
+            global_nodes=None, local_nodes=nodes
+        )
+        local2global_with_ast = get_local2global(
+            global_nodes=None, local_nodes=nodes_with_ast
+        )
+
+        self.write_type_annotation_flag(edges_with_ast, env_path)
 
-            self.write_type_annotation_flag(edges_with_ast, env_path)
+        self.write_local(
+            env_path, nodes=nodes, edges=edges, bodies=bodies, call_seq=call_seq, function_variable_pairs=vars,
+            nodes_with_ast=nodes_with_ast, edges_with_ast=edges_with_ast, offsets=offsets,
+            local2global=local2global, local2global_with_ast=local2global_with_ast,
+            name_mappings=name_mappings, filecontent_with_package=filecontent
+        )
 
-            self.write_local(
-                env_path, nodes=nodes, edges=edges, bodies=bodies, call_seq=call_seq, function_variable_pairs=vars,
-                nodes_with_ast=nodes_with_ast, edges_with_ast=edges_with_ast, offsets=offsets,
-                local2global=local2global, local2global_with_ast=local2global_with_ast,
-                name_mappings=name_mappings, filecontent_with_package=filecontent
-            )
+        return local2global["global_id"].tolist(), local2global_with_ast["global_id"].tolist()
+
+    def do_extraction(self):
+        global_nodes = set()
+        global_nodes_with_ast = set()
+
+        for global_ids in self.extract_environments():
+            if global_ids is None:
+                continue
+
+            env_global_nodes, env_global_nodes_with_ast = global_ids
+
+            global_nodes.update(env_global_nodes)
+            global_nodes_with_ast.update(env_global_nodes_with_ast)
 
         self.compact_mapping_for_l2g(global_nodes, "local2global.bz2")
         self.compact_mapping_for_l2g(global_nodes_with_ast, "local2global_with_ast.bz2")
@@ -272,17 +305,23 @@ class DatasetCreator(AbstractDatasetCreator):
 
     def merge(self, output_directory):
 
+        no_ast_path, with_ast_path = self.create_output_dirs(output_directory)
+
+        if self.incremental:
+            self.prepare_incremental_build(output_directory)
+
         if self.extract:
             logging.info("Extracting...")
             self.do_extraction()
 
-        no_ast_path, with_ast_path = self.create_output_dirs(output_directory)
-
         if not self.only_with_annotations:
             self.merge_graph_without_ast(no_ast_path)
 
         self.merge_graph_with_ast(with_ast_path)
 
+        if self.manifest is not None:
+            self.manifest.save()
+
     def visualize_func(self, nodes, edges, output_path):
         from SourceCodeTools.code.data.sourcetrail.sourcetrail_draw_graph import visualize
         visualize(nodes, edges, output_path)
@@ -300,6 +339,6 @@ if __name__ == "__main__":
     dataset = DatasetCreator(
         args.indexed_environments, args.language, args.bpe_tokenizer, args.create_subword_instances,
         args.connect_subwords, args.only_with_annotations, args.do_extraction, args.visualize, args.track_offsets,
-        args.remove_type_annotations, args.recompute_l2g
+        args.remove_type_annotations, args.recompute_l2g, args.workers, args.incremental, args.parse_cache_dir
     )
     dataset.merge(args.output_directory)
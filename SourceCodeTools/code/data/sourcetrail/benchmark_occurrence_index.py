@@ -0,0 +1,242 @@
+import argparse
+import ast
+import logging
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from SourceCodeTools.code.common import SQLTable
+from SourceCodeTools.code.data.sourcetrail.common import DEFINITION_TYPE, get_occurrence_groups, \
+    sql_get_function_definitions, sql_get_occurrences_from_range
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import sql_get_function_calls_from_range
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_types import node_types, edge_types
+
+
+def read_sourcetrail_db(path):
+    """
+    Read tables required for occurrence queries from Sourcetrail database and decode node and edge types.
+    """
+    conn = sqlite3.connect(path)
+    nodes = pd.read_sql("select * from node", conn)
+    edges = pd.read_sql("select * from edge", conn)
+    occurrence = pd.read_sql("select * from occurrence", conn)
+    source_location = pd.read_sql("select * from source_location", conn)
+    conn.close()
+
+    nodes["type"] = nodes["type"].apply(lambda x: node_types.get(x, x))
+    edges["type"] = edges["type"].apply(lambda x: edge_types.get(x, x))
+    return nodes, edges, source_location, occurrence
+
+
+class SourcetrailDatabaseWriter:
+    """
+    Creates a database with Sourcetrail tables used by occurrence queries from Python sources. Functions and
+    methods are stored with definition locations, calls and loaded names inside functions are stored as `calls`
+    and `uses` edges with single line occurrences of both the edge and the referenced node. This gives databases
+    with the distribution of functions and references of real projects without running Sourcetrail.
+    """
+    node_type_ids = {name: type_id for type_id, name in node_types.items()}
+    edge_type_ids = {name: type_id for type_id, name in edge_types.items()}
+    file_type_id = 262144
+
+    def __init__(self):
+        self.nodes = {}  # serialized name -> (id, type)
+        self.edges = {}  # (type, source, target) -> id
+        self.source_locations = []
+        self.occurrences = []
+        self.next_id = 1
+
+    def get_id(self):
+        self.next_id += 1
+        return self.next_id - 1
+
+    def node(self, name, type_):
+        if name not in self.nodes:
+            self.nodes[name] = (self.get_id(), self.node_type_ids.get(type_, type_))
+        return self.nodes[name][0]
+
+    def edge(self, type_, source, target):
+        key = (self.edge_type_ids[type_], source, target)
+        if key not in self.edges:
+            self.edges[key] = self.get_id()
+        return self.edges[key]
+
+    def occurrence(self, element_ids, file_id, start_line, start_col, end_line, end_col, occ_type=0):
+        location_id = len(self.source_locations) + 1
+        self.source_locations.append((location_id, file_id, start_line, start_col, end_line, end_col, occ_type))
+        for element_id in element_ids:
+            self.occurrences.append((element_id, location_id))
+
+    def add_file(self, path, module_name):
+        with open(path, "r", errors="ignore") as source:
+            tree = ast.parse(source.read())
+
+        file_id = self.node(path, self.file_type_id)
+        module_id = self.node(module_name, "module")
+
+        def visit(node, scope, in_class):
+            for child in ast.iter_child_nodes(node):
+                if isinstance(child, ast.ClassDef):
+                    visit(child, f"{scope}.{child.name}", in_class=True)
+                elif isinstance(child, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    self.add_function(child, f"{scope}.{child.name}", in_class, file_id, module_id)
+                    visit(child, f"{scope}.{child.name}", in_class=False)
+                else:
+                    visit(child, scope, in_class)
+
+        visit(tree, module_name, in_class=False)
+
+    def add_function(self, function, name, is_method, file_id, module_id):
+        function_id = self.node(name, "class_method" if is_method else "function")
+        self.edge("defines", module_id, function_id)
+        self.occurrence(
+            [function_id], file_id, function.lineno, function.col_offset + 1, function.end_lineno,
+            function.end_col_offset, occ_type=DEFINITION_TYPE
+        )
+
+        called = set()
+        for node in ast.walk(function):
+            if isinstance(node, ast.Call):
+                target = node.func.attr if isinstance(node.func, ast.Attribute) else getattr(node.func, "id", None)
+                if target is None:
+                    continue
+                called.add(id(node.func))
+                target_id = self.node(target, "function")
+                self.add_reference(self.edge("calls", function_id, target_id), target_id, node.func, file_id)
+            elif isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load) and id(node) not in called:
+                target_id = self.node(node.id, "global_variable")
+                self.add_reference(self.edge("uses", function_id, target_id), target_id, node, file_id)
+
+    def add_reference(self, edge_id, target_id, node, file_id):
+        self.occurrence(
+            [edge_id, target_id], file_id, node.lineno, node.col_offset + 1, node.end_lineno, node.end_col_offset
+        )
+
+    def write(self, db_path):
+        if os.path.isfile(db_path):
+            os.remove(db_path)
+        conn = sqlite3.connect(db_path)
+        pd.DataFrame(
+            [(id_, type_, name) for name, (id_, type_) in self.nodes.items()],
+            columns=["id", "type", "serialized_name"]
+        ).to_sql("node", conn, index=False)
+        pd.DataFrame(
+            [(id_, type_, source, target) for (type_, source, target), id_ in self.edges.items()],
+            columns=["id", "type", "source_node_id", "target_node_id"]
+        ).to_sql("edge", conn, index=False)
+        pd.DataFrame(
+            self.source_locations,
+            columns=["id", "file_node_id", "start_line", "start_column", "end_line", "end_column", "type"]
+        ).to_sql("source_location", conn, index=False)
+        pd.DataFrame(self.occurrences, columns=["element_id", "source_location_id"]).to_sql(
+            "occurrence", conn, index=False
+        )
+        conn.close()
+
+
+def create_database_from_sources(source_dir, db_path):
+    """
+    Create Sourcetrail-like database for benchmarking from Python files, see `SourcetrailDatabaseWriter`.
+    :param source_dir: directory with Python sources
+    :param db_path: path of the created database
+    :return: Nothing
+    """
+    writer = SourcetrailDatabaseWriter()
+    for root, dirs, files in os.walk(source_dir):
+        for file in sorted(files):
+            if not file.endswith(".py"):
+                continue
+            path = os.path.join(root, file)
+            module_name = os.path.splitext(os.path.relpath(path, source_dir))[0].replace(os.sep, ".")
+            try:
+                writer.add_file(path, module_name)
+            except (SyntaxError, ValueError):
+                logging.warning(f"Cannot parse {path}, skipping")
+    writer.write(db_path)
+
+
+def find_databases(path):
+    if os.path.isfile(path):
+        yield path
+        return
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            if file.endswith(".srctrldb"):
+                yield os.path.join(root, file)
+
+
+def query_with_sql(nodes, edges, source_location, occurrence):
+    results = []
+    for file_id, occurrences in get_occurrence_groups(nodes, edges, source_location.copy(), occurrence):
+        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
+        for _, f_def in sql_get_function_definitions(sql_occurrences).iterrows():
+            body = sql_get_occurrences_from_range(sql_occurrences, f_def.start_line, f_def.end_line)
+            calls = sql_get_function_calls_from_range(sql_occurrences, f_def.start_line, f_def.end_line)
+            results.append((f_def.element_id, body["element_id"].tolist(), calls["element_id"].tolist()))
+        del sql_occurrences
+    return results
+
+
+def query_with_index(nodes, edges, source_location, occurrence):
+    results = []
+    for file_id, file_occurrences in OccurrenceIndex(nodes, edges, source_location.copy(), occurrence):
+        for _, f_def in file_occurrences.function_definitions().iterrows():
+            body = file_occurrences.occurrences_from_range(f_def.start_line, f_def.end_line)
+            calls = file_occurrences.calls_from_range(f_def.start_line, f_def.end_line)
+            results.append((f_def.element_id, body["element_id"].tolist(), calls["element_id"].tolist()))
+    return results
+
+
+def timed(fn, repeat, *args):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn(*args)
+    return result, (time.perf_counter() - start) / repeat
+
+
+def run_benchmark(path, repeat):
+    total_sql = total_index = 0.
+    for db_path in sorted(find_databases(path)):
+        tables = read_sourcetrail_db(db_path)
+        if len(tables[3]) == 0:
+            logging.info(f"{db_path}: no occurrences, skipping")
+            continue
+
+        sql_results, sql_time = timed(query_with_sql, repeat, *tables)
+        index_results, index_time = timed(query_with_index, repeat, *tables)
+        assert sql_results == index_results, f"Results differ for {db_path}"
+
+        total_sql += sql_time
+        total_index += index_time
+        logging.info(
+            f"{db_path}: {len(sql_results)} functions, sqlite {1000 * sql_time:.2f} ms, "
+            f"index {1000 * index_time:.2f} ms, speedup {sql_time / max(index_time, 1e-9):.1f}x"
+        )
+
+    if total_index > 0:
+        logging.info(
+            f"Total: sqlite {1000 * total_sql:.2f} ms, index {1000 * total_index:.2f} ms, "
+            f"speedup {total_sql / total_index:.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compare occurrence range queries with per-file SQLite tables and with OccurrenceIndex"
+    )
+    parser.add_argument("path", nargs="?", default="res/python_testdata/example_environment",
+                        help="Sourcetrail database (*.srctrldb) or directory that contains them")
+    parser.add_argument("--repeat", default=20, type=int, help="Number of repetitions for timing")
+    parser.add_argument("--from_sources", default=None, type=str,
+                        help="Create database at `path` from Python sources in this directory before benchmarking")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    if args.from_sources is not None:
+        create_database_from_sources(args.from_sources, args.path)
+
+    run_benchmark(args.path, args.repeat)
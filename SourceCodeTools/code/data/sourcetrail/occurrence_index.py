@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+from SourceCodeTools.code.data.sourcetrail.common import DEFINITION_TYPE, get_occurrence_groups
+
+
+class FileOccurrences:
+    """
+    Occurrences of a single file indexed by line ranges. Occurrences are sorted by `start_line` once, and range
+    queries are answered with `np.searchsorted` followed by vectorized filtering of candidate rows. Query results
+    keep the original order of occurrences.
+    """
+    def __init__(self, occurrences: pd.DataFrame):
+        self.occurrences = occurrences.reset_index(drop=True)
+
+        self.start_line = self.occurrences["start_line"].to_numpy(dtype=np.int64)
+        self.end_line = self.occurrences["end_line"].to_numpy(dtype=np.int64)
+        self.is_definition = self.occurrences["occ_type"].to_numpy() == DEFINITION_TYPE
+        if "e_type" in self.occurrences.columns:
+            self.is_call = (self.occurrences["e_type"] == "calls").to_numpy(dtype=bool, na_value=False)
+        else:
+            self.is_call = np.zeros(len(self.occurrences), dtype=bool)
+
+        self.order = np.argsort(self.start_line, kind="stable")
+        self.sorted_start_line = self.start_line[self.order]
+        self.sorted_end_line = self.end_line[self.order]
+
+    def __len__(self):
+        return len(self.occurrences)
+
+    def function_definitions(self) -> pd.DataFrame:
+        """
+        :return: definitions of functions and methods
+        """
+        is_function = self.occurrences["type"].isin(["function", "class_method"]).to_numpy(dtype=bool)
+        return self.occurrences[self.is_definition & is_function]
+
+    def range_positions(self, start, end, single_line=False, calls_only=False):
+        """
+        Find occurrences inside the line range, excluding definitions.
+        :param start: first line of the range
+        :param end: last line of the range
+        :param single_line: keep only occurrences that start and end on the same line
+        :param calls_only: keep only occurrences of `calls` edges
+        :return: array with positions of occurrences in the original order
+        """
+        # occurrences that satisfy start_line >= start and end_line <= end also have start_line <= end
+        lo = np.searchsorted(self.sorted_start_line, start, side="left")
+        hi = np.searchsorted(self.sorted_start_line, end, side="right")
+        positions = self.order[lo: hi][self.sorted_end_line[lo: hi] <= end]
+
+        keep = ~self.is_definition[positions]
+        if single_line:
+            keep &= self.start_line[positions] == self.end_line[positions]
+        if calls_only:
+            keep &= self.is_call[positions]
+        return np.sort(positions[keep])
+
+    def occurrences_from_range(self, start, end) -> pd.DataFrame:
+        """
+        Equivalent of `get_occurrences_from_range`: occurrences that are not definitions and fit into a single line.
+        """
+        return self.occurrences.iloc[self.range_positions(start, end, single_line=True)]
+
+    def calls_from_range(self, start, end) -> pd.DataFrame:
+        """
+        Occurrences of function calls within the range.
+        """
+        return self.occurrences.iloc[self.range_positions(start, end, calls_only=True)]
+
+
+class OccurrenceIndex:
+    """
+    Occurrences of Sourcetrail nodes grouped by file. Index for every file is created once and can be reused by
+    all extractors that process the same files.
+    """
+    def __init__(self, nodes, edges, source_location, occurrence):
+        self.occurrence_groups = get_occurrence_groups(nodes, edges, source_location, occurrence)
+        self._files = {}
+
+    def __len__(self):
+        return len(self.occurrence_groups)
+
+    def __iter__(self):
+        """
+        :return: iterator over tuples of file id and `FileOccurrences`
+        """
+        for file_id, occurrences in self.occurrence_groups:
+            if file_id not in self._files:
+                self._files[file_id] = FileOccurrences(occurrences)
+            yield file_id, self._files[file_id]
+
+    def __getitem__(self, file_id):
+        if file_id not in self._files:
+            self._files[file_id] = FileOccurrences(self.occurrence_groups.get_group(file_id))
+        return self._files[file_id]
@@ -4,12 +4,14 @@ from copy import copy
 
 import networkx as nx
 
-from SourceCodeTools.code.IdentifierPool import IntIdentifierPool
+from SourceCodeTools.code.IdentifierPool import CounterIdentifierPool
 from SourceCodeTools.code.ast import has_valid_syntax
+from SourceCodeTools.code.ast.AstParseCache import get_ast_edges
 from SourceCodeTools.code.common import custom_tqdm
 from SourceCodeTools.code.data.sourcetrail.common import *
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
 from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges import NodeResolver, make_reverse_edge
-from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, GNode, PythonSharedNodes, EdgeColumns
 # from SourceCodeTools.code.python_ast_cf import AstGraphGenerator
 from SourceCodeTools.code.annotator_utils import adjust_offsets2
 from SourceCodeTools.code.annotator_utils import overlap as range_overlap
@@ -631,7 +633,9 @@ class AstProcessor(AstGraphGenerator):
         edges.extend(all_edges)
 
         if as_dataframe:
-            df = pd.DataFrame(edges)
+            edge_columns = EdgeColumns()
+            edge_columns.extend(edges)
+            df = edge_columns.to_dataframe()
             df = df.astype({col: "Int32" for col in df.columns if col not in {"src", "dst", "type"}})
 
             body = "\n".join(self.source)
@@ -675,29 +679,15 @@ class AstProcessor(AstGraphGenerator):
                     except:
                         return None
 
-                if "line" in edge:
-                    edge["offsets"] = into_offset(
-                        (edge["line"], edge["end_line"], edge["col_offset"], edge["end_col_offset"])
-                    )
-                    edge.pop("line")
-                    edge.pop("end_line")
-                    edge.pop("col_offset")
-                    edge.pop("end_col_offset")
-                else:
-                    edge["offsets"] = None
-                if "var_line" in edge:
-                    edge["var_offsets"] = into_offset(
-                        (edge["var_line"], edge["var_end_line"], edge["var_col_offset"], edge["var_end_col_offset"])
-                    )
-                    edge.pop("var_line")
-                    edge.pop("var_end_line")
-                    edge.pop("var_col_offset")
-                    edge.pop("var_end_col_offset")
-
-            for edge in edges:
-                format_offsets(edge)
+                formatted = {
+                    "src": edge.src, "dst": edge.dst, "type": edge.type, "scope": edge.scope,
+                    "offsets": into_offset(edge.positions) if edge.line is not None else None
+                }
+                if edge.var_line is not None:
+                    formatted["var_offsets"] = into_offset(edge.var_positions)
+                return formatted
 
-            return edges
+            return [format_offsets(edge) for edge in edges]
 
 
 class SourcetrailResolver:
@@ -706,7 +696,7 @@ class SourcetrailResolver:
     - Iterating over files
     - Preserving Sourcetrail nodes
     """
-    def __init__(self, nodes, edges, source_location, occurrence, file_content, lang):
+    def __init__(self, nodes, edges, source_location, occurrence, file_content, lang, occurrence_index=None):
         self.nodes = nodes
         self.node2name = dict(zip(nodes['id'], nodes['serialized_name']))
 
@@ -715,16 +705,24 @@ class SourcetrailResolver:
         self.occurrence = occurrence
         self.file_content = file_content
         self.lang = lang
-        self._occurrence_groups = None
+        self._occurrence_index = occurrence_index
+        self._file_content_by_id = None
+
+    @property
+    def occurrence_index(self):
+        """
+        :return: OccurrenceIndex that iterates over occurrences grouped by file id.
+        """
+        if self._occurrence_index is None:
+            self._occurrence_index = OccurrenceIndex(self.nodes, self.edges, self.source_location, self.occurrence)
+        return self._occurrence_index
 
     @property
     def occurrence_groups(self):
         """
         :return: Iterator for occurrences grouped by file id.
         """
-        if self._occurrence_groups is None:
-            self._occurrence_groups = get_occurrence_groups(self.nodes, self.edges, self.source_location, self.occurrence)
-        return self._occurrence_groups
+        return self.occurrence_index.occurrence_groups
 
     def get_node_id_from_occurrence(self, elem_id__target_id__name):
         element_id, target_node_id, name = elem_id__target_id__name
@@ -743,7 +741,9 @@ class SourcetrailResolver:
             return node_id
 
     def get_file_content(self, file_id):
-        return self.file_content.query(f"id == {file_id}").iloc[0]['content']
+        if self._file_content_by_id is None:
+            self._file_content_by_id = dict(zip(self.file_content["id"], self.file_content["content"]))
+        return self._file_content_by_id[file_id]
 
     def occurrences_into_ranges(self, body, occurrences: pd.DataFrame):
 
@@ -923,7 +923,10 @@ def standardize_new_edges(edges, node_resolver, mention_tokenizer):
     return edges
 
 
-def process_code(source_file_content, offsets, node_resolver, mention_tokenizer, node_matcher, track_offsets=False):
+def process_code(
+        source_file_content, offsets, node_resolver, mention_tokenizer, node_matcher, track_offsets=False,
+        identifier_seed=None, parse_cache=None
+):
     """
 
     :param source_file_content: String for a file from SOurcetrail database
@@ -932,6 +935,8 @@ def process_code(source_file_content, offsets, node_resolver, mention_tokenizer,
     :param mention_tokenizer:
     :param node_matcher:
     :param track_offsets: Flag that tells whether to perform offset tracking.
+    :param identifier_seed: seed for identifiers of AST nodes, unique for every file. Identifiers are random if None.
+    :param parse_cache: AstParseCache for reusing AST edges of modules that were processed before
     :return: Tuple that stores egdes, list of global and ast offsets for the current file in the format
      (start, end, node_id, set(offsets for functions where the current offset occurs),
      mapping from AST nodes to corresponding global nodes (will be used to replace one with the other).
@@ -941,16 +946,11 @@ def process_code(source_file_content, offsets, node_resolver, mention_tokenizer,
     replacer.perform_replacements(source_file_content, offsets)
 
     # compute ast edges
-    try:
-        ast_processor = AstProcessor(replacer.source_with_replacements)
-    except:
-        return None, None, None, None
-    try: # TODO recursion error does not appear consistently. The issue is probably with library versions...
-        edges = ast_processor.get_edges(as_dataframe=False)
-    except RecursionError:
-        return None, None, None, None
+    edges = get_ast_edges(
+        AstProcessor, replacer.source_with_replacements, identifier_seed=identifier_seed, parse_cache=parse_cache
+    )
 
-    if len(edges) == 0:
+    if edges is None or len(edges) == 0:
         return None, None, None, None
 
     # resolve sourcetrail nodes ans replace with original
@@ -1016,59 +1016,70 @@ def process_code(source_file_content, offsets, node_resolver, mention_tokenizer,
     return edges, global_and_ast_offsets, ast_nodes_to_srctrl_nodes, ast_node_names_to_global_node_names
 
 
-def get_ast_from_modules(
-        nodes, edges, source_location, occurrence, file_content,
-        bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False
-):
+class ModuleAstExtractor:
     """
-    Create edges from source code and methe them wit hthe global graph. Prepare all offsets in the uniform format.
-    :param nodes: DataFrame with nodes
-    :param edges: DataFrame with edges
-    :param source_location: Dataframe that links nodes to source files
-    :param occurrence: Dataframe with records about occurrences
-    :param file_content: Dataframe with sources
-    :param bpe_tokenizer_path: path to sentencepiece model
-    :param create_subword_instances:
-    :param connect_subwords:
-    :param lang:
-    :param track_offsets:
-    :return: Tuple:
-        - Dataframe with all nodes. Schema: id, type, name, mentioned_in (global and AST)
-        - Dataframe with all edges. Schema: id, type, src, dst, file_id, mentioned_in
-        - Dataframe with all_offsets. Schema: file_id, start, end, node_id, mentioned_in
+    Create AST edges for modules one file at a time. State that is shared between files (new nodes, references
+    to global nodes, name mappings, offsets) is accumulated until `finalize` is called.
     """
-    srctrl_resolver = SourcetrailResolver(nodes, edges, source_location, occurrence, file_content, lang)
-    node_resolver = ReplacementNodeResolver(nodes)
-    node_matcher = GlobalNodeMatcher(nodes, edges)  # add_reverse_edges(edges))
-    mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
-    all_ast_edges = []
-    all_global_references = {}
-    all_name_mappings = {}
-    all_offsets = []
-
-    for group_ind, (file_id, occurrences) in custom_tqdm(
-            enumerate(srctrl_resolver.occurrence_groups), message="Processing modules",
-            total=len(srctrl_resolver.occurrence_groups)
+    def __init__(
+            self, nodes, edges, source_location, occurrence, file_content,
+            bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False,
+            occurrence_index=None, package=None, parse_cache=None
     ):
-        # if file_id != 74720: continue
-        source_file_content = srctrl_resolver.get_file_content(file_id)
+        """
+        See `get_ast_from_modules` for the description of parameters.
+        """
+        self.nodes = nodes
+        self.track_offsets = track_offsets
+        self.package = package
+        self.parse_cache = parse_cache
+        self.srctrl_resolver = SourcetrailResolver(
+            nodes, edges, source_location, occurrence, file_content, lang, occurrence_index=occurrence_index
+        )
+        self.node_resolver = ReplacementNodeResolver(nodes)
+        self.node_matcher = GlobalNodeMatcher(nodes, edges)  # add_reverse_edges(edges))
+        self.mention_tokenizer = MentionTokenizer(bpe_tokenizer_path, create_subword_instances, connect_subwords)
+        self.all_ast_edges = []
+        self.all_global_references = {}
+        self.all_name_mappings = {}
+        self.all_offsets = []
+
+    @property
+    def occurrence_index(self):
+        return self.srctrl_resolver.occurrence_index
+
+    def get_file_content(self, file_id):
+        return self.srctrl_resolver.get_file_content(file_id)
+
+    def process_file(self, file_id, file_occurrences, check_syntax=True):
+        """
+        Create AST edges for a single module.
+        :param file_id: id of the file
+        :param file_occurrences: FileOccurrences for the file
+        :param check_syntax: verify that the module is valid python. Set to False when the module was already
+            parsed by the caller.
+        :return: Nothing
+        """
+        # if file_id != 74720: return
+        source_file_content = self.get_file_content(file_id)
 
-        if not has_valid_syntax(source_file_content):
-            continue
+        if check_syntax and not has_valid_syntax(source_file_content):
+            return
 
-        offsets = srctrl_resolver.occurrences_into_ranges(source_file_content, occurrences)
+        offsets = self.srctrl_resolver.occurrences_into_ranges(source_file_content, file_occurrences.occurrences)
 
         # process code
         # try:
         edges, global_and_ast_offsets, ast_nodes_to_srctrl_nodes, ast_node_names_to_global_node_names = process_code(
-            source_file_content, offsets, node_resolver, mention_tokenizer, node_matcher, track_offsets=track_offsets
+            source_file_content, offsets, self.node_resolver, self.mention_tokenizer, self.node_matcher,
+            track_offsets=self.track_offsets, identifier_seed=f"{self.package}:{file_id}", parse_cache=self.parse_cache
         )
         # except SyntaxError:
         #     logging.warning(f"Error processing file_id {file_id}")
-        #     continue
+        #     return
 
         if edges is None:
-            continue
+            return
 
         # afterprocessing
 
@@ -1077,9 +1088,9 @@ def get_ast_from_modules(
 
         # finish afterprocessing
 
-        all_ast_edges.extend(edges)
-        node_matcher.merge_global_references(all_global_references, ast_nodes_to_srctrl_nodes)
-        all_name_mappings.update(ast_node_names_to_global_node_names)
+        self.all_ast_edges.extend(edges)
+        self.node_matcher.merge_global_references(self.all_global_references, ast_nodes_to_srctrl_nodes)
+        self.all_name_mappings.update(ast_node_names_to_global_node_names)
 
         def format_offsets(global_and_ast_offsets, target):
             """
@@ -1098,91 +1109,145 @@ def get_ast_from_modules(
                         "mentioned_in": offset[3] # if len(offset[3]) > 0 else pd.NA
                     })
 
-        format_offsets(global_and_ast_offsets, target=all_offsets)
+        format_offsets(global_and_ast_offsets, target=self.all_offsets)
 
-        node_resolver.stash_new_nodes()
+        self.node_resolver.stash_new_nodes()
 
-    def replace_ast_node_to_global(edges, mapping):
-        for edge in edges:
-            edge["src"] = mapping.get(edge["src"], edge["src"])
-            edge["dst"] = mapping.get(edge["dst"], edge["dst"])
-            if "scope" in edge:
-                edge["scope"] = mapping.get(edge["scope"], edge["scope"])
-
-    # replace_ast_node_to_global(all_ast_edges, all_global_references)  # disabled to keep global nodes separate
-
-    def create_subwords_for_global_nodes():
-        all_ast_edges.extend(
-            standardize_new_edges(edges_for_global_node_names(produce_nodes_without_name(nodes, all_ast_edges)),
-                                  node_resolver, mention_tokenizer))
-        node_resolver.stash_new_nodes()
-
-    # create_subwords_for_global_nodes()  # disabled to keep global nodes separate
-
-    def prepare_new_nodes(node_resolver):
-
-        node_resolver.adjust_ast_node_types(
-            mapping={
-                "Module": "module",
-                "FunctionDef": "function",
-                "ClassDef": "class",
-                "class_method": "function"
-            }, from_stashed=True
-        )
-        node_resolver.map_mentioned_in_to_global(all_global_references, from_stashed=True)
-        # TODO since some function definitions and modules are dropped, need to rename decorated nodes as well
-        # find old name in node_resolver.stashed nodes, go over all nodes and replace corresponding substrings in names
-        node_resolver.drop_nodes(set(all_global_references.keys()), from_stashed=True)
-
-        for offset in all_offsets:
-            offset["node_id"] = all_global_references.get(offset["node_id"], offset["node_id"])
-            offset["mentioned_in"] = [(e[0], e[1], all_global_references.get(e[2], e[2])) for e in offset["mentioned_in"]]
+    def finalize(self):
+        """
+        Prepare nodes, edges, offsets, and name mappings accumulated from all processed modules.
+        :return: Tuple, see `get_ast_from_modules`
+        """
+        nodes = self.nodes
+        node_resolver = self.node_resolver
+        mention_tokenizer = self.mention_tokenizer
+        all_ast_edges = self.all_ast_edges
+        all_global_references = self.all_global_references
+        all_name_mappings = self.all_name_mappings
+        all_offsets = self.all_offsets
+
+        def replace_ast_node_to_global(edges, mapping):
+            for edge in edges:
+                edge["src"] = mapping.get(edge["src"], edge["src"])
+                edge["dst"] = mapping.get(edge["dst"], edge["dst"])
+                if "scope" in edge:
+                    edge["scope"] = mapping.get(edge["scope"], edge["scope"])
+
+        # replace_ast_node_to_global(all_ast_edges, all_global_references)  # disabled to keep global nodes separate
+
+        def create_subwords_for_global_nodes():
+            all_ast_edges.extend(
+                standardize_new_edges(edges_for_global_node_names(produce_nodes_without_name(nodes, all_ast_edges)),
+                                      node_resolver, mention_tokenizer))
+            node_resolver.stash_new_nodes()
+
+        # create_subwords_for_global_nodes()  # disabled to keep global nodes separate
+
+        def prepare_new_nodes(node_resolver):
+
+            node_resolver.adjust_ast_node_types(
+                mapping={
+                    "Module": "module",
+                    "FunctionDef": "function",
+                    "ClassDef": "class",
+                    "class_method": "function"
+                }, from_stashed=True
+            )
+            node_resolver.map_mentioned_in_to_global(all_global_references, from_stashed=True)
+            # TODO since some function definitions and modules are dropped, need to rename decorated nodes as well
+            # find old name in node_resolver.stashed nodes, go over all nodes and replace corresponding substrings in names
+            node_resolver.drop_nodes(set(all_global_references.keys()), from_stashed=True)
+
+            for offset in all_offsets:
+                offset["node_id"] = all_global_references.get(offset["node_id"], offset["node_id"])
+                offset["mentioned_in"] = [(e[0], e[1], all_global_references.get(e[2], e[2])) for e in offset["mentioned_in"]]
+
+
+        # prepare_new_nodes(node_resolver)  # disabled to keep global nodes separate
+
+        all_ast_nodes = node_resolver.new_nodes_for_write(from_stashed=True)
+        if all_ast_nodes is None:
+            return None, None, None, None
+
+        def decipher_node_name(name):
+            if name in all_name_mappings:
+                return all_name_mappings[name]
+            elif "@" in name:
+                for key, value in all_name_mappings.items():
+                    if key in name:
+                        return name.replace(key, value)
+                return name
+            return name
 
+        # all_ast_nodes["serialized_name"] = all_ast_nodes["serialized_name"].apply(decipher_node_name)
 
-    # prepare_new_nodes(node_resolver)  # disabled to keep global nodes separate
+        def prepare_edges(all_ast_edges):
+            all_ast_edges = pd.DataFrame(all_ast_edges)
+            all_ast_edges.drop_duplicates(["type", "src", "dst"], inplace=True)
+            all_ast_edges = all_ast_edges.query("src != dst")
+            all_ast_edges["id"] = 0
+            all_ast_edges = all_ast_edges[["id", "type", "src", "dst", "file_id", "scope"]].rename({'src': 'source_node_id', 'dst': 'target_node_id', 'scope': 'mentioned_in'}, axis=1).astype(
+                {'file_id': 'Int32', "mentioned_in": 'Int32'}
+            )
+            return all_ast_edges
 
-    all_ast_nodes = node_resolver.new_nodes_for_write(from_stashed=True)
-    if all_ast_nodes is None:
-        return None, None, None, None
+        all_ast_edges = prepare_edges(all_ast_edges)
 
-    def decipher_node_name(name):
-        if name in all_name_mappings:
-            return all_name_mappings[name]
-        elif "@" in name:
-            for key, value in all_name_mappings.items():
-                if key in name:
-                    return name.replace(key, value)
-            return name
-        return name
+        if len(all_offsets) > 0:
+            all_offsets = pd.DataFrame(all_offsets)
+        else:
+            all_offsets = None
 
-    # all_ast_nodes["serialized_name"] = all_ast_nodes["serialized_name"].apply(decipher_node_name)
+        if len(all_name_mappings) > 0:
+            all_name_mappings = pd.DataFrame({
+                "ast_name": list(all_name_mappings.keys()),
+                "proper_names": list(all_name_mappings.values())
+            })
+        else:
+            all_name_mappings = None
 
-    def prepare_edges(all_ast_edges):
-        all_ast_edges = pd.DataFrame(all_ast_edges)
-        all_ast_edges.drop_duplicates(["type", "src", "dst"], inplace=True)
-        all_ast_edges = all_ast_edges.query("src != dst")
-        all_ast_edges["id"] = 0
-        all_ast_edges = all_ast_edges[["id", "type", "src", "dst", "file_id", "scope"]].rename({'src': 'source_node_id', 'dst': 'target_node_id', 'scope': 'mentioned_in'}, axis=1).astype(
-            {'file_id': 'Int32', "mentioned_in": 'Int32'}
-        )
-        return all_ast_edges
+        return all_ast_nodes, all_ast_edges, all_offsets, all_name_mappings
 
-    all_ast_edges = prepare_edges(all_ast_edges)
 
-    if len(all_offsets) > 0:
-        all_offsets = pd.DataFrame(all_offsets)
-    else:
-        all_offsets = None
+def get_ast_from_modules(
+        nodes, edges, source_location, occurrence, file_content,
+        bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False,
+        occurrence_index=None, package=None, parse_cache=None
+):
+    """
+    Create edges from source code and methe them wit hthe global graph. Prepare all offsets in the uniform format.
+    :param nodes: DataFrame with nodes
+    :param edges: DataFrame with edges
+    :param source_location: Dataframe that links nodes to source files
+    :param occurrence: Dataframe with records about occurrences
+    :param file_content: Dataframe with sources
+    :param bpe_tokenizer_path: path to sentencepiece model
+    :param create_subword_instances:
+    :param connect_subwords:
+    :param lang:
+    :param track_offsets:
+    :param occurrence_index: OccurrenceIndex shared with other extractors. Created from other arguments when None.
+    :param package: name of the package. Together with file id, used as the seed for identifiers of AST nodes, so
+        that the same package produces the same node names.
+    :param parse_cache: AstParseCache for reusing AST edges of modules that were processed before
+    :return: Tuple:
+        - Dataframe with all nodes. Schema: id, type, name, mentioned_in (global and AST)
+        - Dataframe with all edges. Schema: id, type, src, dst, file_id, mentioned_in
+        - Dataframe with all_offsets. Schema: file_id, start, end, node_id, mentioned_in
+    """
+    extractor = ModuleAstExtractor(
+        nodes, edges, source_location, occurrence, file_content,
+        bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=track_offsets,
+        occurrence_index=occurrence_index, package=package, parse_cache=parse_cache
+    )
 
-    if len(all_name_mappings) > 0:
-        all_name_mappings = pd.DataFrame({
-            "ast_name": list(all_name_mappings.keys()),
-            "proper_names": list(all_name_mappings.values())
-        })
-    else:
-        all_name_mappings = None
+    for group_ind, (file_id, file_occurrences) in custom_tqdm(
+            enumerate(extractor.occurrence_index), message="Processing modules",
+            total=len(extractor.occurrence_index)
+    ):
+        extractor.process_file(file_id, file_occurrences)
 
-    return all_ast_nodes, all_ast_edges, all_offsets, all_name_mappings
+    return extractor.finalize()
 
 
 class OccurrenceReplacer:
@@ -1194,7 +1259,7 @@ class OccurrenceReplacer:
         self.evicted = None
         self.edits = None
 
-        self._identifier_pool = IntIdentifierPool()
+        self._identifier_pool = CounterIdentifierPool()
 
     @staticmethod
     def format_offsets_for_replacements(offsets):
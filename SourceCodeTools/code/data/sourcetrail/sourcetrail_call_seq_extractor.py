@@ -1,5 +1,6 @@
-from SourceCodeTools.code.common import custom_tqdm, SQLTable
+from SourceCodeTools.code.common import custom_tqdm
 from SourceCodeTools.code.data.sourcetrail.common import *
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
 
 import sys
 
@@ -22,46 +23,55 @@ def sql_get_function_calls_from_range(occurrences, start, end):
     return df
 
 
-def extract_call_seq(nodes, edges, source_location, occurrence):
+def get_function_call_seq(file_occurrences, f_def):
+    """
+    :param file_occurrences: FileOccurrences for the file that contains the function
+    :param f_def: Sourcetrail occurrence of the function definition
+    :return: list of consecutive calls within the function
+    """
+    local_occurrences = file_occurrences.calls_from_range(start=f_def.start_line, end=f_def.end_line)
+    local_occurrences = sort_occurrences(local_occurrences)
 
-    occurrence_groups = get_occurrence_groups(nodes, edges, source_location, occurrence)
+    all_calls = get_function_calls(local_occurrences)
 
-    call_seq = []
+    return [{'src': all_calls[i], 'dst': all_calls[i + 1]} for i in range(len(all_calls) - 1)]
 
-    for grp_ind, (file_id, occurrences) in custom_tqdm(
-            enumerate(occurrence_groups), message="Extracting call sequences", total=len(occurrence_groups)
-    ):
 
-        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
+def create_call_seq_table(call_seq):
+    if len(call_seq) > 0:
+        call_seq = pd.DataFrame(call_seq).astype({
+            'src': 'int',
+            'dst': 'int'
+        })
+        return call_seq
+    else:
+        return None
 
-        function_definitions = sql_get_function_definitions(sql_occurrences)
 
-        if len(function_definitions):
-            for ind, f_def in function_definitions.iterrows():
-                local_occurrences = sql_get_function_calls_from_range(sql_occurrences, start=f_def.start_line, end=f_def.end_line)
-                local_occurrences = sort_occurrences(local_occurrences)
+def extract_call_seq(nodes, edges, source_location, occurrence, occurrence_index=None):
+    """
+    :param occurrence_index: OccurrenceIndex shared with other extractors. Created from other arguments when None.
+    """
+
+    if occurrence_index is None:
+        occurrence_index = OccurrenceIndex(nodes, edges, source_location, occurrence)
 
-                all_calls = get_function_calls(local_occurrences)
+    call_seq = []
 
-                for i in range(len(all_calls) - 1):
-                    call_seq.append({
-                        'src': all_calls[i],
-                        'dst': all_calls[i+1]
-                    })
+    for grp_ind, (file_id, file_occurrences) in custom_tqdm(
+            enumerate(occurrence_index), message="Extracting call sequences", total=len(occurrence_index)
+    ):
 
-        del sql_occurrences
+        function_definitions = file_occurrences.function_definitions()
+
+        if len(function_definitions):
+            for ind, f_def in function_definitions.iterrows():
+                call_seq.extend(get_function_call_seq(file_occurrences, f_def))
 
         # print(f"\r{grp_ind}/{len(occurrence_groups)}", end="")
     # print(" " * 30, end="\r")
 
-    if len(call_seq) > 0:
-        call_seq = pd.DataFrame(call_seq).astype({
-            'src': 'int',
-            'dst': 'int'
-        })
-        return call_seq
-    else:
-        return None
+    return create_call_seq_table(call_seq)
 
 
 if __name__ == "__main__":
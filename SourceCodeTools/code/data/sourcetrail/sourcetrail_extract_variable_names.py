@@ -8,6 +8,41 @@ from SourceCodeTools.code.data.file_utils import *
 
 pandas.options.mode.chained_assignment = None
 
+
+def get_python_variable_names(tree):
+    """
+    :param tree: parsed function body, or function definition node from the module tree. Decorators are not part
+        of the function body and are skipped for definition nodes.
+    :return: list of names that appear in the function
+    """
+    if isinstance(tree, (ast.FunctionDef, ast.AsyncFunctionDef)):
+        roots = [tree.args] + tree.body + ([tree.returns] if tree.returns is not None else [])
+    else:
+        roots = [tree]
+    return [n.id for root in roots for n in ast.walk(root) if type(n).__name__ == "Name"]
+
+
+def create_function_variable_pairs(func_var_pairs):
+    """
+    Keep only variables that appear in more than one function.
+    :param func_var_pairs: list of tuples (function id, variable name)
+    :return: Dataframe with columns src, dst or None
+    """
+    if func_var_pairs:
+        counter = Counter(map(lambda x: x[1], func_var_pairs))
+        pp = []
+        for func, var in func_var_pairs:
+            if counter[var] > 1:
+                pp.append({
+                    'src': func,
+                    'dst': var
+                })
+        pairs = pd.DataFrame(pp)
+        return pairs
+    else:
+        return None
+
+
 def extract_var_names(nodes, bodies, lang):
 
     if lang == "python":
@@ -40,7 +75,7 @@ def extract_var_names(nodes, bodies, lang):
         try:
             if lang == "python":
                 tree = ast.parse(row['body'].strip())
-                variables.extend([n.id for n in ast.walk(tree) if type(n).__name__ == "Name"])
+                variables.extend(get_python_variable_names(tree))
             elif lang == "java":
                 lines = row['body'].strip() #.split("\n")
                 tokens = java.lex(lines)
@@ -49,7 +84,7 @@ def extract_var_names(nodes, bodies, lang):
         except SyntaxError: # thrown by ast
             continue
 
-        for v in set(variables):
+        for v in sorted(set(variables)):
             if v not in variable_names:
                 variable_names[v] = id_offset
                 id_offset += 1
@@ -59,19 +94,7 @@ def extract_var_names(nodes, bodies, lang):
         # print(f"\r{body_ind}/{len(bodies)}", end="")
     # print(" " * 30, end ="\r")
 
-    if func_var_pairs:
-        counter = Counter(map(lambda x: x[1], func_var_pairs))
-        pp = []
-        for func, var in func_var_pairs:
-            if counter[var] > 1:
-                pp.append({
-                    'src': func,
-                    'dst': var
-                })
-        pairs = pd.DataFrame(pp)
-        return pairs
-    else:
-        return None
+    return create_function_variable_pairs(func_var_pairs)
 
 
 if __name__ == "__main__":
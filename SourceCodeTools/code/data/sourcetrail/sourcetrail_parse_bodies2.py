@@ -2,9 +2,9 @@ import ast
 import sys
 from typing import Tuple, List, Optional
 
-from SourceCodeTools.code.ast import has_valid_syntax
-from SourceCodeTools.code.common import custom_tqdm, SQLTable
+from SourceCodeTools.code.common import custom_tqdm
 from SourceCodeTools.code.data.sourcetrail.common import *
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
 from SourceCodeTools.code.annotator_utils import to_offsets
 
 pd.options.mode.chained_assignment = None  # default='warn'
@@ -48,12 +48,86 @@ def get_docstring_ast(body):
     try:
         # this does not work with java, docstring formats are different
         ast_parse = ast.parse(body.strip())
-        function_definitions = [node for node in ast_parse.body if isinstance(node, ast.FunctionDef)]
-        return ast.get_docstring(function_definitions[0])
+        return get_docstring_from_tree(ast_parse)
     except:
         return ""
 
 
+def get_docstring_from_tree(tree):
+    """
+    :param tree: either parsed function body (ast.Module) or function definition node taken from the module tree
+    :return: docstring of the function
+    """
+    try:
+        if isinstance(tree, ast.Module):
+            function_definitions = [node for node in tree.body if isinstance(node, ast.FunctionDef)]
+            return ast.get_docstring(function_definitions[0])
+        elif isinstance(tree, ast.FunctionDef):
+            return ast.get_docstring(tree)
+        return ""
+    except:
+        return ""
+
+
+def index_function_nodes(module_tree):
+    """
+    Collect function definitions from the module tree.
+    :param module_tree: parsed module
+    :return: dictionary from (start_line, start_col) of the `def` keyword to function definition node
+    """
+    return {
+        (node.lineno, node.col_offset): node
+        for node in ast.walk(module_tree) if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef))
+    }
+
+
+def find_function_node(body, f_def, function_nodes):
+    """
+    Find function definition node that has the same source as the body. Sourcetrail ranges of functions end where
+    the next definition starts, the node is returned only if the rest of the range has only blank lines and comments.
+    :param body: function body
+    :param f_def: Sourcetrail occurrence of the function definition
+    :param function_nodes: result of `index_function_nodes` for the module
+    :return: function definition node or None
+    """
+    node = function_nodes.get((f_def.start_line, f_def.start_column - 1))
+    if node is None:
+        return None
+
+    body_lines = body.split("\n")
+    last_line = node.end_lineno - f_def.start_line
+    if last_line >= len(body_lines):
+        return None
+    # ast offsets are in bytes
+    last_line_bytes = body_lines[last_line].encode("utf-8")
+    if len(last_line_bytes) < node.end_col_offset:
+        return None
+
+    tail = [last_line_bytes[node.end_col_offset:].decode("utf-8", errors="ignore")] + body_lines[last_line + 1:]
+    if any(line.strip() != "" and not line.strip().startswith("#") for line in tail):
+        return None
+    return node
+
+
+def parse_function_body(body, f_def=None, function_nodes=None):
+    """
+    Parse function body once. When the module that contains the function was already parsed and the body has the
+    same source as a function definition node from the module tree, the node is reused.
+    :param body: function body
+    :param f_def: Sourcetrail occurrence of the function definition
+    :param function_nodes: result of `index_function_nodes` for the module
+    :return: parsed body, or None if the body is not valid python
+    """
+    if function_nodes is not None and f_def is not None:
+        node = find_function_node(body, f_def, function_nodes)
+        if node is not None:
+            return node
+    try:
+        return ast.parse(body.strip())
+    except SyntaxError:
+        return None
+
+
 def get_function_body(file_content, file_id, start, end, s_col, e_col) -> str:
     # need to extract using offsets because last line can have content in it
     offsets = [(start, end, s_col, e_col, "body")]
@@ -96,7 +170,7 @@ def get_range_for_replacement(occurrence, start_col, end_col, line, nodeid2name)
         # return extended_range, name
 
 
-def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
+def process_body(body, local_occurrences, nodeid2name, f_id, f_start, docstring=None):
     """
     Extract the list
     :param body:
@@ -104,6 +178,7 @@ def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
     :param nodeid2name:
     :param f_id:
     :param f_start:
+    :param docstring: docstring of the function, extracted from the body when None
     :return:
     """
     body_lines = body.split("\n")
@@ -141,12 +216,44 @@ def process_body(body, local_occurrences, nodeid2name, f_id, f_start):
     return {
         "id": f_id,
         "body": body,
-        "docstring": get_docstring_ast(body),
+        "docstring": get_docstring_ast(body) if docstring is None else docstring,
         "replacement_list": list_of_replacements,
     }
 
 
-def process_bodies(nodes, edges, source_location, occurrence, file_content, lang):
+def process_function_definition(f_def, file_id, file_occurrences, file_content, nodeid2name, function_nodes=None):
+    """
+    Extract the body of a single function and replace Sourcetrail occurrences.
+    :param f_def: Sourcetrail occurrence of the function definition
+    :param file_id: id of the file that contains the function
+    :param file_occurrences: FileOccurrences for the file
+    :param file_content: dictionary from file id to file content
+    :param nodeid2name: dictionary from Sourcetrail node id to serialized name
+    :param function_nodes: function definitions of the already parsed module, see `index_function_nodes`
+    :return: tuple with processed body and parsed body. Both are None when the body is not valid python.
+    """
+    f_start = f_def.start_line
+    f_end = f_def.end_line
+
+    local_occurrences = file_occurrences.occurrences_from_range(start=f_start, end=f_end)
+
+    # move to zero-index
+    f_start -= 1
+    f_end -= 1
+
+    body = get_function_body(file_content, file_id, f_start, f_end, f_def.start_column-1, f_def.end_column)
+
+    tree = parse_function_body(body, f_def, function_nodes)
+    if tree is None:
+        return None, None
+
+    processed = process_body(
+        body, local_occurrences, nodeid2name, f_def.element_id, f_start, docstring=get_docstring_from_tree(tree)
+    )
+    return processed, tree
+
+
+def process_bodies(nodes, edges, source_location, occurrence, file_content, lang, occurrence_index=None):
     """
     :param nodes:
     :param edges:
@@ -154,11 +261,13 @@ def process_bodies(nodes, edges, source_location, occurrence, file_content, lang
     :param occurrence:
     :param file_content:
     :param lang:
+    :param occurrence_index: OccurrenceIndex shared with other extractors. Created from other arguments when None.
     :return: Dataframe with columns id, body, sourcetrail_node_offsets. Node offsets are not resolved from the
         global graph.
     """
 
-    occurrence_groups = get_occurrence_groups(nodes, edges, source_location, occurrence)
+    if occurrence_index is None:
+        occurrence_index = OccurrenceIndex(nodes, edges, source_location, occurrence)
 
     file_content = dict(zip(file_content["id"], file_content["content"]))
 
@@ -166,36 +275,20 @@ def process_bodies(nodes, edges, source_location, occurrence, file_content, lang
 
     nodeid2name = dict(zip(nodes['id'], nodes['serialized_name']))
 
-    for group_ind, (file_id, occurrences) in custom_tqdm(
-            enumerate(occurrence_groups), message="Processing function bodies", total=len(occurrence_groups)
+    for group_ind, (file_id, file_occurrences) in custom_tqdm(
+            enumerate(occurrence_index), message="Processing function bodies", total=len(occurrence_index)
     ):
-        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
-
-        function_definitions = sql_get_function_definitions(sql_occurrences)
+        function_definitions = file_occurrences.function_definitions()
 
         if len(function_definitions):
             for ind, f_def in function_definitions.iterrows():
-                f_start = f_def.start_line
-                f_end = f_def.end_line
-
-                local_occurrences = sql_get_occurrences_from_range(sql_occurrences, start=f_start, end=f_end)
-
-                # move to zero-index
-                f_start -= 1
-                f_end -= 1
-
-                body = get_function_body(file_content, file_id, f_start, f_end, f_def.start_column-1, f_def.end_column)
-
-                if not has_valid_syntax(body):
-                    continue
-
-                processed = process_body(body, local_occurrences, nodeid2name, f_def.element_id, f_start)
+                processed, _ = process_function_definition(
+                    f_def, file_id, file_occurrences, file_content, nodeid2name
+                )
 
                 if processed is not None:
                     bodies.append(processed)
 
-        del sql_occurrences
-
     if len(bodies) > 0:
         bodies_processed = pd.DataFrame(bodies)
         return bodies_processed
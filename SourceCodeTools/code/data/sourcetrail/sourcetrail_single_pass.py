@@ -0,0 +1,101 @@
+import ast
+
+from SourceCodeTools.code.ast import has_valid_syntax
+from SourceCodeTools.code.common import custom_tqdm
+from SourceCodeTools.code.data.sourcetrail.common import *
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges2 import ModuleAstExtractor
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import get_function_call_seq, \
+    create_call_seq_table
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_extract_variable_names import get_python_variable_names, \
+    create_function_variable_pairs
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_parse_bodies2 import process_function_definition, \
+    index_function_nodes
+
+
+def parse_module(source_file_content):
+    """
+    :param source_file_content: module source
+    :return: tuple with parsed module (None when parsing failed) and the flag that shows whether the module passes
+        `has_valid_syntax`
+    """
+    try:
+        return ast.parse(source_file_content), True
+    except SyntaxError:
+        # `has_valid_syntax` also accepts modules with leading indentation
+        return None, has_valid_syntax(source_file_content)
+
+
+def extract_single_pass(
+        nodes, edges, source_location, occurrence, file_content,
+        bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=False,
+        occurrence_index=None, package=None, parse_cache=None
+):
+    """
+    Fused version of `process_bodies`, `extract_call_seq`, `get_ast_from_modules`, and `extract_var_names` for
+    python. Every module is visited once: occurrences of the file are queried from the shared index, the module is
+    parsed once, and function definition nodes from the module tree are reused for checking syntax of function
+    bodies, extracting docstrings, and collecting variable names. Results are the same as for separate passes.
+    :param nodes: DataFrame with nodes
+    :param edges: DataFrame with edges, including reverse edges
+    :param source_location: Dataframe that links nodes to source files
+    :param occurrence: Dataframe with records about occurrences
+    :param file_content: Dataframe with sources
+    :param bpe_tokenizer_path: path to sentencepiece model
+    :param create_subword_instances:
+    :param connect_subwords:
+    :param lang: only python is supported
+    :param track_offsets:
+    :param occurrence_index: OccurrenceIndex shared with other extractors. Created from other arguments when None.
+        The index should be created before reverse edges are added.
+    :param package: name of the package, used as the seed for identifiers of AST nodes
+    :param parse_cache: AstParseCache for reusing AST edges of modules that were processed before
+    :return: Tuple with bodies, call_seq, ast_nodes, ast_edges, offsets, name_mappings, function_variable_pairs
+    """
+    if lang != "python":
+        raise ValueError(f"Single pass extraction is not supported for {lang}. Supported languages are: python")
+
+    ast_extractor = ModuleAstExtractor(
+        nodes, edges, source_location, occurrence, file_content,
+        bpe_tokenizer_path, create_subword_instances, connect_subwords, lang, track_offsets=track_offsets,
+        occurrence_index=occurrence_index, package=package, parse_cache=parse_cache
+    )
+    occurrence_index = ast_extractor.occurrence_index
+
+    file_content = dict(zip(file_content["id"], file_content["content"]))
+    nodeid2name = dict(zip(nodes['id'], nodes['serialized_name']))
+
+    bodies = []
+    call_seq = []
+    func_var_pairs = []
+
+    for group_ind, (file_id, file_occurrences) in custom_tqdm(
+            enumerate(occurrence_index), message="Processing modules", total=len(occurrence_index)
+    ):
+        module_tree, valid_syntax = parse_module(file_content[file_id])
+        function_nodes = index_function_nodes(module_tree) if module_tree is not None else None
+
+        function_definitions = file_occurrences.function_definitions()
+
+        for ind, f_def in function_definitions.iterrows():
+            call_seq.extend(get_function_call_seq(file_occurrences, f_def))
+
+            processed, tree = process_function_definition(
+                f_def, file_id, file_occurrences, file_content, nodeid2name, function_nodes=function_nodes
+            )
+            if processed is None:
+                continue
+
+            bodies.append(processed)
+            for v in sorted(set(get_python_variable_names(tree))):
+                func_var_pairs.append((processed["id"], v))
+
+        if valid_syntax:
+            ast_extractor.process_file(file_id, file_occurrences, check_syntax=False)
+
+    bodies = pd.DataFrame(bodies) if len(bodies) > 0 else None
+    call_seq = create_call_seq_table(call_seq)
+    ast_nodes, ast_edges, offsets, name_mappings = ast_extractor.finalize()
+    # variable names are extracted only when bodies are available, same as in the staged extraction
+    function_variable_pairs = create_function_variable_pairs(func_var_pairs) if bodies is not None else None
+
+    return bodies, call_seq, ast_nodes, ast_edges, offsets, name_mappings, function_variable_pairs
@@ -0,0 +1,46 @@
+import os
+from glob import glob
+
+import pandas as pd
+import pytest
+
+from SourceCodeTools.code.ast.python_ast2 import AstGraphGenerator, EdgeColumns, GEdge, GNode
+
+testdata = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "..", "res", "python_testdata")
+
+
+def as_dataframe(edges):
+    edge_columns = EdgeColumns()
+    edge_columns.extend(edges)
+    return edge_columns.to_dataframe()
+
+
+def test_edge_columns_match_dataframe_from_dicts():
+    a, b, scope = GNode(name="a", type="Name"), GNode(name="b", type="Name"), GNode(name="f", type="FunctionDef")
+    edges = [
+        GEdge(a, b, "next"),
+        GEdge(b, a, "prev", scope=scope, line=1, end_line=2, col_offset=0, end_col_offset=5),
+        GEdge(a, a, "defines", var_line=3, var_end_line=3, var_col_offset=4, var_end_col_offset=5),
+        GEdge(b, b, "next", line=4, end_line=4, col_offset=1, end_col_offset=2),
+    ]
+
+    expected = pd.DataFrame([edge.to_dict() for edge in edges])
+    pd.testing.assert_frame_equal(as_dataframe(edges), expected, check_dtype=False)
+
+
+def test_edge_columns_without_positions():
+    a, b = GNode(name="a", type="Name"), GNode(name="b", type="Name")
+    edges = [GEdge(a, b, "next"), GEdge(b, a, "prev")]
+
+    pd.testing.assert_frame_equal(as_dataframe(edges), pd.DataFrame([edge.to_dict() for edge in edges]))
+    assert len(as_dataframe([])) == 0
+
+
+@pytest.mark.parametrize("path", sorted(glob(os.path.join(testdata, "example_code", "*", "*.py"))))
+def test_edge_columns_match_dataframe_for_module(path):
+    # modules are parsed from the root node, same as in `AstProcessor`
+    generator = AstGraphGenerator(open(path).read())
+    edges, _ = generator.parse(generator.root)
+
+    expected = pd.DataFrame([edge.to_dict() for edge in edges])
+    pd.testing.assert_frame_equal(as_dataframe(edges), expected, check_dtype=False)
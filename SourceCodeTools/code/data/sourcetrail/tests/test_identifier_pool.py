@@ -0,0 +1,53 @@
+import re
+
+from SourceCodeTools.code.IdentifierPool import DeterministicIdentifierPool, IdentifierPool
+
+identifier_pattern = re.compile("0x[0-9a-f]{16}")
+
+
+def test_same_seed_produces_same_identifiers():
+    first = DeterministicIdentifierPool("package:1")
+    second = DeterministicIdentifierPool("package:1")
+    identifiers = [first.get_new_identifier() for _ in range(5)]
+
+    assert identifiers == [second.get_new_identifier() for _ in range(5)]
+    assert len(set(identifiers)) == 5
+    assert all(identifier_pattern.fullmatch(identifier) for identifier in identifiers)
+    # same format as random identifiers
+    assert identifier_pattern.fullmatch(IdentifierPool().get_new_identifier())
+
+
+def test_different_seeds_produce_different_identifiers():
+    first = DeterministicIdentifierPool("package:1")
+    second = DeterministicIdentifierPool("package:2")
+    assert first.get_new_identifier() != second.get_new_identifier()
+
+
+def test_pool_continues_sequence():
+    pool = DeterministicIdentifierPool("package:2")
+    identifiers = [pool.get_new_identifier() for _ in range(3)]
+
+    resumed = DeterministicIdentifierPool("package:2", num_identifiers=2)
+    assert resumed.get_new_identifier() == identifiers[2]
+
+
+def test_translate():
+    source = DeterministicIdentifierPool("cache_key")
+    target = DeterministicIdentifierPool("package:3")
+    source_identifiers = [source.get_new_identifier() for _ in range(3)]
+    target_identifiers = [target.get_new_identifier() for _ in range(3)]
+
+    text = f"x_{source_identifiers[2]} y_{source_identifiers[0]} z"
+    assert source.translate(text, target) == f"x_{target_identifiers[2]} y_{target_identifiers[0]} z"
+
+
+def test_translate_keeps_foreign_identifiers():
+    source = DeterministicIdentifierPool("cache_key2")
+    source.get_new_identifier()
+    # not created by the source pool yet
+    unused = DeterministicIdentifierPool("cache_key2", num_identifiers=1).get_new_identifier()
+    foreign = IdentifierPool().get_new_identifier()
+    target = DeterministicIdentifierPool("package:4")
+
+    text = f"{unused} {foreign} 0x12"
+    assert source.translate(text, target) == text
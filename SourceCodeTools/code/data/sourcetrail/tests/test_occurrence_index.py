@@ -0,0 +1,55 @@
+import os
+
+import pytest
+
+from SourceCodeTools.code.common import SQLTable
+from SourceCodeTools.code.data.sourcetrail.benchmark_occurrence_index import create_database_from_sources, \
+    read_sourcetrail_db
+from SourceCodeTools.code.data.sourcetrail.common import get_occurrence_groups, sql_get_function_definitions, \
+    sql_get_occurrences_from_range
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import sql_get_function_calls_from_range
+
+testdata = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "..", "res", "python_testdata")
+compared_columns = ["element_id", "start_line", "start_column", "end_line", "end_column"]
+
+
+def as_rows(occurrences):
+    return occurrences[compared_columns].values.tolist()
+
+
+def assert_index_matches_sql(db_path):
+    nodes, edges, source_location, occurrence = read_sourcetrail_db(db_path)
+    index = OccurrenceIndex(nodes, edges, source_location.copy(), occurrence)
+
+    num_functions = 0
+    for file_id, occurrences in get_occurrence_groups(nodes, edges, source_location.copy(), occurrence):
+        sql_occurrences = SQLTable(occurrences, ":memory:", "occurrences")
+        file_occurrences = index[file_id]
+
+        sql_definitions = sql_get_function_definitions(sql_occurrences)
+        definitions = file_occurrences.function_definitions()
+        assert as_rows(definitions) == as_rows(sql_definitions)
+
+        for _, f_def in sql_definitions.iterrows():
+            assert as_rows(file_occurrences.occurrences_from_range(f_def.start_line, f_def.end_line)) == \
+                   as_rows(sql_get_occurrences_from_range(sql_occurrences, f_def.start_line, f_def.end_line))
+            assert as_rows(file_occurrences.calls_from_range(f_def.start_line, f_def.end_line)) == \
+                   as_rows(sql_get_function_calls_from_range(sql_occurrences, f_def.start_line, f_def.end_line))
+            num_functions += 1
+        del sql_occurrences
+
+    assert len(index) == len(list(index))
+    return num_functions
+
+
+@pytest.mark.parametrize("environment", ["example", "example2"])
+def test_occurrence_index_matches_sql(environment):
+    db_path = os.path.join(testdata, "example_environment", environment, f"{environment}.srctrldb")
+    assert assert_index_matches_sql(db_path) > 0
+
+
+def test_occurrence_index_matches_sql_on_generated_database(tmp_path):
+    db_path = str(tmp_path / "example_code.srctrldb")
+    create_database_from_sources(os.path.join(testdata, "example_code"), db_path)
+    assert assert_index_matches_sql(db_path) > 0
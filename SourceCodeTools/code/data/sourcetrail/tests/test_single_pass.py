@@ -0,0 +1,123 @@
+import ast
+import os
+import sqlite3
+from os.path import join
+
+import pandas as pd
+import pytest
+
+from SourceCodeTools.code.data.file_utils import filenames, unpersist_if_present, read_element_component
+from SourceCodeTools.code.data.sourcetrail.occurrence_index import OccurrenceIndex
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_add_reverse_edges import add_reverse_edges
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_ast_edges2 import get_ast_from_modules
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_call_seq_extractor import extract_call_seq
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_decode_edge_types import decode_edge_types
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_extract_variable_names import extract_var_names, \
+    get_python_variable_names
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_filter_ambiguous_edges import filter_ambiguous_edges
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_node_name_merge import merge_names
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_parse_bodies2 import process_bodies, index_function_nodes, \
+    find_function_node, get_function_body
+from SourceCodeTools.code.data.sourcetrail.sourcetrail_single_pass import extract_single_pass
+
+testdata = os.path.join(os.path.dirname(__file__), "..", "..", "..", "..", "..", "res", "python_testdata")
+
+sourcetrail_tables = {
+    "node": "nodes_csv",
+    "edge": "edges_csv",
+    "element_component": "element_component",
+    "source_location": "source_location",
+    "occurrence": "occurrence",
+    "filecontent": "filecontent",
+}
+
+
+def read_environment(environment, working_directory):
+    """
+    Export tables of Sourcetrail database the same way as preprocessing scripts do and read them the same way as
+    `DatasetCreator`.
+    """
+    conn = sqlite3.connect(join(testdata, "example_environment", environment, f"{environment}.srctrldb"))
+    for table, name in sourcetrail_tables.items():
+        pd.read_sql(f"select * from {table}", conn).to_csv(join(working_directory, filenames[name]), index=False)
+    conn.close()
+
+    nodes = merge_names(join(working_directory, filenames["nodes_csv"]))
+    edges = decode_edge_types(join(working_directory, filenames["edges_csv"]))
+    source_location = unpersist_if_present(join(working_directory, filenames["source_location"]))
+    occurrence = unpersist_if_present(join(working_directory, filenames["occurrence"]))
+    filecontent = unpersist_if_present(join(working_directory, filenames["filecontent"]))
+    edges = filter_ambiguous_edges(edges, read_element_component(working_directory))
+    return nodes, edges, source_location, occurrence, filecontent
+
+
+def extract_staged(nodes, edges, source_location, occurrence, filecontent, package):
+    occurrence_index = OccurrenceIndex(nodes, edges, source_location.copy(), occurrence)
+    bodies = process_bodies(
+        nodes, edges, source_location, occurrence, filecontent, "python", occurrence_index=occurrence_index
+    )
+    call_seq = extract_call_seq(nodes, edges, source_location, occurrence, occurrence_index=occurrence_index)
+    edges = add_reverse_edges(edges)
+    ast_nodes, ast_edges, offsets, name_mappings = get_ast_from_modules(
+        nodes, edges, source_location, occurrence, filecontent, None, False, False, "python", track_offsets=True,
+        occurrence_index=occurrence_index, package=package
+    )
+    variables = extract_var_names(nodes, bodies, "python") if bodies is not None else None
+    return bodies, call_seq, ast_nodes, ast_edges, offsets, name_mappings, variables
+
+
+def extract_fused(nodes, edges, source_location, occurrence, filecontent, package):
+    occurrence_index = OccurrenceIndex(nodes, edges, source_location.copy(), occurrence)
+    edges = add_reverse_edges(edges)
+    return extract_single_pass(
+        nodes, edges, source_location, occurrence, filecontent, None, False, False, "python", track_offsets=True,
+        occurrence_index=occurrence_index, package=package
+    )
+
+
+def assert_same(staged, fused):
+    if staged is None or fused is None:
+        assert staged is None and fused is None
+    elif isinstance(staged, pd.DataFrame):
+        pd.testing.assert_frame_equal(staged.reset_index(drop=True), fused.reset_index(drop=True))
+    else:
+        assert staged == fused
+
+
+@pytest.mark.parametrize("environment", ["example", "example2"])
+def test_single_pass_matches_staged_extraction(environment, tmp_path):
+    tables = read_environment(environment, str(tmp_path))
+
+    staged = extract_staged(*(table.copy() for table in tables), package=environment)
+    fused = extract_fused(*(table.copy() for table in tables), package=environment)
+
+    for staged_output, fused_output in zip(staged, fused):
+        assert_same(staged_output, fused_output)
+
+
+def test_function_nodes_are_reused(tmp_path):
+    nodes, edges, source_location, occurrence, filecontent = read_environment("example", str(tmp_path))
+    file_content = dict(zip(filecontent["id"], filecontent["content"]))
+
+    num_functions = num_reused = 0
+    for file_id, file_occurrences in OccurrenceIndex(nodes, edges, source_location, occurrence):
+        function_nodes = index_function_nodes(ast.parse(file_content[file_id]))
+        for _, f_def in file_occurrences.function_definitions().iterrows():
+            body = get_function_body(
+                file_content, file_id, f_def.start_line - 1, f_def.end_line - 1, f_def.start_column - 1,
+                f_def.end_column
+            )
+            num_functions += 1
+            num_reused += find_function_node(body, f_def, function_nodes) is not None
+
+    # Sourcetrail ranges end where the next definition starts, nodes are still found by start position
+    assert num_functions > 0 and num_reused == num_functions
+
+
+def test_variable_names_of_reused_node_skip_decorators():
+    source = "class A:\n    @property\n    def value(self, default=None) -> int:\n        return self.x or default\n"
+    function_node = index_function_nodes(ast.parse(source))[(3, 4)]
+    body = "\n".join(source.split("\n")[2:])
+
+    assert sorted(get_python_variable_names(function_node)) == \
+           sorted(get_python_variable_names(ast.parse(body.strip())))
@@ -1,6 +1,5 @@
 # %%
 import json
-from typing import Iterable
 
 import pandas
 from os.path import join
@@ -12,6 +11,7 @@ import numpy as np
 from SourceCodeTools.code.data.dataset.Dataset import filter_dst_by_freq
 from SourceCodeTools.code.data.file_utils import unpersist
 from SourceCodeTools.models.Embedder import Embedder
+from SourceCodeTools.models.EmbeddingStore import load_embedder
 import pickle
 
 from SourceCodeTools.tabular.common import compact_property
@@ -84,9 +84,7 @@ class Experiments:
         # self.splits = torch.load(os.path.join(self.base_path, "state_dict.pt"))["splits"]
 
         if base_path is not None:
-            self.embed = pickle.load(open(embeddings_path, "rb"))
-            if isinstance(self.embed, Iterable):
-                self.embed = self.embed[gnn_layer]
+            self.embed = load_embedder(embeddings_path, layer=gnn_layer)
             # alternative_nodes = pickle.load(open("nodes.pkl", "rb"))
             # self.embed.e = alternative_nodes
             # self.embed.e = np.random.randn(self.embed.e.shape[0], self.embed.e.shape[1])
@@ -0,0 +1,337 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+import time
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+
+from SourceCodeTools.models.EmbeddingStore import EmbeddingStore, load_embedder
+from SourceCodeTools.models.graph.train.AnnIndex import approximate_indices, create_approximate_index, \
+    parse_index_spec
+from SourceCodeTools.models.graph.train.Scorer import Brute, FaissIndex
+
+
+class EmbeddingQueryEngine:
+    """
+    Answers batched `get` and `knn` queries over an `Embedder` or `EmbeddingStore`. Nearest neighbours are found
+    with the index backends used by `Scorer`.
+    """
+    def __init__(self, embedder, index="brute", method="inner_prod", device="cpu"):
+        """
+        :param embedder: Embedder or EmbeddingStore
+        :param index: brute|faiss or specification of an approximate index, see `parse_index_spec`
+        :param method: inner_prod or l2
+        :param device: device for torch-based indices
+        """
+        self.embedder = embedder
+        self.method = method
+
+        if isinstance(embedder, EmbeddingStore):
+            self.ids_by_row = np.asarray(embedder.ids)
+        else:
+            self.ids_by_row = np.empty(embedder.n_embs, dtype=object)
+            for key, row in embedder.ind.items():
+                self.ids_by_row[row] = key
+
+        self.index = self.create_index(index, np.asarray(embedder.e, dtype=np.float32), method, device)
+
+    @staticmethod
+    def create_index(index, X, method, device):
+        if index == "brute":
+            return Brute(X, method=method, device=device)
+        elif index == "faiss":
+            return FaissIndex(X, method=method)
+        elif parse_index_spec(index)[0] in approximate_indices:
+            return create_approximate_index(index, X, method=method, device=device)
+        else:
+            raise ValueError(
+                f"Unsupported index: {index}. Supported indices are: brute|faiss|{'|'.join(approximate_indices)}"
+            )
+
+    def rows(self, ids):
+        """
+        :return: rows of the embedding matrix and boolean array that tells which ids were found
+        """
+        if isinstance(self.embedder, EmbeddingStore):
+            return self.embedder.positions(ids)
+        ind = self.embedder.ind
+        rows = np.fromiter((ind.get(id_, -1) for id_ in ids), dtype=np.int64, count=len(ids))
+        return np.maximum(rows, 0), rows != -1
+
+    def get(self, ids):
+        """
+        :param ids: list of ids
+        :return: matrix with embeddings, rows for missing ids are filled with nan, and boolean array of found ids
+        """
+        rows, found = self.rows(ids)
+        embeddings = np.asarray(self.embedder.e[rows], dtype=np.float32)
+        embeddings[~found] = np.nan
+        return embeddings, found
+
+    def knn(self, vectors, k):
+        """
+        :param vectors: matrix with query vectors
+        :param k: number of neighbours
+        :return: arrays with ids and scores (distances for l2) of neighbours, shape (len(vectors), k)
+        """
+        scores, rows = self.index.query(vectors, k=k)
+        neighbour_ids = self.ids_by_row[np.maximum(rows, 0)]
+        # missing neighbours of approximate indices have row -1
+        if np.any(rows < 0):
+            neighbour_ids = neighbour_ids.astype(object)
+            neighbour_ids[rows < 0] = None
+        return neighbour_ids, scores
+
+
+class MicroBatcher:
+    """
+    Collects requests from concurrent clients and executes them in batches. A batch is executed when it reaches
+    `max_batch_size` query rows or when the oldest request waited for `max_wait` seconds.
+    """
+    def __init__(self, engine, max_batch_size=256, max_wait=0.002):
+        self.engine = engine
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, kind, payload, k=None):
+        """
+        :param kind: get or knn
+        :param payload: list of ids for `get`, matrix with query vectors for `knn`
+        :param k: number of neighbours for `knn`
+        :return: Future with the result
+        """
+        future = Future()
+        self.requests.put((kind, payload, k, future))
+        return future
+
+    def _collect(self):
+        batch = [self.requests.get()]
+        num_rows = len(batch[0][1])
+        deadline = time.monotonic() + self.max_wait
+        while num_rows < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(request)
+            num_rows += len(request[1])
+        return batch
+
+    def _execute(self, kind, requests):
+        sizes = [len(payload) for _, payload, _, _ in requests]
+        offsets = np.cumsum([0] + sizes)
+
+        if kind == "get":
+            ids = [id_ for _, payload, _, _ in requests for id_ in payload]
+            embeddings, found = self.engine.get(ids)
+            results = [(embeddings[s: e], found[s: e]) for s, e in zip(offsets[:-1], offsets[1:])]
+        else:
+            k = max(request_k for _, _, request_k, _ in requests)
+            vectors = np.concatenate([payload for _, payload, _, _ in requests], axis=0)
+            neighbour_ids, scores = self.engine.knn(vectors, k)
+            results = [
+                (neighbour_ids[s: e, :request_k], scores[s: e, :request_k])
+                for (_, _, request_k, _), s, e in zip(requests, offsets[:-1], offsets[1:])
+            ]
+
+        for (_, _, _, future), result in zip(requests, results):
+            future.set_result(result)
+
+    def _execute_isolated(self, kind, requests):
+        """
+        Execute requests together. When the batch fails, requests are executed one by one, so that an invalid
+        request does not fail other requests from the same batch.
+        """
+        try:
+            self._execute(kind, requests)
+            return
+        except Exception as e:
+            if len(requests) == 1:
+                _, _, _, future = requests[0]
+                if not future.done():
+                    future.set_exception(e)
+                return
+
+        for request in requests:
+            self._execute_isolated(kind, [request])
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            for kind in ["get", "knn"]:
+                requests = [request for request in batch if request[0] == kind]
+                if len(requests) == 0:
+                    continue
+                self._execute_isolated(kind, requests)
+
+
+def to_json_ids(ids):
+    return [id_.item() if isinstance(id_, np.generic) else id_ for id_ in ids]
+
+
+class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+    """
+    Endpoints:
+        GET /info - number and dimensionality of embeddings
+        POST /get {"ids": [...]} - embeddings for ids, null for missing ids
+        POST /knn {"ids": [...] | "vectors": [[...]], "k": 10} - ids and scores of nearest neighbours, `k` is
+            limited by the number of embeddings
+    Invalid requests receive status 400, unexpected failures receive status 500.
+    """
+    # keep connections open between requests of the same client
+    protocol_version = "HTTP/1.1"
+    batcher = None
+    engine = None
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def _send(self, code, response):
+        body = json.dumps(response).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == "/info":
+            self._send(200, {"n_embs": self.engine.embedder.n_embs, "n_dims": self.engine.embedder.n_dims})
+        else:
+            self._send(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def do_POST(self):
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            if self.path == "/get":
+                response = self.handle_get(request)
+            elif self.path == "/knn":
+                response = self.handle_knn(request)
+            else:
+                self._send(404, {"error": f"Unknown endpoint: {self.path}"})
+                return
+        except (KeyError, ValueError, TypeError) as e:
+            self._send(400, {"error": repr(e)})
+            return
+        except Exception as e:
+            logging.exception(f"Failed to process request to {self.path}")
+            self._send(500, {"error": repr(e)})
+            return
+        self._send(200, response)
+
+    @staticmethod
+    def get_ids(request):
+        ids = request["ids"]
+        if not isinstance(ids, list) or len(ids) == 0:
+            raise ValueError("Field `ids` should be a non-empty list")
+        if not all(isinstance(id_, (int, str)) and not isinstance(id_, bool) for id_ in ids):
+            raise TypeError("Ids should be integers or strings")
+        return ids
+
+    def get_k(self, request):
+        k = request.get("k", 10)
+        if not isinstance(k, int) or isinstance(k, bool) or k < 1:
+            raise ValueError(f"Number of neighbours should be a positive integer, received: {k!r}")
+        return min(k, self.engine.embedder.n_embs)
+
+    def handle_get(self, request):
+        embeddings, found = self.batcher.submit("get", self.get_ids(request)).result()
+        return {
+            "embeddings": [vector if is_found else None for vector, is_found in zip(embeddings.tolist(), found)]
+        }
+
+    def handle_knn(self, request):
+        k = self.get_k(request)
+        if "vectors" in request:
+            vectors = np.asarray(request["vectors"], dtype=np.float32)
+        else:
+            ids = self.get_ids(request)
+            vectors, found = self.batcher.submit("get", ids).result()
+            if not np.all(found):
+                raise KeyError(f"Unknown ids: {[id_ for id_, f in zip(ids, found) if not f]}")
+        if vectors.ndim != 2 or vectors.shape[0] == 0 or vectors.shape[1] != self.engine.embedder.n_dims:
+            raise ValueError(f"Query vectors should have shape (n, {self.engine.embedder.n_dims}) with n > 0")
+        if not np.all(np.isfinite(vectors)):
+            raise ValueError("Query vectors should not contain nan or inf")
+
+        neighbour_ids, scores = self.batcher.submit("knn", vectors, k=k).result()
+        return {"ids": [to_json_ids(row) for row in neighbour_ids], "scores": scores.tolist()}
+
+
+class ThreadingUnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def get_request(self):
+        request, _ = super(ThreadingUnixHTTPServer, self).get_request()
+        # BaseHTTPRequestHandler expects client address to be a (host, port) tuple
+        return request, ("unix", 0)
+
+
+def create_server(engine, host="127.0.0.1", port=8765, socket_path=None, max_batch_size=256, max_wait=0.002):
+    """
+    Create HTTP server for embedding queries. Call `serve_forever` to start serving.
+    :param engine: EmbeddingQueryEngine
+    :param host: host for TCP server, should be a local address
+    :param port: port for TCP server
+    :param socket_path: when provided, the server listens on this Unix socket instead of TCP
+    :param max_batch_size: maximum number of query rows in a batch
+    :param max_wait: maximum time in seconds a request waits for other requests to form a batch
+    :return: server object
+    """
+    handler = type("BoundEmbeddingRequestHandler", (EmbeddingRequestHandler,), {
+        "engine": engine,
+        "batcher": MicroBatcher(engine, max_batch_size=max_batch_size, max_wait=max_wait),
+    })
+
+    if socket_path is not None:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        return ThreadingUnixHTTPServer(socket_path, handler)
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve embedding lookups and nearest neighbour queries")
+    parser.add_argument("embeddings", help="Path to embedding store directory or Embedder pickle")
+    parser.add_argument("--layer", default=-1, type=int, help="Embedder to use when pickle contains a list")
+    parser.add_argument("--index", default="brute", type=str,
+                        help=f"Nearest neighbour index: brute|faiss|{'|'.join(approximate_indices)}")
+    parser.add_argument("--method", default="inner_prod", type=str, help="inner_prod|l2")
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--socket", default=None, type=str, help="Listen on Unix socket instead of TCP")
+    parser.add_argument("--max_batch_size", default=256, type=int)
+    parser.add_argument("--max_wait_ms", default=2., type=float)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    engine = EmbeddingQueryEngine(
+        load_embedder(args.embeddings, layer=args.layer), index=args.index, method=args.method, device=args.device
+    )
+    server = create_server(
+        engine, host=args.host, port=args.port, socket_path=args.socket, max_batch_size=args.max_batch_size,
+        max_wait=args.max_wait_ms / 1000
+    )
+    logging.info(f"Serving {engine.embedder.n_embs} embeddings on {args.socket or f'{args.host}:{args.port}'}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
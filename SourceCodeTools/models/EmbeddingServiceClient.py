@@ -0,0 +1,90 @@
+import http.client
+import json
+import socket
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, socket_path, timeout=None):
+        super(UnixHTTPConnection, self).__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        if self.timeout is not None:
+            self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+class EmbeddingServiceClient:
+    """
+    Client for the embedding query service started with `SourceCodeTools.models.EmbeddingService`. The connection
+    is kept open between requests. The client is not thread-safe, create one client per thread.
+    """
+    def __init__(self, host="127.0.0.1", port=8765, socket_path=None, timeout=None):
+        """
+        :param host: host of TCP server
+        :param port: port of TCP server
+        :param socket_path: path to Unix socket, used instead of host and port when provided
+        :param timeout: socket timeout in seconds
+        """
+        if socket_path is not None:
+            self.connection = UnixHTTPConnection(socket_path, timeout=timeout)
+        else:
+            self.connection = http.client.HTTPConnection(host, port, timeout=timeout)
+
+    def _request(self, method, path, payload=None):
+        body = None if payload is None else json.dumps(payload)
+        headers = {} if payload is None else {"Content-Type": "application/json"}
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+        except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+            # server closed idle connection, retry once with a new connection
+            self.connection.close()
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+
+        result = json.loads(response.read())
+        if response.status != 200:
+            raise ValueError(f"Request to {path} failed with status {response.status}: {result.get('error')}")
+        return result
+
+    def info(self):
+        """
+        :return: dictionary with number of embeddings `n_embs` and their dimensionality `n_dims`
+        """
+        return self._request("GET", "/info")
+
+    def get(self, ids):
+        """
+        :param ids: list of ids
+        :return: list of embeddings, None for missing ids
+        """
+        return self._request("POST", "/get", {"ids": list(ids)})["embeddings"]
+
+    def knn(self, ids=None, vectors=None, k=10):
+        """
+        Find nearest neighbours for ids or for query vectors.
+        :param ids: list of ids
+        :param vectors: list of query vectors
+        :param k: number of neighbours
+        :return: lists of neighbour ids and lists of their scores for every query
+        """
+        assert (ids is None) != (vectors is None), "Provide either ids or vectors"
+        payload = {"k": k}
+        if ids is not None:
+            payload["ids"] = list(ids)
+        else:
+            payload["vectors"] = [list(map(float, vector)) for vector in vectors]
+        result = self._request("POST", "/knn", payload)
+        return result["ids"], result["scores"]
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
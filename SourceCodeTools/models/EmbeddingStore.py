@@ -0,0 +1,238 @@
+import os
+import pickle
+from os.path import join, isdir, isfile
+
+import numpy as np
+
+
+class IdMap:
+    """
+    Read-only mapping from ids to rows of `EmbeddingStore`. Can be used in place of `Embedder.ind`.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, key):
+        pos, found = self.store.positions([key])
+        if not found[0]:
+            raise KeyError(key)
+        return int(pos[0])
+
+    def get(self, key, default=None):
+        pos, found = self.store.positions([key])
+        return int(pos[0]) if found[0] else default
+
+    def __contains__(self, key):
+        return key in self.store
+
+    def __len__(self):
+        return self.store.n_embs
+
+    def __iter__(self):
+        return iter(self.store.ids.tolist())
+
+    def keys(self):
+        return self.store.ids.tolist()
+
+    def values(self):
+        return range(self.store.n_embs)
+
+    def items(self):
+        return zip(self.keys(), self.values())
+
+
+class InverseIdMap:
+    """
+    Read-only mapping from rows of `EmbeddingStore` to ids. Can be used in place of `Embedder.inv`.
+    """
+    def __init__(self, store):
+        self.store = store
+
+    def __getitem__(self, row):
+        return int(self.store.ids[row])
+
+    def __len__(self):
+        return self.store.n_embs
+
+
+class EmbeddingStore:
+    """
+    Embeddings stored in a directory as a sorted array of int64 ids and a matrix where row `i` is the embedding
+    of the id `i`. Both files are opened as memory-mapped arrays on first access, so that large embedding tables open
+    instantly and pages are shared between processes. Ids are looked up in batches with `np.searchsorted`.
+    Provides the same interface as `Embedder`.
+    """
+
+    ids_filename = "ids.npy"
+    embeddings_filename = "embeddings.npy"
+
+    def __init__(self, path):
+        """
+        :param path: directory created with `EmbeddingStore.write`
+        """
+        self.path = path
+        self._ids = None
+        self._e = None
+
+    def __getstate__(self):
+        # only the location is pickled, arrays are opened again after unpickling
+        return {"path": self.path}
+
+    def __setstate__(self, state):
+        self.__init__(state["path"])
+
+    @classmethod
+    def is_store(cls, path):
+        return isdir(path) and isfile(join(path, cls.ids_filename)) and isfile(join(path, cls.embeddings_filename))
+
+    @classmethod
+    def write(cls, path, ids, embeddings, rows=None, dtype=None, chunk_size=2 ** 16):
+        """
+        Create embedding store. Rows of the embedding matrix are copied in chunks, so the source can be a
+        memory-mapped array larger than memory.
+        :param path: destination directory
+        :param ids: array of int64 ids
+        :param embeddings: matrix with embeddings
+        :param rows: row of `embeddings` for every id. When None, `ids[i]` corresponds to row `i`.
+        :param dtype: data type of stored embeddings, the type of `embeddings` when None
+        :param chunk_size: number of rows copied at once
+        :return: EmbeddingStore
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        if rows is None:
+            rows = np.arange(len(ids), dtype=np.int64)
+        rows = np.asarray(rows, dtype=np.int64)
+        assert len(rows) == len(ids)
+
+        order = np.argsort(ids, kind="stable")
+        sorted_ids = ids[order]
+        if np.any(sorted_ids[1:] == sorted_ids[:-1]):
+            raise ValueError("Embedding ids should be unique")
+
+        if not isdir(path):
+            os.makedirs(path)
+
+        np.save(join(path, cls.ids_filename), sorted_ids)
+
+        source_rows = rows[order]
+        output = np.lib.format.open_memmap(
+            join(path, cls.embeddings_filename), mode="w+", dtype=dtype or embeddings.dtype,
+            shape=(len(ids), embeddings.shape[1])
+        )
+        for start in range(0, len(source_rows), chunk_size):
+            chunk = source_rows[start: start + chunk_size]
+            output[start: start + len(chunk)] = np.asarray(embeddings[chunk])
+        output.flush()
+        del output
+
+        return cls(path)
+
+    @classmethod
+    def from_embedder(cls, embedder, path, dtype=None):
+        """
+        Convert `Embedder` with integer ids into embedding store.
+        """
+        ids = np.fromiter(embedder.ind.keys(), dtype=np.int64, count=len(embedder.ind))
+        rows = np.fromiter(embedder.ind.values(), dtype=np.int64, count=len(embedder.ind))
+        return cls.write(path, ids, np.asarray(embedder.e), rows=rows, dtype=dtype)
+
+    @property
+    def ids(self):
+        if self._ids is None:
+            self._ids = np.load(join(self.path, self.ids_filename), mmap_mode="r")
+        return self._ids
+
+    @property
+    def e(self):
+        if self._e is None:
+            self._e = np.load(join(self.path, self.embeddings_filename), mmap_mode="r")
+        return self._e
+
+    @property
+    def ind(self):
+        return IdMap(self)
+
+    @property
+    def inv(self):
+        return InverseIdMap(self)
+
+    def positions(self, keys):
+        """
+        Find rows for ids.
+        :param keys: iterable with ids
+        :return: array of rows and boolean array that tells which ids were found
+        """
+        keys = np.asarray(keys)
+        if not np.issubdtype(keys.dtype, np.integer):
+            # ids of other types are never present in the store
+            return np.zeros(keys.shape, dtype=np.int64), np.zeros(keys.shape, dtype=np.bool_)
+
+        ids = self.ids
+        if len(ids) == 0:
+            return np.zeros(keys.shape, dtype=np.int64), np.zeros(keys.shape, dtype=np.bool_)
+
+        pos = np.minimum(np.searchsorted(ids, keys), len(ids) - 1)
+        return pos, ids[pos] == keys
+
+    def lookup(self, keys, default=None):
+        """
+        Return embeddings for a batch of ids.
+        :param keys: iterable with ids
+        :param default: vector returned for missing ids. When None, missing ids raise KeyError.
+        :return: matrix with embeddings
+        """
+        pos, found = self.positions(keys)
+        if default is None:
+            if not np.all(found):
+                raise KeyError(np.asarray(keys)[~found][0])
+            return np.asarray(self.e[pos])
+
+        embeddings = np.asarray(self.e[pos])
+        embeddings[~found] = default
+        return embeddings
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            pos, found = self.positions([key])
+            if not found[0]:
+                raise KeyError(key)
+            return np.asarray(self.e[pos[0], :])
+        elif isinstance(key, (np.ndarray, list)):
+            return self.lookup(key)
+        else:
+            raise TypeError("Unknown type:", type(key))
+
+    def __contains__(self, item):
+        return bool(self.positions([item])[1][0])
+
+    def keys(self):
+        return self.ids
+
+    def get(self, item, default):
+        return self[item] if item in self else default
+
+    @property
+    def n_embs(self):
+        return len(self.ids)
+
+    @property
+    def n_dims(self):
+        return self.e.shape[1]
+
+
+def load_embedder(path, layer=-1):
+    """
+    Load embeddings stored as `EmbeddingStore` directory or as pickled `Embedder`. Pickles can contain a list of
+    embedders, one for every layer.
+    :param path: path to embedding store directory or pickle file
+    :param layer: embedder to return when pickle contains a list
+    :return: EmbeddingStore or Embedder
+    """
+    if EmbeddingStore.is_store(path):
+        return EmbeddingStore(path)
+
+    with open(path, "rb") as source:
+        embedder = pickle.load(source)
+    if isinstance(embedder, list):
+        embedder = embedder[layer]
+    return embedder
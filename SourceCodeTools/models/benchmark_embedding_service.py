@@ -0,0 +1,130 @@
+import argparse
+import logging
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from SourceCodeTools.models.EmbeddingServiceClient import EmbeddingServiceClient
+
+
+def start_local_service(num_vectors, dim, index, method, device, max_batch_size, max_wait, socket_path, port, store_dir):
+    """
+    Create embedding store with synthetic embeddings and serve it from a background thread.
+    """
+    from SourceCodeTools.models.EmbeddingService import EmbeddingQueryEngine, create_server
+    from SourceCodeTools.models.EmbeddingStore import EmbeddingStore
+    from SourceCodeTools.models.graph.train.benchmark_nn_index import create_clustered_vectors
+
+    logging.info(f"Creating {num_vectors} embeddings with {dim} dimensions")
+    store = EmbeddingStore.write(
+        store_dir, np.arange(num_vectors, dtype=np.int64), create_clustered_vectors(num_vectors, dim)
+    )
+    engine = EmbeddingQueryEngine(store, index=index, method=method, device=device)
+    server = create_server(
+        engine, port=port, socket_path=socket_path, max_batch_size=max_batch_size, max_wait=max_wait
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def run_client(client_args, request, num_requests, latencies, errors):
+    with EmbeddingServiceClient(**client_args) as client:
+        for _ in range(num_requests):
+            start = time.perf_counter()
+            try:
+                request(client)
+            except Exception as e:
+                errors.append(e)
+                continue
+            latencies.append(time.perf_counter() - start)
+
+
+def run_load_test(name, client_args, request, num_clients, requests_per_client):
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(target=run_client, args=(client_args, request, requests_per_client, latencies, errors))
+        for _ in range(num_clients)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    if len(latencies) == 0:
+        logging.error(f"{name}: all requests failed, first error: {errors[0]!r}")
+        return
+    latencies = np.array(latencies) * 1000
+    logging.info(
+        f"{name}: {len(latencies)} requests, {num_clients} clients, p50 {np.percentile(latencies, 50):.2f} ms, "
+        f"p99 {np.percentile(latencies, 99):.2f} ms, {len(latencies) / elapsed:.1f} QPS, {len(errors)} errors"
+    )
+
+
+def run_benchmark(client_args, num_clients, requests_per_client, ids_per_request, k):
+    with EmbeddingServiceClient(**client_args) as client:
+        info = client.info()
+    logging.info(f"Service has {info['n_embs']} embeddings with {info['n_dims']} dimensions")
+
+    with EmbeddingServiceClient(**client_args) as client:
+        known_ids = client.knn(vectors=np.random.normal(size=(1, info["n_dims"])), k=1000)[0][0]
+    known_ids = [id_ for id_ in known_ids if id_ is not None]
+    rng = np.random.default_rng(42)
+
+    def sample_ids():
+        return rng.choice(known_ids, ids_per_request).tolist()
+
+    def get_request(client):
+        client.get(sample_ids())
+
+    def knn_ids_request(client):
+        client.knn(ids=sample_ids(), k=k)
+
+    def knn_vectors_request(client):
+        client.knn(vectors=rng.normal(size=(ids_per_request, info["n_dims"])), k=k)
+
+    for name, request in [("get", get_request), ("knn ids", knn_ids_request), ("knn vectors", knn_vectors_request)]:
+        run_load_test(name, client_args, request, num_clients, requests_per_client)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure latency and throughput of embedding query service")
+    parser.add_argument("--host", default="127.0.0.1", type=str)
+    parser.add_argument("--port", default=8765, type=int)
+    parser.add_argument("--socket", default=None, type=str, help="Connect to service over Unix socket")
+    parser.add_argument("--start_local", action="store_true",
+                        help="Start service with synthetic embeddings instead of connecting to a running service")
+    parser.add_argument("--num_vectors", default=100000, type=int, help="Number of synthetic embeddings")
+    parser.add_argument("--dim", default=100, type=int, help="Dimensionality of synthetic embeddings")
+    parser.add_argument("--index", default="brute", type=str, help="Index of local service")
+    parser.add_argument("--method", default="inner_prod", type=str, help="inner_prod|l2")
+    parser.add_argument("--device", default="cpu", type=str)
+    parser.add_argument("--max_batch_size", default=256, type=int)
+    parser.add_argument("--max_wait_ms", default=2., type=float)
+    parser.add_argument("--num_clients", default=16, type=int)
+    parser.add_argument("--requests_per_client", default=200, type=int)
+    parser.add_argument("--ids_per_request", default=8, type=int)
+    parser.add_argument("--k", default=10, type=int)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    client_args = {"host": args.host, "port": args.port, "socket_path": args.socket}
+
+    with tempfile.TemporaryDirectory() as store_dir:
+        server = None
+        if args.start_local:
+            server = start_local_service(
+                args.num_vectors, args.dim, args.index, args.method, args.device, args.max_batch_size,
+                args.max_wait_ms / 1000, args.socket, args.port, store_dir
+            )
+
+        run_benchmark(client_args, args.num_clients, args.requests_per_client, args.ids_per_request, args.k)
+
+        if server is not None:
+            server.shutdown()
+            server.server_close()
@@ -191,7 +191,9 @@ class ElementEmbedder(ElementEmbedderBase, nn.Module, Scorer):
         self.norm = nn.LayerNorm(emb_size)
 
     def __getitem__(self, ids):
-        return torch.LongTensor(ElementEmbedderBase.__getitem__(self, ids=ids))
+        keys = ElementEmbedderBase.__getitem__(self, ids=ids)
+        self.mark_touched(keys.tolist())
+        return torch.LongTensor(keys)
 
     def sample_negative(self, size, ids=None, strategy="closest"):
         # TODO
@@ -203,15 +205,18 @@ class ElementEmbedder(ElementEmbedderBase, nn.Module, Scorer):
             negative = Scorer.sample_closest_negative(self, ids, k=size // len(ids))
             assert len(negative) == size
 
+        self.mark_touched(negative)
         return torch.LongTensor(negative)
 
     def forward(self, input, **kwargs):
         return self.norm(self.embed(input))
 
-    def set_embed(self):
-        all_keys = self.get_keys_for_scoring()
+    def embed_keys(self, keys):
         with torch.set_grad_enabled(False):
-            self.scorer_all_emb = self(torch.LongTensor(all_keys).to(self.embed.weight.device)).detach().cpu().numpy()
+            return self(torch.LongTensor(keys).to(self.embed.weight.device)).detach().cpu().numpy()
+
+    def set_embed(self):
+        self.scorer_all_emb = self.embed_keys(self.get_keys_for_scoring())
 
     def prepare_index(self):
         self.set_embed()
@@ -269,6 +274,7 @@ class ElementEmbedderWithCharNGramSubwords(ElementEmbedderBase, nn.Module, Score
         :return: Matrix with subwords for passing to embedder
         """
         candidates = [rnd.choice(self.element_lookup[id]) for id in ids]
+        self.mark_touched(candidates)
         emb_matr = np.array([self.name2repr[c] for c in candidates], dtype=np.int32)
         return torch.LongTensor(emb_matr)
 
@@ -282,6 +288,7 @@ class ElementEmbedderWithCharNGramSubwords(ElementEmbedderBase, nn.Module, Score
             negative = Scorer.sample_closest_negative(self, ids, k=size // len(ids))
             assert len(negative) == size
 
+        self.mark_touched(negative)
         emb_matr = np.array([self.name2repr[c] for c in negative])
         return torch.LongTensor(emb_matr)
 
@@ -289,11 +296,13 @@ class ElementEmbedderWithCharNGramSubwords(ElementEmbedderBase, nn.Module, Score
         x = self.embed(input)
         return self.norm(torch.mean(x, dim=1))
 
-    def set_embed(self):
-        all_keys = self.get_keys_for_scoring()
-        emb_matr = np.array([self.name2repr[key] for key in all_keys], dtype=np.int32)
+    def embed_keys(self, keys):
+        emb_matr = np.array([self.name2repr[key] for key in keys], dtype=np.int32)
         with torch.set_grad_enabled(False):
-            self.scorer_all_emb = self(torch.LongTensor(emb_matr).to(self.embed.weight.device)).detach().cpu().numpy()
+            return self(torch.LongTensor(emb_matr).to(self.embed.weight.device)).detach().cpu().numpy()
+
+    def set_embed(self):
+        self.scorer_all_emb = self.embed_keys(self.get_keys_for_scoring())
 
     def prepare_index(self):
         self.set_embed()
@@ -1,4 +1,5 @@
 from SourceCodeTools.nlp import token_hasher
+import numpy as np
 import torch
 import torch.nn as nn
 
@@ -24,25 +25,38 @@ class NodeEmbedder(nn.Module):
             ['global_graph_id', 'typed_id', 'type', 'type_backup', embedding_field]
         ]
 
-        type_name = list(zip(nodes_with_embeddings['type_backup'], nodes_with_embeddings[embedding_field]))
+        assert not nodes_with_embeddings.duplicated(["type", "typed_id"]).any()
 
-        self.node_info = dict(zip(
-            list(zip(nodes_with_embeddings['type'], nodes_with_embeddings['typed_id'])),
-            type_name
-        ))
-
-        assert len(nodes_with_embeddings) == len(self.node_info)
-
-        self.node_info_global = dict(zip(
-            nodes_with_embeddings['global_graph_id'],
-            type_name
-        ))
+        self._create_bucket_ids(nodes, nodes_with_embeddings, embedding_field)
 
         if pretrained is None:
             self._create_buckets()
         else:
             self._create_buckets_from_pretrained(pretrained)
 
+    def _create_bucket_ids(self, nodes, nodes_with_embeddings, embedding_field):
+        """
+        Hash names of embeddable nodes once and store bucket ids in dense tensors indexed by typed and global node
+        ids. Nodes without embeddings point to the padding bucket. Tensors are not registered as buffers, so that
+        they do not appear in checkpoints.
+        """
+        names = nodes_with_embeddings[embedding_field]
+        unique_names = names.unique()
+        name_buckets = dict(zip(unique_names, (token_hasher(name, self.n_buckets) for name in unique_names)))
+        bucket_ids = names.map(name_buckets).to_numpy(dtype=np.int64)
+
+        self.typed_bucket_ids = {}
+        type_sizes = nodes.groupby("type", observed=True)["typed_id"].max() + 1
+        for type_, size in type_sizes.items():
+            table = np.full(size, self.n_buckets, dtype=np.int64)
+            of_type = (nodes_with_embeddings["type"] == type_).to_numpy()
+            table[nodes_with_embeddings["typed_id"].to_numpy(dtype=np.int64)[of_type]] = bucket_ids[of_type]
+            self.typed_bucket_ids[type_] = torch.from_numpy(table)
+
+        global_table = np.full(nodes["global_graph_id"].max() + 1, self.n_buckets, dtype=np.int64)
+        global_table[nodes_with_embeddings["global_graph_id"].to_numpy(dtype=np.int64)] = bucket_ids
+        self.global_bucket_ids = torch.from_numpy(global_table)
+
     def _create_buckets(self):
         self.buckets = nn.Embedding(self.n_buckets + 1, self.emb_size, padding_idx=self.n_buckets, sparse=True)
 
@@ -50,38 +64,43 @@ class NodeEmbedder(nn.Module):
 
         assert pretrained.shape[1] == self.emb_size
 
-        import numpy as np
-
         weights_with_pad = torch.tensor(np.vstack([pretrained, np.zeros((1, self.emb_size), dtype=np.float32)]))
 
         self.buckets = nn.Embedding.from_pretrained(weights_with_pad, freeze=False, padding_idx=self.n_buckets, sparse=True)
 
-    def _get_embedding_from_node_info(self, keys, node_info, masked=None):
-        idxs = []
+    def _get_embedding_from_bucket_ids(self, bucket_id_table, ids, masked=None):
+        """
+        :param bucket_id_table: tensor with bucket id for every node id, or None if no nodes have embeddings
+        :param ids: node ids
+        :param masked: collection of node ids that should receive padding embedding
+        """
+        ids = torch.as_tensor(ids, dtype=torch.long).cpu()
 
-        if isinstance(masked, dict):
-            new_masked = set()
-            for ntype, nids in masked.items():
-                for nid in nids:
-                    new_masked.add((ntype, nid))
-            masked = new_masked
-
-        for key in keys:
-            if key not in node_info or masked is not None and key in masked:
-            # if key in node_info and key not in masked:
-                idxs.append(self.n_buckets)
+        if bucket_id_table is None:
+            bucket_ids = torch.full_like(ids, self.n_buckets)
+        else:
+            bucket_ids = bucket_id_table[ids]
+
+        if masked is not None and len(masked) > 0:
+            if isinstance(masked, torch.Tensor):
+                masked = masked.cpu().numpy()
             else:
-                real_type, name = node_info[key]
-                idxs.append(token_hasher(name, self.n_buckets))
+                masked = np.fromiter(masked, dtype=np.int64, count=len(masked))
+            is_masked = torch.from_numpy(np.isin(ids.numpy(), masked))
+            bucket_ids = bucket_ids.masked_fill(is_masked, self.n_buckets)
 
-        return self.buckets(torch.LongTensor(idxs))
+        return self.buckets(bucket_ids.to(self.buckets.weight.device))
 
     def _get_embeddings_with_type(self, node_type, ids, masked=None):
-        type_ids = ((node_type, id_) for id_ in ids)
-        return self._get_embedding_from_node_info(type_ids, self.node_info, masked=masked)
+        if isinstance(masked, dict):
+            masked = masked.get(node_type, None)
+        return self._get_embedding_from_bucket_ids(self.typed_bucket_ids.get(node_type, None), ids, masked=masked)
 
     def _get_embeddings_global(self, ids, masked=None):
-        return self._get_embedding_from_node_info(ids, self.node_info_global, masked=masked)
+        if isinstance(masked, dict):
+            # masks grouped by node type refer to typed ids
+            masked = None
+        return self._get_embedding_from_bucket_ids(self.global_bucket_ids, ids, masked=masked)
 
     def get_embeddings(self, node_type=None, node_ids=None, masked=None):
         assert node_ids is not None
@@ -92,10 +111,10 @@ class NodeEmbedder(nn.Module):
 
     def forward(self, node_type=None, node_ids=None, train_embeddings=True, masked=None):
         if train_embeddings:
-            return self.get_embeddings(node_type, node_ids.tolist(), masked=masked)
+            return self.get_embeddings(node_type, node_ids, masked=masked)
         else:
             with torch.set_grad_enabled(False):
-                return self.get_embeddings(node_type, node_ids.tolist(), masked=masked)
+                return self.get_embeddings(node_type, node_ids, masked=masked)
 
 
 class NodeIdEmbedder(NodeEmbedder):
@@ -117,21 +136,23 @@ class NodeIdEmbedder(NodeEmbedder):
             ['global_graph_id', 'typed_id', 'type', 'type_backup', embedding_field]
         ]
 
+        # typed ids of nodes without embeddings map to -1 and cannot be embedded
         self.to_global_map = {}
-        for global_graph_id, typed_id, type_, type_backup, name in nodes_with_embeddings.values:
-            if type_ not in self.to_global_map:
-                self.to_global_map[type_] = {}
-
-            self.to_global_map[type_][typed_id] = global_graph_id
+        for type_, nodes_of_type in nodes_with_embeddings.groupby("type", observed=True):
+            typed_ids = nodes_of_type["typed_id"].to_numpy(dtype=np.int64)
+            table = np.full(typed_ids.max() + 1, -1, dtype=np.int64)
+            table[typed_ids] = nodes_of_type["global_graph_id"].to_numpy(dtype=np.int64)
+            self.to_global_map[type_] = torch.from_numpy(table)
 
         self._create_buckets()
 
     def get_embeddings(self, node_type=None, node_ids=None, masked=None):
         assert node_ids is not None
+        node_ids = torch.as_tensor(node_ids, dtype=torch.long).cpu()
         if node_type is not None:
-            node_ids = list(map(lambda local_id: self.to_global_map[node_type][local_id], node_ids))
+            node_ids = self.to_global_map[node_type][node_ids]
 
-        return self.buckets(torch.LongTensor(node_ids))
+        return self.buckets(node_ids.to(self.buckets.weight.device))
 
 
 # class SimpleNodeEmbedder(nn.Module):
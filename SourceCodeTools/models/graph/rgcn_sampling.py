@@ -1,4 +1,8 @@
 """RGCN layer implementation"""
+import os
+from os.path import join
+
+import numpy as np
 import torch
 import torch as th
 import torch.nn as nn
@@ -347,14 +351,44 @@ class RGCNSampling(nn.Module):
         else:
             return h
 
-    def inference(self, batch_size, device, num_workers, x=None):
+    @staticmethod
+    def _gather_features(features, ntype, ids, device):
+        if callable(features):
+            return features(ntype, ids).to(device)
+        features = features[ntype]
+        if isinstance(features, np.ndarray):
+            # layer outputs stored in memory-mapped files
+            return th.from_numpy(np.asarray(features[ids.numpy()], dtype=np.float32)).to(device)
+        return features[ids].to(device)
+
+    def _allocate_layer_output(self, layer_ind, out_dim, output_dir=None, dtype="float32"):
+        if output_dir is None:
+            return {k: th.zeros(self.g.number_of_nodes(k), out_dim) for k in self.g.ntypes}, None
+
+        # node types are stored one after another in the order of `g.ntypes`
+        num_nodes = [self.g.number_of_nodes(k) for k in self.g.ntypes]
+        layer_path = join(output_dir, f"layer_{layer_ind}.npy")
+        output = np.lib.format.open_memmap(layer_path, mode="w+", dtype=dtype, shape=(sum(num_nodes), out_dim))
+        offsets = np.cumsum([0] + num_nodes)
+        return {k: output[offsets[i]: offsets[i + 1]] for i, k in enumerate(self.g.ntypes)}, layer_path
+
+    def inference(self, batch_size, device, num_workers, x=None, output_dir=None, dtype="float32"):
         """Minibatch inference of final representation over all node types.
 
         ***NOTE***
         For node classification, the model is trained to predict on only one node type's
         label.  Therefore, only that type's final representation is meaningful.
+
+        :param x: input features, dictionary with a tensor for every node type, or a function that takes node type
+            and typed ids and returns input features for these nodes
+        :param output_dir: when provided, outputs of every layer are written to memory-mapped file `layer_{l}.npy`
+            in this directory instead of being kept in memory. Node types are stored one after another in the order
+            of `g.ntypes`. Files of intermediate layers are removed once the next layer is computed.
+        :param dtype: data type of memory-mapped layer outputs, float32 or float16
+        :return: dictionary with outputs of the last layer for every node type
         """
         h0 = x
+        previous_layer_path = None
 
         with th.set_grad_enabled(False):
 
@@ -362,19 +396,19 @@ class RGCNSampling(nn.Module):
             #     x = self.embed_layer()
 
             for l, (layer, norm) in enumerate(zip(self.layers, self.layer_norm)):
-                y = {
-                    k: th.zeros(
-                        self.g.number_of_nodes(k),
-                        self.h_dim if l != len(self.layers) - 1 else self.out_dim)
-                    for k in self.g.ntypes}
+                y, layer_path = self._allocate_layer_output(
+                    l, self.h_dim if l != len(self.layers) - 1 else self.out_dim, output_dir, dtype
+                )
 
+                # nodes are visited in the order of ids, so that consecutive batches have overlapping neighbourhoods
+                # and writes to memory-mapped outputs are sequential
                 sampler = dgl.dataloading.MultiLayerFullNeighborSampler(1)
                 dataloader = dgl.dataloading.NodeDataLoader(
                     self.g,
-                    {k: th.arange(self.g.number_of_nodes(k)) for k in self.g.ntypes},
+                    {k: th.arange(self.g.number_of_nodes(k), dtype=self.g.idtype) for k in self.g.ntypes},
                     sampler,
                     batch_size=batch_size,
-                    shuffle=True,
+                    shuffle=False,
                     drop_last=False,
                     num_workers=num_workers)
 
@@ -386,13 +420,28 @@ class RGCNSampling(nn.Module):
                         input_nodes = {key: input_nodes}
                         output_nodes = {key: output_nodes}
 
-                    _h0 = {k: h0[k][input_nodes[k]].to(device) for k in input_nodes.keys()}
-                    h = {k: x[k][input_nodes[k]].to(device) for k in input_nodes.keys()}
+                    # graph ids can be int32, indexing requires int64
+                    input_nodes = {k: v.long() for k, v in input_nodes.items()}
+                    output_nodes = {k: v.long() for k, v in output_nodes.items()}
+
+                    _h0 = {k: self._gather_features(h0, k, input_nodes[k], device) for k in input_nodes.keys()}
+                    h = {k: self._gather_features(x, k, input_nodes[k], device) for k in input_nodes.keys()}
                     h = layer(block, h, _h0)
                     h = self.normalize(h, norm)
 
                     for k in h.keys():
-                        y[k][output_nodes[k]] = h[k].cpu()
+                        if layer_path is None:
+                            y[k][output_nodes[k]] = h[k].cpu()
+                        else:
+                            y[k][output_nodes[k].numpy()] = h[k].cpu().numpy()
+
+                if layer_path is not None:
+                    for k in y:
+                        y[k].flush()
+                    if previous_layer_path is not None:
+                        x = None
+                        os.remove(previous_layer_path)
+                    previous_layer_path = layer_path
 
                 x = y
             return y
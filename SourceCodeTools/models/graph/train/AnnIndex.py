@@ -0,0 +1,311 @@
+import logging
+
+import numpy as np
+import torch
+from sklearn.preprocessing import normalize
+
+
+def parse_index_spec(spec):
+    """
+    Parse index specification of the form `name:param=value,param=value`, e.g. `ivf:n_lists=1024,n_probe=16`.
+    :return: index name and dictionary with parameters
+    """
+    name, _, params = spec.partition(":")
+    parsed = {}
+    for param in params.split(","):
+        if param.strip() == "":
+            continue
+        key, value = param.split("=")
+        value = value.strip()
+        try:
+            value = int(value)
+        except ValueError:
+            value = float(value)
+        parsed[key.strip()] = value
+    return name.strip(), parsed
+
+
+def default_n_lists(num_vectors):
+    return max(int(4 * np.sqrt(num_vectors)), 1)
+
+
+class FaissIVFIndex:
+    """
+    Inverted file index from faiss. Vectors are assigned to `n_lists` clusters and only `n_probe` closest clusters
+    are searched. With `pq_m` set, vectors are compressed with product quantization (IVF-PQ). Supports updates
+    through `remove_ids` and `add_with_ids`.
+
+    Product quantization trades recall for memory. With the default `pq_m` (4 dimensions per subquantizer),
+    recall@10 on clustered 32-dimensional vectors is only about 0.4 for inner_prod and 0.75 for l2, compared to
+    about 1.0 for `ivf`, `faiss_ivf`, and `faiss_hnsw`. Setting `pq_m` to the dimensionality raises recall above 0.9.
+    """
+    def __init__(self, X, method="inner_prod", n_lists=None, n_probe=8, pq_m=None, pq_bits=8, *args, **kwargs):
+        import faiss
+        self.method = method
+        num_vectors, dim = X.shape
+
+        if method == "inner_prod":
+            metric = faiss.METRIC_INNER_PRODUCT
+            quantizer = faiss.IndexFlatIP(dim)
+        elif method == "l2":
+            metric = faiss.METRIC_L2
+            quantizer = faiss.IndexFlatL2(dim)
+        else:
+            raise NotImplementedError()
+
+        n_lists = min(n_lists or default_n_lists(num_vectors), num_vectors)
+
+        if pq_m is None:
+            self.index = faiss.IndexIVFFlat(quantizer, dim, n_lists, metric)
+        else:
+            self.index = faiss.IndexIVFPQ(quantizer, dim, n_lists, pq_m, pq_bits, metric)
+        self.quantizer = quantizer  # faiss does not keep a reference to the quantizer
+
+        X = X.astype(np.float32)
+        self.index.train(X)
+        self.index.add_with_ids(X, np.arange(num_vectors, dtype=np.int64))
+        self.index.nprobe = n_probe
+        self.size = num_vectors
+
+    def query(self, X, k):
+        if self.method == "inner_prod":
+            X = normalize(X, axis=1)
+        return self.index.search(X.astype(np.float32), k=k)
+
+    def add(self, X):
+        ids = np.arange(self.size, self.size + X.shape[0], dtype=np.int64)
+        self.index.add_with_ids(X.astype(np.float32), ids)
+        self.size += X.shape[0]
+
+    def update(self, ind, X):
+        ind = np.asarray(ind, dtype=np.int64)
+        self.index.remove_ids(ind)
+        self.index.add_with_ids(X.astype(np.float32), ind)
+
+
+class FaissHNSWIndex:
+    """
+    HNSW graph index from faiss. HNSW does not support removal, so updated vectors are added as new entries and
+    outdated entries are filtered from query results. The index is rebuilt from current vectors when the fraction
+    of outdated entries exceeds `max_outdated_fraction`.
+    """
+    def __init__(
+            self, X, method="inner_prod", hnsw_m=32, ef_search=64, ef_construction=40, max_outdated_fraction=0.2,
+            *args, **kwargs
+    ):
+        assert 0. <= max_outdated_fraction < 1., "Fraction of outdated entries should be in range [0, 1)"
+        self.method = method
+        self.hnsw_m = hnsw_m
+        self.ef_search = ef_search
+        self.ef_construction = ef_construction
+        self.max_outdated_fraction = max_outdated_fraction
+        self.build(X)
+
+    def build(self, X):
+        import faiss
+        num_vectors, dim = X.shape
+
+        if self.method == "inner_prod":
+            metric = faiss.METRIC_INNER_PRODUCT
+        elif self.method == "l2":
+            metric = faiss.METRIC_L2
+        else:
+            raise NotImplementedError()
+
+        self.index = faiss.IndexHNSWFlat(dim, self.hnsw_m, metric)
+        self.index.hnsw.efConstruction = self.ef_construction
+        self.index.hnsw.efSearch = self.ef_search
+
+        self.index.add(X.astype(np.float32))
+        self.entry_to_row = np.arange(num_vectors, dtype=np.int64)  # row for every entry in the index
+        self.row_to_entry = np.arange(num_vectors, dtype=np.int64)  # current entry for every row
+        self.num_outdated = 0
+
+    def rebuild(self):
+        self.build(self.index.reconstruct_n(0, self.index.ntotal)[self.row_to_entry])
+
+    def query(self, X, k):
+        if self.method == "inner_prod":
+            X = normalize(X, axis=1)
+
+        # every row has at most one current entry among neighbours, outdated entries of the same rows are usually
+        # close to the current ones, request twice as many neighbours when there are outdated entries
+        k_ = min(k + min(self.num_outdated, k), self.index.ntotal)
+        dist, entries = self.index.search(X.astype(np.float32), k=k_)
+
+        valid = entries >= 0
+        rows = np.where(valid, self.entry_to_row[np.maximum(entries, 0)], -1)
+        valid &= self.row_to_entry[np.maximum(rows, 0)] == entries
+
+        # stable sort moves valid entries to the front and keeps their order by distance
+        order = np.argsort(~valid, axis=1, kind="stable")[:, :k]
+        found = np.take_along_axis(valid, order, axis=1)
+        result_dist = np.where(found, np.take_along_axis(dist, order, axis=1), np.nan).astype(np.float32)
+        result_ind = np.where(found, np.take_along_axis(rows, order, axis=1), -1)
+
+        if result_dist.shape[1] < k:
+            missing = k - result_dist.shape[1]
+            result_dist = np.pad(result_dist, ((0, 0), (0, missing)), constant_values=np.nan)
+            result_ind = np.pad(result_ind, ((0, 0), (0, missing)), constant_values=-1)
+        return result_dist, result_ind
+
+    def add(self, X):
+        start = self.index.ntotal
+        num_rows = len(self.row_to_entry)
+        self.index.add(X.astype(np.float32))
+        new_entries = np.arange(start, start + X.shape[0], dtype=np.int64)
+        self.entry_to_row = np.concatenate([self.entry_to_row, np.arange(num_rows, num_rows + X.shape[0])])
+        self.row_to_entry = np.concatenate([self.row_to_entry, new_entries])
+
+    def update(self, ind, X):
+        ind = np.asarray(ind, dtype=np.int64)
+        start = self.index.ntotal
+        self.index.add(X.astype(np.float32))
+        self.entry_to_row = np.concatenate([self.entry_to_row, ind])
+        self.row_to_entry[ind] = np.arange(start, start + len(ind), dtype=np.int64)
+        self.num_outdated += len(ind)
+
+        if self.num_outdated > self.max_outdated_fraction * self.index.ntotal:
+            self.rebuild()
+
+
+class IVFIndex:
+    """
+    Inverted file index implemented with torch, used when faiss is not available. Centroids are found with
+    k-means on a sample of vectors. Queries score centroids first and then only the vectors from `n_probe`
+    closest lists. Vectors are stored on the device and can be updated in place.
+    """
+    def __init__(
+            self, X, method="inner_prod", device="cpu", n_lists=None, n_probe=8, kmeans_iterations=10,
+            kmeans_sample_size=100000, *args, **kwargs
+    ):
+        if method not in {"inner_prod", "l2"}:
+            raise NotImplementedError()
+
+        self.method = method
+        self.device = device
+        self.vectors = torch.as_tensor(X, dtype=torch.float32).to(device)
+        n_lists = min(n_lists or default_n_lists(self.vectors.shape[0]), self.vectors.shape[0])
+        self.n_probe = min(n_probe, n_lists)
+
+        self.centroids = self.train_centroids(n_lists, kmeans_iterations, kmeans_sample_size)
+        self.assignment = self.assign(self.vectors)
+        self.build_lists()
+
+    def score(self, X, Y):
+        if self.method == "inner_prod":
+            return torch.nn.functional.normalize(X, dim=1) @ Y.T
+        else:
+            return -torch.cdist(X, Y)
+
+    def train_centroids(self, n_lists, iterations, sample_size):
+        num_vectors = self.vectors.shape[0]
+        sample = self.vectors[torch.randperm(num_vectors)[:max(sample_size, n_lists)].to(self.device)]
+        centroids = sample[torch.randperm(sample.shape[0])[:n_lists].to(self.device)].clone()
+
+        for _ in range(iterations):
+            assignment = torch.argmax(self.score(sample, centroids), dim=1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, sample)
+            counts = torch.bincount(assignment, minlength=n_lists).to(sums.dtype).unsqueeze(1)
+            non_empty = counts.squeeze(1) > 0
+            centroids[non_empty] = sums[non_empty] / counts[non_empty]
+
+        return centroids
+
+    def assign(self, X):
+        return torch.argmax(self.score(X, self.centroids), dim=1)
+
+    def build_lists(self):
+        # lists are stored in CSR format: rows sorted by list and offsets of every list
+        self.list_rows = torch.argsort(self.assignment)
+        counts = torch.bincount(self.assignment, minlength=self.centroids.shape[0])
+        self.list_offsets = torch.cat([torch.zeros(1, dtype=torch.long, device=counts.device), torch.cumsum(counts, 0)])
+        self.lists_outdated = False
+
+    def add(self, X):
+        X = torch.as_tensor(X, dtype=torch.float32).to(self.device)
+        self.vectors = torch.cat([self.vectors, X], dim=0)
+        self.assignment = torch.cat([self.assignment, self.assign(X)])
+        self.lists_outdated = True
+
+    def update(self, ind, X):
+        ind = torch.as_tensor(ind, dtype=torch.long).to(self.device)
+        X = torch.as_tensor(X, dtype=torch.float32).to(self.device)
+        self.vectors[ind] = X
+        self.assignment[ind] = self.assign(X)
+        self.lists_outdated = True
+
+    def query(self, X, k):
+        """
+        :return: scores (distances for l2) and indices of closest vectors, arrays of shape (len(X), k). Missing
+            neighbours have index -1.
+        """
+        if self.lists_outdated:
+            self.build_lists()
+
+        X = torch.as_tensor(X, dtype=torch.float32).to(self.device)
+        num_queries = X.shape[0]
+
+        probes = torch.topk(self.score(X, self.centroids), self.n_probe, dim=1).indices
+
+        # every probe of every query gets k slots in the candidate buffer
+        buffer_score = torch.full((num_queries, self.n_probe * k), -float("inf"), device=self.device)
+        buffer_ind = torch.full((num_queries, self.n_probe * k), -1, dtype=torch.long, device=self.device)
+
+        for list_id in torch.unique(probes).tolist():
+            list_start, list_end = self.list_offsets[list_id].item(), self.list_offsets[list_id + 1].item()
+            if list_start == list_end:
+                continue
+            rows = self.list_rows[list_start: list_end]
+
+            queries, probe_rank = (probes == list_id).nonzero(as_tuple=True)
+            kk = min(k, len(rows))
+            top_score, top_pos = torch.topk(self.score(X[queries], self.vectors[rows]), kk, dim=1)
+
+            slots = probe_rank.unsqueeze(1) * k + torch.arange(kk, device=self.device).unsqueeze(0)
+            buffer_score[queries.unsqueeze(1), slots] = top_score
+            buffer_ind[queries.unsqueeze(1), slots] = rows[top_pos]
+
+        score, pos = torch.topk(buffer_score, min(k, buffer_score.shape[1]), dim=1)
+        ind = torch.gather(buffer_ind, 1, pos)
+
+        if self.method == "l2":
+            score = -score
+
+        return score.cpu().numpy(), ind.cpu().numpy()
+
+
+approximate_indices = {
+    "ivf": IVFIndex,
+    "faiss_ivf": FaissIVFIndex,
+    "faiss_ivfpq": FaissIVFIndex,
+    "faiss_hnsw": FaissHNSWIndex,
+}
+
+
+def create_approximate_index(spec, X, method="inner_prod", device="cpu"):
+    """
+    Create approximate nearest neighbour index.
+    :param spec: index specification, see `parse_index_spec`
+    :param X: matrix with vectors
+    :param method: inner_prod or l2
+    :param device: device for torch-based indices
+    :return: index object with methods `query`, `add`, and `update`
+    """
+    name, params = parse_index_spec(spec)
+    if name not in approximate_indices:
+        raise ValueError(f"Unsupported approximate index: {name}. Supported indices are: {'|'.join(approximate_indices)}")
+
+    if name == "faiss_ivfpq" and "pq_m" not in params:
+        dim = X.shape[1]
+        # largest number of subquantizers that divides dimensionality and keeps at least 4 dimensions per subvector
+        params["pq_m"] = next(m for m in range(max(dim // 4, 1), 0, -1) if dim % m == 0)
+
+    if name.startswith("faiss"):
+        try:
+            import faiss
+        except ImportError:
+            logging.warning(f"faiss is not installed, using ivf index instead of {name}")
+            name = "ivf"
+
+    return approximate_indices[name](X, method=method, device=device, **params)
@@ -0,0 +1,266 @@
+import json
+import logging
+import os
+import queue
+import threading
+from os.path import join, isfile
+
+import torch
+
+
+def atomic_torch_save(obj, path):
+    """
+    Write the file under a temporary name and rename it, so that readers never see partially written checkpoints.
+    """
+    tmp_path = path + f".tmp{os.getpid()}"
+    torch.save(obj, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def _clone_state(state):
+    if isinstance(state, torch.Tensor):
+        return state.detach().clone()
+    elif isinstance(state, dict):
+        return state.__class__((key, _clone_state(val)) for key, val in state.items())
+    return state
+
+
+class CheckpointWriter:
+    """
+    Writes training checkpoints on a background thread. The state is copied when `save` is called, and training
+    continues while the copy is serialized. Large embedding tables that are updated sparsely (such as hashed node
+    embedding buckets) are stored incrementally: every `full_every`-th checkpoint contains the full table, other
+    checkpoints contain only the rows updated since the previous checkpoint.
+
+    Checkpoints are stored in `checkpoint_dir/checkpoints` together with `manifest.json` that lists the versions.
+    Only the last `keep_last` checkpoints, the best checkpoint, and the checkpoints they depend on are kept.
+    """
+
+    dirname = "checkpoints"
+    manifest_filename = "manifest.json"
+
+    def __init__(self, checkpoint_dir, keep_last=3, full_every=10, max_pending=1):
+        """
+        :param checkpoint_dir: model directory
+        :param keep_last: number of latest checkpoints to keep
+        :param full_every: number of checkpoints between full copies of tracked tables
+        :param max_pending: number of snapshots that can wait for writing. `save` blocks when the writer falls behind.
+        """
+        assert keep_last >= 1, "At least one checkpoint should be kept"
+        self.checkpoint_dir = checkpoint_dir
+        self.path = join(checkpoint_dir, self.dirname)
+        os.makedirs(self.path, exist_ok=True)
+
+        self.keep_last = keep_last
+        self.full_every = max(full_every, 1)
+        self.manifest = self.read_manifest(self.path) or {"checkpoints": [], "best": None}
+        self.tracked = {}
+        self.updated_rows = {}
+        # the first checkpoint written by this writer is always full
+        self.since_full = self.full_every
+
+        self.pending = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def track_rows(self, key, param):
+        """
+        Store the parameter incrementally.
+        :param key: tuple with the key of the module state in the checkpoint and the key of the parameter in the
+            module state dict, e.g. ("node_embedder", "buckets.weight")
+        :param param: parameter, rows are updated by the optimizer along the first dimension
+        """
+        self.tracked[key] = param
+        self.updated_rows[key] = torch.zeros(param.shape[0], dtype=torch.bool)
+
+    def mark_updated(self):
+        """
+        Record rows of tracked parameters that receive gradients in the current step. Call after the optimizer step.
+        """
+        for key, param in self.tracked.items():
+            grad = param.grad
+            if grad is None:
+                continue
+            if grad.is_sparse:
+                self.updated_rows[key][grad.coalesce().indices()[0]] = True
+            else:
+                self.updated_rows[key][:] = True
+
+    def _snapshot_tracked(self, full):
+        tracked_state = {}
+        for key, param in self.tracked.items():
+            if full:
+                tracked_state[key] = {"full": param.detach().clone()}
+            else:
+                rows = self.updated_rows[key].nonzero(as_tuple=True)[0]
+                tracked_state[key] = {"rows": rows, "values": param.detach()[rows].clone()}
+            self.updated_rows[key][:] = False
+        return tracked_state
+
+    def save(self, state, write_best_model=False, copies=None):
+        """
+        Copy the state and schedule writing.
+        :param state: dictionary with state dicts of modules and training progress
+        :param write_best_model: mark the checkpoint as the best and store it as `best_model.pt`
+        :param copies: names of files in `checkpoint_dir` where the full checkpoint should be stored in addition,
+            e.g. checkpoints for every epoch
+        """
+        self._raise_error()
+
+        full = self.since_full >= self.full_every
+        self.since_full = 1 if full else self.since_full + 1
+
+        state = dict(state)
+        for module_key, param_key in self.tracked:
+            # tracked tables are not copied entirely
+            state[module_key] = {k: v for k, v in state[module_key].items() if k != param_key}
+        state = _clone_state(state)
+        tracked_state = self._snapshot_tracked(full)
+
+        copies = list(copies or [])
+        if write_best_model:
+            copies.append("best_model.pt")
+        self.pending.put((state, tracked_state, full, write_best_model, copies))
+
+    def flush(self):
+        """
+        Wait until all scheduled checkpoints are written.
+        """
+        self.pending.join()
+        self._raise_error()
+
+    def close(self):
+        self.flush()
+
+    def _raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError("Failed to write checkpoint") from error
+
+    def _run(self):
+        while True:
+            item = self.pending.get()
+            try:
+                self._write(*item)
+            except Exception as e:
+                logging.exception("Failed to write checkpoint")
+                self.error = e
+            finally:
+                self.pending.task_done()
+
+    def _write(self, state, tracked_state, full, write_best_model, copies):
+        checkpoints = self.manifest["checkpoints"]
+        version = checkpoints[-1]["version"] + 1 if len(checkpoints) > 0 else 0
+        filename = f"state_{version:06d}.pt"
+
+        atomic_torch_save({"state": state, "tracked": tracked_state}, join(self.path, filename))
+
+        checkpoints.append({
+            "version": version,
+            "file": filename,
+            "full": full,
+            "parent": None if full else checkpoints[-1]["version"],
+            "epoch": state.get("epoch"),
+            "batch": state.get("batch"),
+        })
+        if write_best_model:
+            self.manifest["best"] = version
+        self._write_manifest()
+
+        for copy_name in copies:
+            atomic_torch_save(self.load_version(self.path, version, self.manifest), join(self.checkpoint_dir, copy_name))
+
+        self._apply_retention()
+
+    def _write_manifest(self):
+        tmp_path = join(self.path, self.manifest_filename + ".tmp")
+        with open(tmp_path, "w") as sink:
+            sink.write(json.dumps(self.manifest, indent=4))
+        os.replace(tmp_path, join(self.path, self.manifest_filename))
+
+    def _apply_retention(self):
+        checkpoints = self.manifest["checkpoints"]
+        by_version = {checkpoint["version"]: checkpoint for checkpoint in checkpoints}
+
+        keep = [checkpoint["version"] for checkpoint in checkpoints[-self.keep_last:]]
+        if self.manifest["best"] is not None:
+            keep.append(self.manifest["best"])
+
+        needed = set()
+        for version in keep:
+            # incremental checkpoints depend on all checkpoints back to the last full one
+            while version is not None and version not in needed:
+                needed.add(version)
+                version = by_version[version]["parent"]
+
+        removed = [checkpoint for checkpoint in checkpoints if checkpoint["version"] not in needed]
+        if len(removed) == 0:
+            return
+
+        self.manifest["checkpoints"] = [checkpoint for checkpoint in checkpoints if checkpoint["version"] in needed]
+        self._write_manifest()
+        for checkpoint in removed:
+            path = join(self.path, checkpoint["file"])
+            if isfile(path):
+                os.remove(path)
+
+    @classmethod
+    def read_manifest(cls, path):
+        manifest_path = join(path, cls.manifest_filename)
+        if not isfile(manifest_path):
+            return None
+        with open(manifest_path, "r") as source:
+            return json.loads(source.read())
+
+    @staticmethod
+    def load_version(path, version, manifest):
+        """
+        Restore the full state of a checkpoint version by applying incremental updates to the last full checkpoint.
+        """
+        by_version = {checkpoint["version"]: checkpoint for checkpoint in manifest["checkpoints"]}
+        chain = []
+        while version is not None:
+            chain.append(by_version[version])
+            version = by_version[version]["parent"]
+
+        tables = {}
+        state = None
+        for checkpoint in reversed(chain):
+            stored = torch.load(join(path, checkpoint["file"]), map_location=torch.device("cpu"))
+            state = stored["state"]
+            for key, update in stored["tracked"].items():
+                if "full" in update:
+                    tables[key] = update["full"]
+                else:
+                    tables[key][update["rows"]] = update["values"]
+
+        for (module_key, param_key), table in tables.items():
+            state[module_key][param_key] = table
+        return state
+
+
+def load_checkpoint(checkpoint_dir, filename="saved_state.pt"):
+    """
+    Load the latest checkpoint from the model directory. Checkpoints written by `CheckpointWriter` are used when
+    they are more recent than the checkpoint stored in `filename`.
+    :param checkpoint_dir: model directory
+    :param filename: name of the checkpoint saved with `torch.save`
+    :return: checkpoint dictionary
+    """
+    path = join(checkpoint_dir, CheckpointWriter.dirname)
+    manifest = CheckpointWriter.read_manifest(path)
+    single_file = join(checkpoint_dir, filename)
+
+    checkpoint = None
+    if isfile(single_file):
+        checkpoint = torch.load(single_file, map_location=torch.device("cpu"))
+
+    if manifest is not None and len(manifest["checkpoints"]) > 0:
+        latest = manifest["checkpoints"][-1]
+        if checkpoint is None or latest["batch"] > checkpoint["batch"]:
+            checkpoint = CheckpointWriter.load_version(path, latest["version"], manifest)
+
+    if checkpoint is None:
+        raise FileNotFoundError(f"No checkpoint found in {checkpoint_dir}")
+    return checkpoint
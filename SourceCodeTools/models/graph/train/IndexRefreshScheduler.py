@@ -0,0 +1,80 @@
+import random
+from time import time
+
+import numpy as np
+
+
+class IndexRefreshScheduler:
+    """
+    Decides when the nearest neighbour index of a target embedder should be rebuilt during training. Between full
+    refreshes, only the embeddings of keys that were used in the last batch are updated. Supported policies:
+        steps - full refresh every `interval` steps
+        epoch - full refresh once per epoch, together with evaluation
+        drift - every `interval` steps, embeddings of a random sample of keys are recomputed and compared with
+            the stored ones. Full refresh happens when the average drift exceeds `drift_threshold`. Target embedders
+            that cannot recompute embeddings for individual keys fall back to `steps` policy.
+    """
+
+    policies = {"steps", "epoch", "drift"}
+
+    def __init__(self, policy="steps", interval=50, drift_threshold=0.05, drift_sample_size=1000):
+        """
+        :param policy: one of `steps`, `epoch`, or `drift`
+        :param interval: number of steps between full refreshes or drift measurements
+        :param drift_threshold: average cosine distance between stored and recomputed embeddings that triggers
+            full refresh
+        :param drift_sample_size: number of keys used for measuring drift
+        """
+        if policy not in self.policies:
+            raise ValueError(f"Unsupported index refresh policy: {policy}. Supported policies are: steps|epoch|drift")
+
+        self.policy = policy
+        self.interval = max(interval, 1)
+        self.drift_threshold = drift_threshold
+        self.drift_sample_size = drift_sample_size
+        self.last_drift = 0.
+
+    @staticmethod
+    def can_measure_drift(target_embedder):
+        return hasattr(target_embedder, "embed_keys") and hasattr(target_embedder, "scorer_all_emb")
+
+    def measure_drift(self, target_embedder):
+        keys = target_embedder.scorer_all_keys
+        if len(keys) > self.drift_sample_size:
+            keys = random.sample(keys, self.drift_sample_size)
+
+        rows = np.fromiter((target_embedder.scorer_key_order[key] for key in keys), dtype=np.int64)
+        stored = target_embedder.scorer_all_emb[rows]
+        current = target_embedder.embed_keys(keys)
+
+        norms = np.linalg.norm(stored, axis=1) * np.linalg.norm(current, axis=1)
+        cosine = (stored * current).sum(axis=1) / np.maximum(norms, 1e-8)
+        return float(np.mean(1. - cosine))
+
+    def needs_full_refresh(self, target_embedder, step):
+        # the index is always refreshed before the first epoch and before evaluation
+        if step == 0 or self.policy == "epoch":
+            return False
+        elif self.policy == "drift" and self.can_measure_drift(target_embedder):
+            if step % self.interval != 0:
+                return False
+            self.last_drift = self.measure_drift(target_embedder)
+            return self.last_drift > self.drift_threshold
+        else:
+            return step % self.interval == 0
+
+    def step(self, target_embedder, step):
+        """
+        Refresh the index of the target embedder before a training step.
+        :param target_embedder: target embedder of an objective
+        :param step: step number within the current epoch
+        :return: time spent on the refresh in seconds
+        """
+        start = time()
+
+        if self.needs_full_refresh(target_embedder, step):
+            target_embedder.prepare_index()
+        elif hasattr(target_embedder, "update_index"):
+            target_embedder.update_index()
+
+        return time() - start
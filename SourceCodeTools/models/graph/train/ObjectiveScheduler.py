@@ -0,0 +1,89 @@
+import numpy as np
+
+
+class ObjectiveScheduler:
+    """
+    Decides which objectives are trained on every training step. Supported modes:
+        lockstep - every objective makes a step on every training step, the epoch ends when the objective with the
+            fewest batches is exhausted
+        round_robin - one objective per step, objectives take turns
+        proportional - one objective per step, objectives are interleaved so that every objective makes a number of
+            steps proportional to its number of training batches
+        temperature - one objective per step, sampled with probability proportional to `num_batches ** (1 / T)`.
+            T = 1 is equivalent to proportional sampling, larger T moves the distribution towards uniform.
+    Except for lockstep, the length of the epoch is defined by the total number of training examples, and loaders
+    of objectives are consumed independently.
+    """
+
+    modes = {"lockstep", "round_robin", "proportional", "temperature"}
+
+    def __init__(self, mode="lockstep", temperature=2., epoch_examples=None, seed=None):
+        """
+        :param mode: one of `lockstep`, `round_robin`, `proportional`, or `temperature`
+        :param temperature: temperature for `temperature` mode
+        :param epoch_examples: number of training examples in one epoch. When None, the epoch is as long as the
+            total number of training examples of all objectives.
+        :param seed: random seed for `temperature` mode
+        """
+        if mode not in self.modes:
+            raise ValueError(
+                f"Unsupported objective schedule: {mode}. Supported schedules are: "
+                f"lockstep|round_robin|proportional|temperature"
+            )
+        assert temperature > 0, "Temperature should be positive"
+
+        self.mode = mode
+        self.temperature = temperature
+        self.epoch_examples = epoch_examples
+        self.rng = np.random.default_rng(seed)
+
+    def num_steps(self, num_batches, batch_size):
+        if self.mode == "lockstep":
+            return min(num_batches)
+        elif self.epoch_examples is not None:
+            return max(self.epoch_examples // batch_size, 1)
+        else:
+            return sum(num_batches)
+
+    def weights(self, num_batches):
+        num_batches = np.array(num_batches, dtype=np.float64)
+        if self.mode == "round_robin":
+            weights = np.ones_like(num_batches)
+        elif self.mode == "proportional":
+            weights = num_batches
+        else:
+            weights = num_batches ** (1. / self.temperature)
+        if weights.sum() == 0:
+            # no objective has training batches, avoid division by zero
+            weights = np.ones_like(num_batches)
+        return weights / weights.sum()
+
+    def _interleave(self, weights, num_steps):
+        # smooth weighted round robin: on every step, pick the objective that is furthest behind its share
+        schedule = []
+        credit = np.zeros_like(weights)
+        for _ in range(num_steps):
+            credit += weights
+            ind = int(np.argmax(credit))
+            credit[ind] -= 1.
+            schedule.append([ind])
+        return schedule
+
+    def epoch_schedule(self, num_batches, batch_size):
+        """
+        Create schedule for one epoch.
+        :param num_batches: number of training batches for every objective
+        :param batch_size: training batch size
+        :return: list with indices of objectives trained on every step
+        """
+        num_steps = self.num_steps(num_batches, batch_size)
+
+        if self.mode == "lockstep":
+            return [list(range(len(num_batches)))] * num_steps
+        elif self.mode == "round_robin":
+            return [[step % len(num_batches)] for step in range(num_steps)]
+        elif self.mode == "temperature":
+            sampled = self.rng.choice(len(num_batches), size=num_steps, p=self.weights(num_batches))
+            return [[ind] for ind in sampled.tolist()]
+        else:
+            return self._interleave(self.weights(num_batches), num_steps)
@@ -1,15 +1,18 @@
 import random
 import time
-from collections import Iterable, defaultdict
+from collections import defaultdict
+from collections.abc import Iterable
 from typing import Dict, List
 
 import torch
 import numpy as np
-from sklearn.metrics import ndcg_score, top_k_accuracy_score
 from sklearn.neighbors import NearestNeighbors
 from sklearn.neighbors._ball_tree import BallTree
 from sklearn.preprocessing import normalize
 
+from SourceCodeTools.models.graph.train.AnnIndex import approximate_indices, create_approximate_index, \
+    parse_index_spec
+
 
 class FaissIndex:
     def __init__(self, X, method="inner_prod", *args, **kwargs):
@@ -40,36 +43,74 @@ class FaissIndex:
 
 
 class Brute:
-    def __init__(self, X, method="inner_prod", device="cpu", *args, **kwargs):
-        self.vectors = X
+    def __init__(self, X, method="inner_prod", device="cpu", max_scores_size=2 ** 26, *args, **kwargs):
+        """
+        Exact nearest neighbour search with matrix multiplication. Vectors are stored on the device once and are
+        updated in place.
+        :param X: matrix with vectors
+        :param method: inner_prod or l2
+        :param device: device for storing vectors and computing scores
+        :param max_scores_size: maximum number of elements in the score matrix, larger queries are split into chunks
+        """
         self.method = method
         self.device = device
+        self.max_scores_size = max_scores_size
+        self.vectors = torch.as_tensor(X, dtype=torch.float32).to(device)
 
-    def query_inner_prod(self, X, k):
-        X = torch.Tensor(normalize(X, axis=1)).to(self.device)
-        vectors = torch.Tensor(self.vectors).to(self.device)
-        score = (vectors @ X.T).reshape(-1,).to("cpu").numpy()
-        ind = np.flip(np.argsort(score))[:k]
-        return score[ind][:k], ind
-
-    def query_l2(self, X, k):
-        vectors = torch.Tensor(self.vectors).to(self.device)
-        X = torch.Tensor(X).to(self.device)
-        score = torch.norm(vectors - X, dim=-1).to("cpu").numpy()
-        # score = np.linalg.norm(vectors - X).reshape(-1,)
-        ind = np.argsort(score)[:k]
-        return score[ind][:k], ind
+    def update(self, ind, X):
+        ind = torch.as_tensor(ind, dtype=torch.long).to(self.device)
+        self.vectors[ind] = torch.as_tensor(X, dtype=torch.float32).to(self.device)
 
-    def query(self, X, k):
-        assert X.shape[0] == 1
+    def score(self, X):
+        """
+        :return: score matrix where larger values correspond to closer vectors
+        """
         if self.method == "inner_prod":
-            dist, ind = self.query_inner_prod(X, k)
+            return torch.nn.functional.normalize(X, dim=1) @ self.vectors.T
         elif self.method == "l2":
-            dist, ind = self.query_l2(X, k)
+            return -torch.cdist(X, self.vectors)
         else:
             raise NotImplementedError()
 
-        return dist, ind#.reshape((-1,1))
+    def query(self, X, k, exclude=None):
+        """
+        Find k closest vectors for every row of X.
+        :param X: query matrix
+        :param k: number of neighbours
+        :param exclude: optional pair of arrays (query_ind, vector_ind) with pairs that should not be returned.
+            Excluded pairs get score -inf (inf distance for l2) when there are not enough other vectors.
+        :return: scores (distances for l2) and indices of closest vectors, arrays of shape (len(X), k)
+        """
+        X = torch.as_tensor(X, dtype=torch.float32).to(self.device)
+        k = min(k, self.vectors.shape[0])
+
+        if exclude is not None:
+            exclude_query = torch.as_tensor(exclude[0], dtype=torch.long).to(self.device)
+            exclude_vector = torch.as_tensor(exclude[1], dtype=torch.long).to(self.device)
+
+        chunk_size = max(self.max_scores_size // max(self.vectors.shape[0], 1), 1)
+
+        all_scores = []
+        all_ind = []
+        for chunk_start in range(0, X.shape[0], chunk_size):
+            chunk_end = min(chunk_start + chunk_size, X.shape[0])
+            score = self.score(X[chunk_start: chunk_end])
+
+            if exclude is not None:
+                in_chunk = (exclude_query >= chunk_start) & (exclude_query < chunk_end)
+                score[exclude_query[in_chunk] - chunk_start, exclude_vector[in_chunk]] = -float("inf")
+
+            top_score, ind = torch.topk(score, k, dim=1)
+            all_scores.append(top_score)
+            all_ind.append(ind)
+
+        score = torch.cat(all_scores, dim=0)
+        ind = torch.cat(all_ind, dim=0)
+
+        if self.method == "l2":
+            score = -score
+
+        return score.cpu().numpy(), ind.cpu().numpy()
 
 
 class Scorer:
@@ -80,7 +121,7 @@ class Scorer:
     """
     def __init__(
             self, num_embs, emb_size, src2dst: Dict[int, List[int]], neighbours_to_sample=5, index_backend="brute",
-            method = "inner_prod", device="cpu", ns_groups=None
+            method = "inner_prod", device="cpu", ns_groups=None, min_size_for_ann=10000
     ):
         """
         Creates an embedding table, the embeddings in this table are updated once during an epoch. Embeddings from this
@@ -90,7 +131,9 @@ class Scorer:
         :param emb_size: embedding dimensionality
         :param src2dst: Mapping from SRC to all DST, need this to find the hardest negative example for all DST at once
         :param neighbours_to_sample: default number of neighbours
-        :param index_backend: Choose between sklearn and faiss
+        :param index_backend: Choose between sklearn, faiss, brute, or an approximate index. Approximate index is
+            given as `name:param=value,...`, see `AnnIndex.create_approximate_index`
+        :param min_size_for_ann: approximate index is replaced with exact search when there are fewer candidates
         """
         self.scorer_num_emb = num_embs
         self.scorer_emb_size = emb_size
@@ -98,11 +141,14 @@ class Scorer:
         self.scorer_index_backend = index_backend
         self.scorer_method = method
         self.scorer_device = device
+        self.scorer_min_size_for_ann = min_size_for_ann
 
         self.scorer_all_emb = normalize(np.ones((num_embs, emb_size)), axis=1)  # unique dst embedding table
         self.scorer_all_keys = self.get_cand_to_score_against(None)
         self.scorer_key_order = dict(zip(self.scorer_all_keys, range(len(self.scorer_all_keys))))
+        self.scorer_all_keys_array = np.array(self.scorer_all_keys)
         self.scorer_index = None
+        self.scorer_touched_keys = set()  # keys used since the last index update
         self.neighbours_to_sample = min(neighbours_to_sample, self.scorer_num_emb)
         self.prepare_ns_groups(ns_groups)
 
@@ -143,7 +189,30 @@ class Scorer:
         return possible_targets
 
 
+    def mark_touched(self, keys):
+        self.scorer_touched_keys.update(keys)
+
+    def update_index(self):
+        """
+        Update embeddings of keys that were used since the last update. Requires method `embed_keys` that computes
+        embeddings for a list of keys. When the index backend does not support updates, the changes are picked up
+        on the next call to `prepare_index`.
+        """
+        if len(self.scorer_touched_keys) == 0 or not hasattr(self, "embed_keys"):
+            self.scorer_touched_keys.clear()
+            return
+
+        keys = list(self.scorer_touched_keys)
+        self.scorer_touched_keys.clear()
+
+        rows = np.fromiter((self.scorer_key_order[key] for key in keys), dtype=np.int64)
+        self.scorer_all_emb[rows, :] = self.embed_keys(keys)
+
+        if self.scorer_index is not None and hasattr(self.scorer_index, "update"):
+            self.scorer_index.update(rows, self.scorer_all_emb[rows, :])
+
     def prepare_index(self, override_strategy=None):
+        self.scorer_touched_keys.clear()
         if self.scorer_method == "nn":
             self.scorer_index = None
             return
@@ -156,8 +225,20 @@ class Scorer:
             self.scorer_index = FaissIndex(self.scorer_all_emb, method=self.scorer_method)
         elif self.scorer_index_backend == "brute":
             self.scorer_index = Brute(self.scorer_all_emb, method=self.scorer_method, device=self.scorer_device)
+        elif parse_index_spec(self.scorer_index_backend)[0] in approximate_indices:
+            if self.scorer_num_emb < self.scorer_min_size_for_ann:
+                # exact search is faster for small candidate sets
+                self.scorer_index = Brute(self.scorer_all_emb, method=self.scorer_method, device=self.scorer_device)
+            else:
+                self.scorer_index = create_approximate_index(
+                    self.scorer_index_backend, self.scorer_all_emb, method=self.scorer_method,
+                    device=self.scorer_device
+                )
         else:
-            raise ValueError(f"Unsupported backend: {self.scorer_index_backend}. Supported backends are: sklearn|faiss")
+            raise ValueError(
+                f"Unsupported backend: {self.scorer_index_backend}. "
+                f"Supported backends are: sklearn|faiss|brute|{'|'.join(approximate_indices)}"
+            )
 
     def sample_closest_negative(self, ids, k=None):
         if k is None:
@@ -175,32 +256,94 @@ class Scorer:
         # [seed_pool.append(self.scorer_src2dst[id]) for id in ids]
         if hasattr(self, "scorer_ns_group2nodes"):
             nested_negative = self.sample_negative_from_groups(seed_pool, k=k+1)
-        else:
-            nested_negative = self.get_closest_to_keys(seed_pool, k=k+1)
 
-        negative = []
-        for neg in nested_negative:
-            negative.extend(random.choices(neg, k=k))
-        return negative
+            negative = []
+            for neg in nested_negative:
+                negative.extend(random.choices(neg, k=k))
+            return negative
+
+        candidate_rows, candidate_groups = self.get_closest_to_keys(seed_pool, k=k+1)
+        negative_rows = self.sample_from_candidates(candidate_rows, candidate_groups, seed_pool, k=k)
+        return self.scorer_all_keys_array[negative_rows.ravel()].tolist()
+
+    def get_key_rows(self, key_groups):
+        """
+        :param key_groups: list of lists of keys
+        :return: rows of keys in the embedding table and group index for every key
+        """
+        rows = np.fromiter(
+            (self.scorer_key_order[key] for key_group in key_groups for key in key_group), dtype=np.int64
+        )
+        groups = np.repeat(np.arange(len(key_groups)), [len(key_group) for key_group in key_groups])
+        return rows, groups
+
+    @staticmethod
+    def get_positive_pairs(rows, groups):
+        """
+        Create sparse mask of pairs (query position, row) for all keys that belong to the same group as the query.
+        Assumes that keys of every group are stored contiguously.
+        :return: query positions, rows
+        """
+        group_sizes = np.bincount(groups)
+        group_starts = np.cumsum(group_sizes) - group_sizes
+
+        sizes = group_sizes[groups]  # number of positive keys for every query
+        query_pos = np.repeat(np.arange(len(rows)), sizes)
+        offsets = np.arange(len(query_pos)) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        positive_rows = rows[np.repeat(group_starts[groups], sizes) + offsets]
+        return query_pos, positive_rows
 
     def get_closest_to_keys(self, key_groups, k=None):
-        possible_targets = []
-        for key_group in key_groups:
-            closest_keys = []
-            for key in key_group:
-                _, closest = self.scorer_index.query(
-                    self.scorer_all_emb[self.scorer_key_order[key]].reshape(1, -1), k=k
-                )
-                closest_keys.extend(self.scorer_all_keys[c] for c in closest.ravel())
-            # ensure that negative samples do not come from positive edges
-            closest_keys_ = list(set(closest_keys) - set(key_group))
-            if len(closest_keys_) == 0:
-                # backup strategy
-                closest_keys_ = random.choices(list(set(self.scorer_all_keys) - set(key_group)), k=k)
-            possible_targets.append(closest_keys_)
-            # possible_targets.extend(self.scorer_all_keys[c] for c in closest.ravel())
-        return possible_targets
-        # return list(set(possible_targets) - set(keys))
+        """
+        Find closest keys for all groups with a single index query. Keys of the group are never returned as its
+        candidates.
+        :param key_groups: list of lists of keys
+        :param k: number of neighbours for every key
+        :return: unique candidate rows and their group index, sorted by group
+        """
+        rows, groups = self.get_key_rows(key_groups)
+        query_pos, positive_rows = self.get_positive_pairs(rows, groups)
+
+        if isinstance(self.scorer_index, Brute):
+            score, closest = self.scorer_index.query(
+                self.scorer_all_emb[rows], k=k, exclude=(query_pos, positive_rows)
+            )
+            valid = np.isfinite(score)
+        else:
+            _, closest = self.scorer_index.query(self.scorer_all_emb[rows], k=k)
+            valid = closest >= 0
+
+        # ensure that negative samples do not come from positive edges
+        num_keys = len(self.scorer_all_keys)
+        candidate_codes = (groups.reshape(-1, 1) * num_keys + closest)[valid]
+        positive_codes = groups[query_pos] * num_keys + positive_rows
+        candidate_codes = np.unique(candidate_codes[~np.isin(candidate_codes, positive_codes)])
+
+        return candidate_codes % num_keys, candidate_codes // num_keys
+
+    def sample_from_candidates(self, candidate_rows, candidate_groups, key_groups, k):
+        """
+        Sample k candidates with replacement for every group.
+        :param candidate_rows: candidate rows sorted by group
+        :param candidate_groups: group index of every candidate
+        :param key_groups: list of lists of keys, used when a group has no candidates
+        :param k: number of samples for every group
+        :return: array of rows with shape (len(key_groups), k)
+        """
+        num_groups = len(key_groups)
+        counts = np.bincount(candidate_groups, minlength=num_groups)
+        starts = np.cumsum(counts) - counts
+
+        positions = starts.reshape(-1, 1) + (np.random.rand(num_groups, k) * counts.reshape(-1, 1)).astype(np.int64)
+        sampled = candidate_rows[np.minimum(positions, max(len(candidate_rows) - 1, 0))] \
+            if len(candidate_rows) > 0 else np.zeros((num_groups, k), dtype=np.int64)
+
+        for group in np.flatnonzero(counts == 0):
+            # backup strategy
+            backup = random.choices(list(set(self.scorer_all_keys) - set(key_groups[group])), k=k)
+            sampled[group] = [self.scorer_key_order[key] for key in backup]
+
+        return sampled
 
     def set_embed(self, ids, embs):
 
@@ -219,38 +362,30 @@ class Scorer:
         score_matr = (score_matr + 1.) / 2.
         # score_matr = score_matr - self.margin
         # score_matr[score_matr < 0.] = 0.
-        y_pred = score_matr.cpu().tolist()
 
-        return y_pred
+        return score_matr
 
     def set_margin(self, margin):
         self.margin = margin
 
     def score_candidates_l2(self, to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, at=None):
 
-        y_pred = []
-        for i in range(len(to_score_ids)):
-            input_embs = to_score_embs[i, :].reshape(1, -1)
-            score_matr = torch.norm(embs_to_score_against - input_embs, dim=-1)
-            score_matr = 1. / (1. + score_matr)
-            # score_matr = score_matr + self.margin
-            # score_matr[score_matr < 0.] = 0
-            y_pred.append(score_matr.cpu().tolist())
-
-        # embs_to_score_against = embs_to_score_against.unsqueeze(0)
-        # to_score_embs = to_score_embs.unsqueeze(1)
-        #
-        # score_matr = -torch.norm(embs_to_score_against - to_score_embs, dim=-1)
+        score_matr = torch.cdist(to_score_embs, embs_to_score_against)
+        score_matr = 1. / (1. + score_matr)
         # score_matr = score_matr + self.margin
         # score_matr[score_matr < 0.] = 0
-        # y_pred = score_matr.cpu().tolist()
 
-        return y_pred
+        return score_matr
 
     def score_candidates_lp(
             self, to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against, link_predictor, at=None,
             with_types=None
     ):
+        """
+        :param with_types: list with relation types for every query. When provided, every pair of query and type
+            gets a separate row in the score matrix.
+        :return: score matrix
+        """
 
         if with_types is None:
             y_pred = []
@@ -258,15 +393,14 @@ class Scorer:
                 input_embs = to_score_embs[i, :].repeat((embs_to_score_against.shape[0], 1))
                 # predictor_input = torch.cat([input_embs, all_emb], dim=1)
                 y_pred.append(
-                    torch.nn.functional.softmax(link_predictor(input_embs, embs_to_score_against), dim=1)[:, 1].tolist()
+                    torch.nn.functional.softmax(link_predictor(input_embs, embs_to_score_against), dim=1)[:, 1]
                 )  # 0 - negative, 1 - positive
 
-            return y_pred
+            return torch.stack(y_pred, dim=0)
 
         else:
             y_pred = []
             for i in range(len(to_score_ids)):
-                y_pred.append(dict())
                 for type in with_types[i]:
                     input_embs = to_score_embs[i, :].unsqueeze(0)
                     # predictor_input = torch.cat([input_embs, all_emb], dim=1)
@@ -280,10 +414,9 @@ class Scorer:
                     transl = m_a + rels
                     sim = torch.norm(transl - m_s, dim=-1)
                     sim = 1./ (1. + sim)
-                    y_pred[-1][type] = sim.cpu().tolist()
-
-            return y_pred
+                    y_pred.append(sim)
 
+            return torch.stack(y_pred, dim=0)
 
     def get_gt_candidates(self, ids):
         candidates = [set(list(self.scorer_src2dst[id])) for id in ids]
@@ -320,94 +453,124 @@ class Scorer:
     def get_keys_for_scoring(self):
         return self.scorer_all_keys
 
-    def hits_at_k(self, y_true, y_pred, k):
-        correct = y_true
-        predicted = y_pred
-        result = []
-        for y_true, y_pred in zip(correct, predicted):
-            ind_true = set([ind for ind, y_t in enumerate(y_true) if y_t == 1.])
-            ind_pred = set(list(np.flip(np.argsort(y_pred))[:k]))
-            result.append(len(ind_pred.intersection(ind_true)) / min(len(ind_true), k))
-
-        return sum(result) / len(result)
-
-    def mean_rank(self, y_true, y_pred):
-        true_ranks = []
-        reciprocal_ranks = []
-
-        correct = y_true
-        predicted = y_pred
-        for y_true, y_pred in zip(correct, predicted):
-            ranks = sorted(zip(y_true, y_pred), key=lambda x: x[1], reverse=True)
-            for ind, (true, pred) in enumerate(ranks):
-                if true > 0.:
-                    true_ranks.append(ind + 1)
-                    reciprocal_ranks.append(1 / (ind + 1))
-                    break  # should consider only first result https://en.wikipedia.org/wiki/Mean_reciprocal_rank
-
-        return sum(true_ranks) / len(true_ranks), sum(reciprocal_ranks) / len(reciprocal_ranks)
-
-    def mean_average_precision(self, y_true, y_pred):
-        correct = y_true
-        predicted = y_pred
-        map = 0.
-        for y_true, y_pred in zip(correct, predicted):
-            ranks = sorted(zip(y_true, y_pred), key=lambda x: x[1], reverse=True)
-            found_relevant = 0
-            avep = 0.
-            for ind, (true, pred) in enumerate(ranks):
-                if true > 0.:
-                    found_relevant += 1
-                    avep += found_relevant / (ind + 1)  # precision@k
-            avep /= found_relevant
-
-            map += avep
-
-        map /= len(correct)
-
-        return map
-
-    def get_y_true_from_candidate_list(self, candidates, keys_to_score_against):
-        y_true = [[1. if key in cand else 0. for key in keys_to_score_against] for cand in candidates]
-        return y_true
-
-    def get_y_true_from_candidates(self, candidates, keys_to_score_against):
+    def get_relevant_positions(self, candidates, keys_to_score_against):
+        """
+        Represent ground truth as positions of relevant keys in the score matrix.
+        :param candidates: list of sets with relevant keys for every query. Keys are tuples (key, type) when
+            candidates are typed.
+        :param keys_to_score_against: keys that correspond to the columns of the score matrix
+        :return: row and column indices of relevant keys, and the list of types for every query when candidates
+            are typed. For typed candidates, every pair of query and type has its own row.
+        """
+        if keys_to_score_against is self.scorer_all_keys:
+            key_position = self.scorer_key_order
+        else:
+            key_position = dict(zip(keys_to_score_against, range(len(keys_to_score_against))))
 
         has_types = isinstance(list(candidates[0])[0], tuple)
 
-        if not has_types:
-            return self.get_y_true_from_candidate_list(candidates, keys_to_score_against)
+        rows = []
+        cols = []
 
-        candidate_dicts = []
+        if not has_types:
+            for row, cand in enumerate(candidates):
+                for key in cand:
+                    if key in key_position:
+                        rows.append(row)
+                        cols.append(key_position[key])
+            return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), None
+
+        query_types = []
+        row = 0
         for cand in candidates:
-            candidate_dicts.append(dict())
+            type_rows = dict()
             for ent, type in cand:
-                if type not in candidate_dicts[-1]:
-                    candidate_dicts[-1][type] = []
-                candidate_dicts[-1][type].append(ent)
-
-        y_true = []
-        for cand in candidate_dicts:
-            y_true.append(dict())
-            for type, ents in cand.items():
-                y_true[-1][type] = [1. if key in ents else 0. for key in keys_to_score_against]
-                assert sum(y_true[-1][type]) > 0.
-
-        return y_true
-
-    def flatten_pred(self, y):
+                if type not in type_rows:
+                    type_rows[type] = row
+                    row += 1
+                if ent in key_position:
+                    rows.append(type_rows[type])
+                    cols.append(key_position[ent])
+            query_types.append(list(type_rows.keys()))
+
+        return np.array(rows, dtype=np.int64), np.array(cols, dtype=np.int64), query_types
+
+    @staticmethod
+    def get_ranks(y_pred, rows, cols, max_chunk_size=2 ** 24):
+        """
+        Compute ranks of relevant keys. Ties are resolved by column order, the same way as a stable sort would.
+        :param y_pred: score matrix
+        :param rows: row indices of relevant keys
+        :param cols: column indices of relevant keys
+        :param max_chunk_size: maximum number of compared elements in one chunk
+        :return: array with 1-based ranks
+        """
+        rows = torch.as_tensor(rows, dtype=torch.long).to(y_pred.device)
+        cols = torch.as_tensor(cols, dtype=torch.long).to(y_pred.device)
+        positions = torch.arange(y_pred.shape[1], device=y_pred.device).unsqueeze(0)
+
+        chunk_size = max(max_chunk_size // max(y_pred.shape[1], 1), 1)
+
+        ranks = []
+        for chunk_start in range(0, len(rows), chunk_size):
+            row_scores = y_pred[rows[chunk_start: chunk_start + chunk_size]]
+            chunk_cols = cols[chunk_start: chunk_start + chunk_size].unsqueeze(1)
+            target = row_scores.gather(1, chunk_cols)
+            higher = (row_scores > target).sum(dim=1)
+            tied_before = ((row_scores == target) & (positions < chunk_cols)).sum(dim=1)
+            ranks.append(higher + tied_before + 1)
+
+        if len(ranks) == 0:
+            return np.zeros((0,), dtype=np.int64)
+        return torch.cat(ranks).cpu().numpy()
+
+    @staticmethod
+    def ranking_metrics(ranks, rows, num_rows, at):
+        """
+        Compute hits@k, ndcg@k, mean rank, mean reciprocal rank, and mean average precision from the ranks of
+        relevant keys. Only rows with at least one relevant key are considered.
+        :param ranks: 1-based ranks of relevant keys
+        :param rows: row index for every rank
+        :param num_rows: number of rows in the score matrix
+        :param at: list of cutoffs
+        :return: dictionary with scores
+        """
+        order = np.lexsort((ranks, rows))
+        ranks = ranks[order].astype(np.float64)
+        rows = rows[order]
 
-        flattened = []
-        for x in y:
-            for key, scores in x.items():
-                flattened.append(scores)
+        counts = np.bincount(rows, minlength=num_rows)
+        starts = np.cumsum(counts) - counts
+        has_relevant = counts > 0
+        # 1-based position of every relevant key among relevant keys of the same row
+        position = np.arange(len(ranks)) - np.repeat(starts, counts) + 1
 
-        return flattened
+        scores = {}
+        for k in at:
+            in_top = ranks <= k
+            hits = np.bincount(rows, weights=in_top, minlength=num_rows)
+            scores[f"hits@{k}"] = float(np.mean(hits[has_relevant] / np.minimum(counts[has_relevant], k)))
+
+            dcg = np.bincount(rows, weights=in_top / np.log2(ranks + 1), minlength=num_rows)
+            ideal_dcg = np.cumsum(1. / np.log2(np.arange(2, k + 2)))
+            idcg = ideal_dcg[np.minimum(counts[has_relevant], k) - 1]
+            scores[f"ndcg@{k}"] = float(np.mean(dcg[has_relevant] / idcg))
+
+        first_ranks = ranks[starts[has_relevant]]
+        average_precision = np.bincount(rows, weights=position / ranks, minlength=num_rows)[has_relevant] / \
+                            counts[has_relevant]
+
+        scores["mr"] = float(np.mean(first_ranks))
+        scores["mrr"] = float(np.mean(1. / first_ranks))
+        scores["map"] = float(np.mean(average_precision))
+        return scores
 
     def score_candidates(self, to_score_ids, to_score_embs, link_predictor=None, at=None, type=None, device="cpu"):
 
         if at is None:
             at = [1, 3, 5, 10]
+        if not isinstance(at, Iterable):
+            at = [at]
 
         start = time.time()
 
@@ -417,16 +580,14 @@ class Scorer:
         # keys_to_score_against = self.get_cand_to_score_against(to_score_ids)
         keys_to_score_against = self.get_keys_for_scoring()
 
-        y_true = self.get_y_true_from_candidates(candidates, keys_to_score_against)
+        rows, cols, query_types = self.get_relevant_positions(candidates, keys_to_score_against)
 
         embs_to_score_against = self.get_embeddings_for_scoring(device=to_score_embs.device)
 
         if type == "nn":
-            has_types = isinstance(y_true[0], dict)
-
             y_pred = self.score_candidates_lp(
                 to_score_ids, to_score_embs, keys_to_score_against, embs_to_score_against,
-                link_predictor, at=at, with_types=y_true if has_types else None
+                link_predictor, at=at, with_types=query_types
             )
         elif type == "inner_prod":
             y_pred = self.score_candidates_cosine(
@@ -439,29 +600,13 @@ class Scorer:
         else:
             raise ValueError(f"`type` can be either `nn` or `inner_prod` but `{type}` given")
 
-        has_types = isinstance(y_pred[0], dict)
-
-        if has_types:
-            y_true = self.flatten_pred(y_true)
-            y_pred = self.flatten_pred(y_pred)
+        if query_types is not None and type != "nn":
+            # scores do not depend on the type, repeat them for every pair of query and type
+            repeats = torch.LongTensor([len(types) for types in query_types]).to(y_pred.device)
+            y_pred = torch.repeat_interleave(y_pred, repeats, dim=0)
 
-        scores = {}
-        # y_true_onehot = np.array(y_true)
-        # labels=list(range(y_true_onehot.shape[1]))
+        ranks = self.get_ranks(y_pred, rows, cols)
 
-        if isinstance(at, Iterable):
-            scores.update({f"hits@{k}": self.hits_at_k(y_true, y_pred, k=k) for k in at})
-            scores.update({f"ndcg@{k}": ndcg_score(y_true, y_pred, k=k) for k in at})
-            # scores = {f"ndcg@{k}": ndcg_score(y_true, y_pred, k=k) for k in at}
-        else:
-            scores.update({f"hits@{at}": self.hits_at_k(y_true, y_pred, k=at)})
-            scores.update({f"ndcg@{at}": ndcg_score(y_true, y_pred, k=at)})
-            # scores = {f"ndcg@{at}": ndcg_score(y_true, y_pred, k=at)}
-
-        mr, mrr = self.mean_rank(y_true, y_pred)
-        map = self.mean_average_precision(y_true, y_pred)
-        scores["mr"] = mr
-        scores["mrr"] = mrr
-        scores["map"] = map
+        scores = self.ranking_metrics(ranks, rows, y_pred.shape[0], at)
         scores["scoring_time"] = time.time() - start
         return scores
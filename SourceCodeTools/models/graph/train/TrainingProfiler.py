@@ -0,0 +1,157 @@
+import json
+import logging
+from collections import defaultdict
+from os.path import join
+from time import perf_counter
+
+import torch
+
+
+class _DisabledStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+class _Stage:
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.profiler._synchronize()
+        self.start = perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.profiler._synchronize()
+        self.profiler.record(self.name, perf_counter() - self.start)
+        return False
+
+
+class TrainingProfiler:
+    """
+    Collects wall time of training stages such as subgraph sampling, transfer of blocks to device, masking,
+    node embedding lookup, GNN forward, negative sampling, backward, optimizer steps, and index refresh.
+    Stages can be nested, the time of a stage includes the time of its nested stages. When disabled, `stage`
+    returns a shared no-op context manager and nothing is recorded.
+
+    Optionally, `torch.profiler` trace is recorded for a window of training steps and stored in TensorBoard format.
+    """
+
+    _disabled_stage = _DisabledStage()
+
+    def __init__(self, enabled=False, output_dir=None, device="cpu", trace_start=None, trace_steps=5):
+        """
+        :param enabled: record stage times
+        :param output_dir: directory for JSON reports and `torch.profiler` traces
+        :param device: training device. For CUDA devices, stages are synchronized to measure the time of kernels
+            launched within the stage.
+        :param trace_start: global training step when `torch.profiler` trace starts. Trace is disabled when None.
+        :param trace_steps: number of steps recorded in the trace
+        """
+        self.enabled = enabled
+        self.output_dir = output_dir
+        self.synchronize_cuda = enabled and torch.device(device).type == "cuda"
+        self.trace_start = trace_start
+        self.trace_steps = trace_steps
+        self.torch_profiler = None
+        self.global_step = 0
+        self.reset_epoch()
+
+    def reset_epoch(self):
+        self.step_times = defaultdict(float)
+        self.epoch_times = defaultdict(float)
+        self.epoch_max_step_times = defaultdict(float)
+        self.epoch_calls = defaultdict(int)
+        self.epoch_steps = 0
+
+    def _synchronize(self):
+        if self.synchronize_cuda:
+            torch.cuda.synchronize()
+
+    def stage(self, name):
+        """
+        Context manager that measures the time of a training stage.
+        :param name: stage name
+        """
+        if not self.enabled:
+            return self._disabled_stage
+        return _Stage(self, name)
+
+    def record(self, name, elapsed):
+        self.step_times[name] += elapsed
+        self.epoch_calls[name] += 1
+
+    def start_trace(self):
+        if self.trace_start is None or self.output_dir is None:
+            return
+        self.torch_profiler = torch.profiler.profile(
+            schedule=torch.profiler.schedule(
+                wait=max(self.trace_start - self.global_step - 1, 0), warmup=1, active=self.trace_steps, repeat=1
+            ),
+            on_trace_ready=torch.profiler.tensorboard_trace_handler(join(self.output_dir, "profiler_trace")),
+            record_shapes=True
+        )
+        self.torch_profiler.__enter__()
+
+    def stop_trace(self):
+        if self.torch_profiler is not None:
+            self.torch_profiler.__exit__(None, None, None)
+            self.torch_profiler = None
+
+    def end_step(self):
+        """
+        Finish the current training step.
+        :return: dictionary with the time of every stage during the step
+        """
+        if self.torch_profiler is not None:
+            self.torch_profiler.step()
+            if self.global_step + 1 >= self.trace_start + self.trace_steps:
+                self.stop_trace()
+        self.global_step += 1
+
+        if not self.enabled:
+            return {}
+
+        step_times = dict(self.step_times)
+        for name, elapsed in step_times.items():
+            self.epoch_times[name] += elapsed
+            self.epoch_max_step_times[name] = max(self.epoch_max_step_times[name], elapsed)
+        self.epoch_steps += 1
+        self.step_times = defaultdict(float)
+        return step_times
+
+    def epoch_report(self, epoch):
+        """
+        Summarize stage times for the epoch, write the report to `output_dir`, and reset epoch statistics.
+        :param epoch: epoch number
+        :return: dictionary with total, mean and maximum time per step, and number of calls for every stage
+        """
+        if not self.enabled:
+            return {}
+
+        steps = max(self.epoch_steps, 1)
+        report = {
+            "epoch": epoch,
+            "steps": self.epoch_steps,
+            "stages": {
+                name: {
+                    "total": total,
+                    "mean_per_step": total / steps,
+                    "max_per_step": self.epoch_max_step_times[name],
+                    "calls": self.epoch_calls[name],
+                } for name, total in sorted(self.epoch_times.items(), key=lambda x: x[1], reverse=True)
+            }
+        }
+
+        if self.output_dir is not None:
+            report_path = join(self.output_dir, f"profile_epoch_{epoch}.json")
+            with open(report_path, "w") as sink:
+                sink.write(json.dumps(report, indent=4))
+            logging.info(f"Stored training profile in {report_path}")
+
+        self.reset_epoch()
+        return report
@@ -0,0 +1,79 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+
+from SourceCodeTools.models.graph.train.AnnIndex import create_approximate_index
+from SourceCodeTools.models.graph.train.Scorer import Brute
+
+
+def create_clustered_vectors(num_vectors, dim, num_clusters=1000, noise=0.3, random_seed=42):
+    """
+    Sample vectors around random cluster centers. Target embeddings form clusters, so uniformly random vectors
+    would underestimate recall of approximate indices.
+    """
+    rng = np.random.default_rng(random_seed)
+    centers = rng.normal(size=(num_clusters, dim))
+    assignment = rng.integers(0, num_clusters, num_vectors)
+    vectors = centers[assignment] + noise * rng.normal(size=(num_vectors, dim))
+    return vectors.astype(np.float32)
+
+
+def recall_at_k(true_ind, found_ind):
+    k = true_ind.shape[1]
+    hits = sum(len(set(t) & set(f[f >= 0])) for t, f in zip(true_ind.tolist(), found_ind))
+    return hits / (len(true_ind) * k)
+
+
+def timed_query(index, queries, k, batch_size):
+    start = time.time()
+    found = []
+    for batch_start in range(0, len(queries), batch_size):
+        _, ind = index.query(queries[batch_start: batch_start + batch_size], k=k)
+        found.append(ind)
+    return np.concatenate(found, axis=0), time.time() - start
+
+
+def run_benchmark(specs, num_vectors, dim, num_queries, k, batch_size, method, device):
+    logging.info(f"Creating {num_vectors} vectors with {dim} dimensions")
+    vectors = create_clustered_vectors(num_vectors, dim)
+    queries = vectors[np.random.choice(num_vectors, num_queries, replace=False)]
+
+    start = time.time()
+    flat = Brute(vectors, method=method, device=device)
+    build_time = time.time() - start
+    true_ind, query_time = timed_query(flat, queries, k, batch_size)
+    logging.info(
+        f"flat: build {build_time:.2f} s, query {1000 * query_time / num_queries:.3f} ms per vector, recall@{k} 1.0"
+    )
+
+    for spec in specs:
+        start = time.time()
+        index = create_approximate_index(spec, vectors, method=method, device=device)
+        build_time = time.time() - start
+        found_ind, query_time = timed_query(index, queries, k, batch_size)
+        logging.info(
+            f"{spec}: build {build_time:.2f} s, query {1000 * query_time / num_queries:.3f} ms per vector, "
+            f"recall@{k} {recall_at_k(true_ind, found_ind):.4f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare recall and latency of approximate indices with exact search")
+    parser.add_argument("--specs", nargs="+", default=["ivf", "ivf:n_probe=32", "faiss_ivf", "faiss_ivfpq", "faiss_hnsw"],
+                        help="Index specifications in the format accepted by `--nn_index`")
+    parser.add_argument("--num_vectors", default=1000000, type=int)
+    parser.add_argument("--dim", default=100, type=int)
+    parser.add_argument("--num_queries", default=10000, type=int)
+    parser.add_argument("--k", default=10, type=int)
+    parser.add_argument("--batch_size", default=512, type=int)
+    parser.add_argument("--method", default="inner_prod", type=str, help="inner_prod|l2")
+    parser.add_argument("--device", default="cpu", type=str)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s:%(levelname)s:%(message)s")
+
+    run_benchmark(
+        args.specs, args.num_vectors, args.dim, args.num_queries, args.k, args.batch_size, args.method, args.device
+    )
@@ -0,0 +1,259 @@
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from datetime import timedelta
+from multiprocessing.connection import wait
+
+import torch
+import torch.distributed as dist
+
+
+class WorkerProcessError(RuntimeError):
+    def __init__(self, failed):
+        super().__init__(
+            "Training processes failed: " +
+            ", ".join(f"{worker.pid} exited with code {worker.exitcode}" for worker in failed)
+        )
+
+
+class DistributedContext:
+    """
+    Process group for data-parallel CPU training with `gloo` backend. Every process trains a replica of the model on
+    its own partition of training targets. After the backward pass, dense gradients are averaged with all-reduce.
+    Gradients of sparse node embedding buckets are exchanged as (row, value) pairs, so that only the rows used
+    in the step are communicated.
+    """
+    joined_key = "joined_processes"
+
+    def __init__(self, rank, world_size, workers=None, previous_num_threads=None):
+        self.rank = rank
+        self.world_size = world_size
+        self.workers = workers or []
+        self.previous_num_threads = previous_num_threads
+
+    @classmethod
+    def initialize(
+            cls, rank, world_size, master_port, master_addr="127.0.0.1", num_threads=None, timeout_minutes=30,
+            workers=None
+    ):
+        """
+        Join the process group. Blocks until all processes joined.
+        :param rank: rank of the current process, rank 0 evaluates and stores the model
+        :param world_size: number of training processes
+        :param master_port: port used for process rendezvous
+        :param master_addr: address of rank 0
+        :param num_threads: number of intra-op threads of the process, cpu_count // world_size when None. The previous
+            value is restored by `shutdown`.
+        :param timeout_minutes: timeout of collective operations
+        :param workers: processes started with `start_worker_processes`, only in the main process. Rendezvous fails
+            as soon as one of them exits with an error.
+        """
+        timeout = timedelta(minutes=timeout_minutes)
+        previous_num_threads = torch.get_num_threads()
+        torch.set_num_threads(num_threads or max(os.cpu_count() // world_size, 1))
+
+        context = cls(rank, world_size, workers=workers, previous_num_threads=previous_num_threads)
+        try:
+            store = dist.TCPStore(master_addr, master_port, world_size, rank == 0, timeout, wait_for_workers=False)
+            if rank == 0:
+                context._wait_for_processes(store, timeout)
+            else:
+                store.add(cls.joined_key, 1)
+            dist.init_process_group("gloo", store=store, rank=rank, world_size=world_size, timeout=timeout)
+        except:
+            context.shutdown()
+            raise
+        return context
+
+    def _wait_for_processes(self, store, timeout):
+        # the default rendezvous blocks until timeout when a process fails before joining
+        deadline = time.monotonic() + timeout.total_seconds()
+        while store.add(self.joined_key, 0) < self.world_size - 1:
+            self.check_worker_processes()
+            if time.monotonic() > deadline:
+                raise RuntimeError("Timed out waiting for training processes to join")
+            wait([worker.sentinel for worker in self.workers], timeout=0.1)
+
+    def check_worker_processes(self):
+        """
+        Raise an error if one of the worker processes exited with an error. Does nothing in worker processes.
+        """
+        failed = [worker for worker in self.workers if worker.exitcode not in (None, 0)]
+        if len(failed) > 0:
+            raise WorkerProcessError(failed)
+
+    @property
+    def is_main_process(self):
+        return self.rank == 0
+
+    def shutdown(self):
+        if dist.is_initialized():
+            dist.destroy_process_group()
+        if self.previous_num_threads is not None:
+            torch.set_num_threads(self.previous_num_threads)
+            self.previous_num_threads = None
+
+    def barrier(self):
+        dist.barrier()
+
+    def partition(self, ids):
+        """
+        Select training targets of the current process.
+        :param ids: array or tensor of ids, or dictionary of them for every node type
+        :return: every `world_size`-th id starting from `rank`
+        """
+        if isinstance(ids, dict):
+            return {key: val[self.rank::self.world_size] for key, val in ids.items()}
+        return ids[self.rank::self.world_size]
+
+    def all_reduce_min(self, values):
+        """
+        :param values: list of integers
+        :return: element-wise minimum of the lists over all processes
+        """
+        values = torch.LongTensor(values)
+        dist.all_reduce(values, op=dist.ReduceOp.MIN)
+        return values.tolist()
+
+    def broadcast_flag(self, flag):
+        """
+        :return: value of the flag in the main process
+        """
+        flag = torch.LongTensor([int(flag)])
+        dist.broadcast(flag, src=0)
+        return bool(flag.item())
+
+    def broadcast_seed(self):
+        """
+        :return: random seed drawn by the main process, identical in all processes
+        """
+        seed = torch.LongTensor([int.from_bytes(os.urandom(4), "little") if self.is_main_process else 0])
+        dist.broadcast(seed, src=0)
+        return int(seed.item())
+
+    def broadcast_parameters(self, parameters):
+        """
+        Copy parameter values from the main process, so that all replicas start from the same state.
+        """
+        for param in parameters:
+            dist.broadcast(param.data, src=0)
+
+    def all_reduce_gradients(self, dense_parameters, sparse_parameters):
+        """
+        Average gradients over processes. Parameters that did not receive gradients in any of the processes keep
+        `grad=None`, so that optimizers skip them the same way as in single process training.
+        :param dense_parameters: parameters with dense gradients
+        :param sparse_parameters: parameters with sparse gradients, e.g. embedding tables with `sparse=True`
+        """
+        dense_parameters = list(dense_parameters)
+        sparse_parameters = list(sparse_parameters)
+
+        has_grad = torch.LongTensor([p.grad is not None for p in dense_parameters + sparse_parameters])
+        dist.all_reduce(has_grad)
+        has_grad = has_grad.tolist()
+
+        self._all_reduce_dense(dense_parameters, has_grad[:len(dense_parameters)])
+        for param, param_has_grad in zip(sparse_parameters, has_grad[len(dense_parameters):]):
+            if param_has_grad > 0:
+                self._all_reduce_sparse(param)
+
+    def _all_reduce_dense(self, parameters, has_grad):
+        parameters = [p for p, param_has_grad in zip(parameters, has_grad) if param_has_grad > 0]
+        if len(parameters) == 0:
+            return
+
+        # all gradients are reduced with a single collective call
+        flat = torch.cat([
+            p.grad.detach().reshape(-1) if p.grad is not None else torch.zeros(p.numel(), dtype=p.dtype)
+            for p in parameters
+        ])
+        dist.all_reduce(flat)
+        flat /= self.world_size
+
+        offset = 0
+        for p in parameters:
+            grad = flat[offset: offset + p.numel()].view_as(p)
+            if p.grad is None:
+                p.grad = grad.clone()
+            else:
+                p.grad.copy_(grad)
+            offset += p.numel()
+
+    def _all_reduce_sparse(self, param):
+        if param.grad is not None:
+            grad = param.grad.coalesce()
+            indices, values = grad.indices(), grad.values()
+        else:
+            indices = torch.zeros((1, 0), dtype=torch.long)
+            values = torch.zeros((0,) + tuple(param.shape[1:]), dtype=param.dtype)
+
+        # processes update different number of rows, pad to the largest number before gathering
+        sizes = [torch.zeros(1, dtype=torch.long) for _ in range(self.world_size)]
+        dist.all_gather(sizes, torch.LongTensor([indices.shape[1]]))
+        sizes = [int(size.item()) for size in sizes]
+        max_size = max(sizes)
+
+        padded_indices = torch.zeros((indices.shape[0], max_size), dtype=indices.dtype)
+        padded_indices[:, :indices.shape[1]] = indices
+        padded_values = torch.zeros((max_size,) + tuple(values.shape[1:]), dtype=values.dtype)
+        padded_values[:values.shape[0]] = values
+
+        gathered_indices = [torch.empty_like(padded_indices) for _ in range(self.world_size)]
+        gathered_values = [torch.empty_like(padded_values) for _ in range(self.world_size)]
+        dist.all_gather(gathered_indices, padded_indices)
+        dist.all_gather(gathered_values, padded_values)
+
+        indices = torch.cat([ind[:, :size] for ind, size in zip(gathered_indices, sizes)], dim=1)
+        values = torch.cat([val[:size] for val, size in zip(gathered_values, sizes)], dim=0)
+        param.grad = torch.sparse_coo_tensor(
+            indices, values / self.world_size, size=param.shape
+        ).coalesce()
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_worker_processes(world_size, target, args):
+    """
+    Start training processes with ranks 1..world_size-1. The caller becomes rank 0. Processes are forked, so that
+    the dataset loaded in the main process, including memory-mapped arrays, is shared copy-on-write instead of
+    being pickled and loaded again.
+    :param world_size: total number of training processes
+    :param target: function called as `target(rank, world_size, master_port, *args)`
+    :param args: additional arguments for `target`
+    :return: list of started processes and the rendezvous port
+    """
+    master_port = find_free_port()
+    context = multiprocessing.get_context("fork")
+    workers = []
+    for rank in range(1, world_size):
+        # not daemonic, worker processes can start data loader workers
+        worker = context.Process(target=target, args=(rank, world_size, master_port) + tuple(args), daemon=False)
+        worker.start()
+        workers.append(worker)
+    logging.info(f"Started {len(workers)} additional training processes")
+    return workers, master_port
+
+
+def join_worker_processes(workers, terminate=False):
+    """
+    Wait until training processes exit.
+    :param workers: processes started with `start_worker_processes`
+    :param terminate: stop processes that are still running, e.g. when the main process failed
+    :raises RuntimeError: if a process exited with an error before it was terminated
+    """
+    failed = [worker for worker in workers if worker.exitcode not in (None, 0)]
+    for worker in workers:
+        if terminate and worker.is_alive():
+            worker.terminate()
+        worker.join()
+        if not terminate and worker.exitcode != 0 and worker not in failed:
+            failed.append(worker)
+
+    if len(failed) > 0:
+        raise WorkerProcessError(failed)
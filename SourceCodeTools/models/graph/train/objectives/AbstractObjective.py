@@ -1,6 +1,7 @@
 import logging
 from abc import abstractmethod
 from collections import defaultdict
+from math import ceil
 
 import dgl
 import torch
@@ -11,6 +12,8 @@ from SourceCodeTools.mltools.torch import compute_accuracy
 from SourceCodeTools.models.graph.ElementEmbedder import ElementEmbedderWithBpeSubwords, GraphLinkSampler
 from SourceCodeTools.models.graph.ElementEmbedderBase import ElementEmbedderBase
 from SourceCodeTools.models.graph.LinkPredictor import CosineLinkPredictor, BilinearLinkPedictor, L2LinkPredictor
+from SourceCodeTools.models.graph.train.Scorer import Scorer
+from SourceCodeTools.models.graph.train.TrainingProfiler import TrainingProfiler
 
 import torch.nn as nn
 
@@ -20,6 +23,28 @@ class ZeroEdges(Exception):
         super(ZeroEdges, self).__init__(*args)
 
 
+def _ids_to_int64(ids):
+    if isinstance(ids, dict):
+        return {ntype: nodes.long() for ntype, nodes in ids.items()}
+    return ids.long()
+
+
+class GraphIdLoader:
+    """
+    Wraps DGL node loader and converts ids of input and seed nodes to int64. Graphs are created with int32 ids
+    (see `EdgeStore.to_dgl`), while embedding tables and node data are indexed with int64 tensors.
+    """
+    def __init__(self, loader):
+        self.loader = loader
+
+    def __iter__(self):
+        for input_nodes, seeds, blocks in self.loader:
+            yield _ids_to_int64(input_nodes), _ids_to_int64(seeds), blocks
+
+    def __len__(self):
+        return len(self.loader)
+
+
 class EarlyStoppingTracker:
     def __init__(self, early_stopping_tolerance):
         self.early_stopping_tolerance = early_stopping_tolerance
@@ -81,6 +106,13 @@ class AbstractObjective(nn.Module):
     #
     # ntypes = None
 
+    # loader options, changed with `set_loader_options`
+    neighbour_sampling = "full"
+    loader_workers = 0
+    prefetch_batches = 2
+    # replaced by the trainer when profiling is enabled
+    profiler = TrainingProfiler(enabled=False)
+
     def __init__(
             self, name, graph_model, node_embedder, nodes, data_loading_func, device,
             sampling_neighbourhood_size, batch_size,
@@ -110,7 +142,7 @@ class AbstractObjective(nn.Module):
 
         self.create_target_embedder(data_loading_func, nodes, tokenizer_path)
         self.create_link_predictor()
-        self.create_loaders()
+        self.prepare_loader_pools()
 
         self.target_embedding_fn = self.get_targets_from_embedder
         self.negative_factor = 1
@@ -199,7 +231,11 @@ class AbstractObjective(nn.Module):
         else:
             raise NotImplementedError()
 
-    def create_loaders(self):
+    def prepare_loader_pools(self):
+        """
+        Find training, validation, and test targets. Data loaders are created from these pools by
+        `set_loader_options`.
+        """
         print("Number of nodes", self.graph_model.g.number_of_nodes())
         train_idx, val_idx, test_idx = self._get_training_targets()
         train_idx, val_idx, test_idx = self.target_embedder.create_idx_pools(
@@ -210,10 +246,7 @@ class AbstractObjective(nn.Module):
             f"val {self._idx_len(val_idx)}, "
             f"test {self._idx_len(test_idx)}."
         )
-        self.train_loader, self.val_loader, self.test_loader = self._get_loaders(
-            train_idx=train_idx, val_idx=val_idx, test_idx=test_idx,
-            batch_size=self.batch_size  # batch_size_node_name
-        )
+        self.loader_pools = (train_idx, val_idx, test_idx)
 
         def get_num_nodes(ids):
             return sum(len(ids[key_]) for key_ in ids) // self.batch_size + 1
@@ -282,21 +315,96 @@ class AbstractObjective(nn.Module):
 
         return train_idx, val_idx, test_idx
 
-    def _create_loader(self, ids, batch_size=None, shuffle=False):
+    def set_index_options(self, min_size_for_ann=10000):
+        """
+        Configure nearest neighbour index used for negative sampling.
+        :param min_size_for_ann: approximate index is replaced with exact search when there are fewer candidates
+        """
+        if isinstance(getattr(self, "target_embedder", None), Scorer):
+            self.target_embedder.scorer_min_size_for_ann = min_size_for_ann
+
+    def set_loader_options(self, neighbour_sampling="full", loader_workers=0, prefetch_batches=2):
+        """
+        Configure how training subgraphs are sampled and create data loaders.
+        :param neighbour_sampling: `full` uses all neighbours on every layer, `fanout` samples at most
+            `sampling_neighbourhood_size` incoming edges per node on every layer
+        :param loader_workers: number of worker processes that sample subgraphs for train, validation, and test
+            loaders. When zero, sampling happens in the training process.
+        :param prefetch_batches: number of batches sampled ahead of time by worker processes
+        """
+        if neighbour_sampling not in {"full", "fanout"}:
+            raise ValueError(
+                f"Unsupported neighbour sampling: {neighbour_sampling}. Supported sampling strategies are: full|fanout"
+            )
+        assert loader_workers >= 0, "Number of loader workers should be non-negative"
+
+        self.neighbour_sampling = neighbour_sampling
+        self.loader_workers = loader_workers
+        self.prefetch_batches = prefetch_batches
+
+        self.create_loaders()
+
+    def create_loaders(self):
+        for data_split in ["train", "val", "test"]:
+            iter_name = f"{data_split}_loader_iter"
+            if hasattr(self, iter_name):
+                delattr(self, iter_name)
+
+        train_idx, val_idx, test_idx = self.loader_pools
+        self.train_loader, self.val_loader, self.test_loader = self._get_loaders(
+            train_idx=train_idx, val_idx=val_idx, test_idx=test_idx,
+            batch_size=self.batch_size  # batch_size_node_name
+        )
+
+    def partition_training_pool(self, partition_fn):
+        """
+        Keep a subset of training targets. Used for data-parallel training, where every process trains on its own
+        partition. Should be called before data loaders are created with `set_loader_options`.
+        :param partition_fn: function that receives the pool of training targets and returns the subset
+        """
+        train_idx, val_idx, test_idx = self.loader_pools
+        train_idx = partition_fn(train_idx)
+        self.loader_pools = (train_idx, val_idx, test_idx)
+        self.num_train_batches = self._idx_len(train_idx) // self.batch_size + 1
+
+    def _create_sampler(self):
+        num_layers = self.graph_model.num_layers
+        if self.neighbour_sampling == "fanout":
+            return dgl.dataloading.MultiLayerNeighborSampler([self.sampling_neighbourhood_size] * num_layers)
+        return dgl.dataloading.MultiLayerFullNeighborSampler(num_layers)
+
+    def _create_loader(self, ids, batch_size=None, shuffle=False, use_workers=False):
         if batch_size is None:
             # TODO
             # only works when ids do not have types
             batch_size = self._idx_len(ids)
-        sampler = dgl.dataloading.MultiLayerFullNeighborSampler(self.graph_model.num_layers)
+        sampler = self._create_sampler()
+
+        worker_options = {"num_workers": 0}
+        if use_workers and self.loader_workers > 0:
+            # workers are kept alive between epochs because iterators are recreated for every epoch
+            worker_options = {
+                "num_workers": self.loader_workers,
+                "prefetch_factor": max(ceil(self.prefetch_batches / self.loader_workers), 1),
+                "persistent_workers": True,
+            }
+
+        # seed ids should have the same type as graph ids
+        idtype = self.graph_model.g.idtype
+        if isinstance(ids, dict):
+            ids = {ntype: torch.as_tensor(nodes).to(idtype) for ntype, nodes in ids.items()}
+        else:
+            ids = torch.as_tensor(ids).to(idtype)
+
         loader = dgl.dataloading.NodeDataLoader(
-            self.graph_model.g, ids, sampler, batch_size=batch_size, shuffle=shuffle, num_workers=0)
-        return loader
+            self.graph_model.g, ids, sampler, batch_size=batch_size, shuffle=shuffle, **worker_options)
+        return GraphIdLoader(loader)
 
     def _get_loaders(self, train_idx, val_idx, test_idx, batch_size):
 
-        train_loader = self._create_loader(train_idx, batch_size, shuffle=False)
-        val_loader = self._create_loader(val_idx, batch_size, shuffle=False)
-        test_loader = self._create_loader(test_idx, batch_size, shuffle=False)
+        train_loader = self._create_loader(train_idx, batch_size, shuffle=False, use_workers=True)
+        val_loader = self._create_loader(val_idx, batch_size, shuffle=False, use_workers=True)
+        test_loader = self._create_loader(test_idx, batch_size, shuffle=False, use_workers=True)
 
         return train_loader, val_loader, test_loader
 
@@ -317,11 +425,12 @@ class AbstractObjective(nn.Module):
 
     def _extract_embed(self, input_nodes, train_embeddings=True, masked=None):
         emb = {}
-        for node_type, nid in input_nodes.items():
-            emb[node_type] = self.node_embedder(
-                node_type=node_type, node_ids=nid,
-                train_embeddings=train_embeddings, masked=masked
-            ).to(self.device)
+        with self.profiler.stage("node_embedder"):
+            for node_type, nid in input_nodes.items():
+                emb[node_type] = self.node_embedder(
+                    node_type=node_type, node_ids=nid,
+                    train_embeddings=train_embeddings, masked=masked
+                ).to(self.device)
         return emb
 
     def compute_acc_loss(self, node_embs_, element_embs_, labels):
@@ -371,10 +480,12 @@ class AbstractObjective(nn.Module):
                 # emb = self._extract_embed(self.graph_model.node_embed(), input_nodes)
                 emb = self._extract_embed(input_nodes, train_embeddings, masked=masked)
             else:
-                emb = self.node_embedder(node_ids=input_nodes, train_embeddings=train_embeddings, masked=masked)
+                with self.profiler.stage("node_embedder"):
+                    emb = self.node_embedder(node_ids=input_nodes, train_embeddings=train_embeddings, masked=masked)
                 # emb = self.graph_model.node_embed()[input_nodes]
 
-        logits = self.graph_model(emb, blocks)
+        with self.profiler.stage("gnn_forward"):
+            logits = self.graph_model(emb, blocks)
 
         if self.use_types:
             for ntype in self.graph_model.g.ntypes:
@@ -404,16 +515,23 @@ class AbstractObjective(nn.Module):
             return seeds
 
     def sample_negative(self, ids, k, neg_sampling_strategy):
-        if neg_sampling_strategy is not None:
-            negative = self.target_embedder.sample_negative(
-                k, ids=ids, strategy=neg_sampling_strategy
-            )
-        else:
-            negative = self.target_embedder.sample_negative(
-                k, ids=ids,
-            )
+        with self.profiler.stage("negative_sampling"):
+            if neg_sampling_strategy is not None:
+                negative = self.target_embedder.sample_negative(
+                    k, ids=ids, strategy=neg_sampling_strategy
+                )
+            else:
+                negative = self.target_embedder.sample_negative(
+                    k, ids=ids,
+                )
         return negative
 
+    def get_mask(self, seeds):
+        if self.masker is None:
+            return None
+        with self.profiler.stage("masker"):
+            return self.masker.get_mask(self.seeds_to_python(seeds))
+
     def get_targets_from_nodes(
             self, positive_indices, negative_indices=None, train_embeddings=True
     ):
@@ -581,7 +699,7 @@ class AbstractObjective(nn.Module):
         return python_seeds
 
     def forward(self, input_nodes, seeds, blocks, train_embeddings=True, neg_sampling_strategy=None):
-        masked = self.masker.get_mask(self.seeds_to_python(seeds)) if self.masker is not None else None
+        masked = self.get_mask(seeds)
         graph_emb = self._graph_embeddings(input_nodes, blocks, train_embeddings, masked=masked)
         node_embs_, element_embs_, labels = self.prepare_for_prediction(
             graph_emb, seeds, self.target_embedding_fn, negative_factor=self.negative_factor,
@@ -134,7 +134,7 @@ class SubgraphAbstractObjective(AbstractObjective):
 
         return train_idx, val_idx, test_idx
 
-    def create_loaders(self):
+    def prepare_loader_pools(self):
         print("Number of nodes", self.graph_model.g.number_of_nodes())
         train_idx, val_idx, test_idx = self._get_training_targets()
         train_idx, val_idx, test_idx = self.target_embedder.create_idx_pools(
@@ -145,11 +145,7 @@ class SubgraphAbstractObjective(AbstractObjective):
             f"val {self._idx_len(val_idx)}, "
             f"test {self._idx_len(test_idx)}."
         )
-        loaders = self._get_loaders(
-            train_idx=train_idx, val_idx=val_idx, test_idx=test_idx,
-            batch_size=self.batch_size  # batch_size_node_name
-        )
-        self.train_loader, self.val_loader, self.test_loader = loaders
+        self.loader_pools = (train_idx, val_idx, test_idx)
 
         # def get_num_nodes(ids):
         #     return sum(len(ids[key_]) for key_ in ids) // self.batch_size + 1
@@ -205,7 +201,7 @@ class SubgraphAbstractObjective(AbstractObjective):
 
     def forward(self, input_nodes, seeds, blocks, train_embeddings=True, neg_sampling_strategy=None):
         subgraph_masks, seeds = seeds
-        masked = self.masker.get_mask(self.seeds_to_python(seeds)) if self.masker is not None else None
+        masked = self.get_mask(seeds)
         graph_emb = self._graph_embeddings(input_nodes, blocks, train_embeddings, masked=masked, subgraph_masks=subgraph_masks)
         subgraph_embs_, element_embs_, labels = self.prepare_for_prediction(
             graph_emb, seeds, self.target_embedding_fn, negative_factor=self.negative_factor,
@@ -16,10 +16,17 @@ import logging
 from tqdm import tqdm
 
 from SourceCodeTools.models.Embedder import Embedder
+from SourceCodeTools.models.EmbeddingStore import EmbeddingStore
 from SourceCodeTools.models.graph.train.objectives import VariableNameUsePrediction, TokenNamePrediction, \
     NextCallPrediction, NodeNamePrediction, GlobalLinkPrediction, GraphTextPrediction, GraphTextGeneration, \
     NodeNameClassifier, EdgePrediction, TypeAnnPrediction, EdgePrediction2, NodeClassifierObjective
 from SourceCodeTools.models.graph.NodeEmbedder import NodeEmbedder
+from SourceCodeTools.models.graph.train.CheckpointWriter import CheckpointWriter, atomic_torch_save, load_checkpoint
+from SourceCodeTools.models.graph.train.IndexRefreshScheduler import IndexRefreshScheduler
+from SourceCodeTools.models.graph.train.ObjectiveScheduler import ObjectiveScheduler
+from SourceCodeTools.models.graph.train.TrainingProfiler import TrainingProfiler
+from SourceCodeTools.models.graph.train.distributed_training import DistributedContext, start_worker_processes, \
+    join_worker_processes
 from SourceCodeTools.models.graph.train.objectives.GraphLinkClassificationObjective import TransRObjective
 from SourceCodeTools.models.graph.train.objectives.SubgraphClassifierObjective import SubgraphClassifierObjective
 from SourceCodeTools.models.graph.train.objectives.SubgraphEmbedderObjective import SubgraphEmbeddingObjective, \
@@ -41,9 +48,10 @@ class SamplingMultitaskTrainer:
 
     def __init__(
             self, dataset=None, model_name=None, model_params=None, trainer_params=None, restore=None, device=None,
-            pretrained_embeddings_path=None, tokenizer_path=None, load_external_dataset=None
+            pretrained_embeddings_path=None, tokenizer_path=None, load_external_dataset=None, distributed=None
     ):
 
+        self.distributed = distributed
         self.graph_model = model_name(dataset.g, **model_params).to(device)
         self.model_params = model_params
         self.trainer_params = trainer_params
@@ -63,6 +71,10 @@ class SamplingMultitaskTrainer:
         )
 
         self.create_objectives(dataset, tokenizer_path)
+        self.configure_indices()
+        self.create_index_refresh_schedulers()
+        self.create_profiler()
+        self.create_objective_scheduler()
 
         if restore:
             self.restore_from_checkpoint(self.model_base_path)
@@ -71,10 +83,13 @@ class SamplingMultitaskTrainer:
             self.trainer_params["model_base_path"] = external_args.external_model_base
 
         self._create_optimizer()
+        self.configure_distributed()
+        self.configure_loaders()
+        self.create_checkpoint_writer()
 
         self.lr_scheduler = ExponentialLR(self.optimizer, gamma=1.0)
         # self.lr_scheduler = ReduceLROnPlateau(self.optimizer, patience=10, cooldown=20)
-        self.summary_writer = SummaryWriter(self.model_base_path)
+        self.summary_writer = SummaryWriter(self.model_base_path) if self.is_main_process else None
 
     def create_objectives(self, dataset, tokenizer_path):
         objective_list = self.trainer_params["objectives"]
@@ -111,6 +126,85 @@ class SamplingMultitaskTrainer:
         if "var_misuse_link" in objective_list:
             self.create_var_misuse_edge_objective(dataset, tokenizer_path)
 
+    def configure_loaders(self):
+        for objective in self.objectives:
+            objective.set_loader_options(
+                neighbour_sampling=self.trainer_params.get("neighbour_sampling", "full"),
+                loader_workers=self.trainer_params.get("loader_workers", 0),
+                prefetch_batches=self.trainer_params.get("prefetch_batches", 2)
+            )
+
+    def configure_indices(self):
+        for objective in self.objectives:
+            objective.set_index_options(min_size_for_ann=self.trainer_params.get("min_size_for_ann", 10000))
+
+    @property
+    def is_main_process(self):
+        return self.distributed is None or self.distributed.is_main_process
+
+    def configure_distributed(self):
+        """
+        Partition training targets between processes and synchronize initial parameters with the main process.
+        """
+        if self.distributed is None:
+            return
+        for objective in self.objectives:
+            objective.partition_training_pool(self.distributed.partition)
+        self.distributed.broadcast_parameters(self._dense_parameters() + self._sparse_parameters())
+
+    def _dense_parameters(self):
+        return [param for group in self.optimizer.param_groups for param in group["params"]]
+
+    def _sparse_parameters(self):
+        return [param for group in self.sparse_optimizer.param_groups for param in group["params"]]
+
+    def create_index_refresh_schedulers(self):
+        self.index_refresh_schedulers = [
+            IndexRefreshScheduler(
+                policy=self.trainer_params.get("index_refresh", "steps"),
+                interval=self.trainer_params.get("index_refresh_interval", 50),
+                drift_threshold=self.trainer_params.get("index_refresh_drift", 0.05)
+            ) for _ in self.objectives
+        ]
+
+    def create_profiler(self):
+        self.profiler = TrainingProfiler(
+            enabled=self.trainer_params.get("profile", False),
+            output_dir=self.model_base_path if self.is_main_process else None,
+            device=self.device,
+            trace_start=self.trainer_params.get("profiler_trace_start", None),
+            trace_steps=self.trainer_params.get("profiler_trace_steps", 5)
+        )
+        for objective in self.objectives:
+            objective.profiler = self.profiler
+
+    def create_objective_scheduler(self):
+        # processes should train the same objective on every step, otherwise gradients of different objectives are
+        # averaged, sampled schedules are identical when every process uses the same seed
+        seed = self.distributed.broadcast_seed() if self.distributed is not None else None
+        self.objective_scheduler = ObjectiveScheduler(
+            mode=self.trainer_params.get("objective_schedule", "lockstep"),
+            temperature=self.trainer_params.get("objective_temperature", 2.),
+            epoch_examples=self.trainer_params.get("epoch_examples", None),
+            seed=seed
+        )
+
+    def create_checkpoint_writer(self):
+        self.checkpoint_writer = None
+        if not (self.trainer_params.get("async_checkpoints", False) and self.do_save and self.is_main_process):
+            return
+
+        self.checkpoint_writer = CheckpointWriter(
+            self.model_base_path,
+            keep_last=self.trainer_params.get("checkpoint_keep_last", 3),
+            full_every=self.trainer_params.get("checkpoint_full_every", 10)
+        )
+        # node embedding buckets are updated sparsely, only updated rows are stored between full checkpoints
+        sparse_parameters = {id(param) for param in self._sparse_parameters()}
+        for name, param in self.node_embedder.named_parameters():
+            if id(param) in sparse_parameters:
+                self.checkpoint_writer.track_rows(("node_embedder", name), param)
+
     def create_token_pred_objective(self, dataset, tokenizer_path):
         self.objectives.append(
             TokenNamePrediction(
@@ -435,6 +529,8 @@ class SamplingMultitaskTrainer:
         return self.trainer_params['save_checkpoints']
 
     def write_summary(self, scores, batch_step):
+        if self.summary_writer is None:
+            return
         # main_name = os.path.basename(self.model_base_path)
         for var, val in scores.items():
             # self.summary_writer.add_scalar(f"{main_name}/{var}", val, batch_step)
@@ -442,6 +538,8 @@ class SamplingMultitaskTrainer:
         # self.summary_writer.add_scalars(main_name, scores, batch_step)
 
     def write_hyperparams(self, scores, epoch):
+        if self.summary_writer is None:
+            return
         params = copy(self.model_params)
         params["epoch"] = epoch
         main_name = os.path.basename(self.model_base_path)
@@ -514,13 +612,21 @@ class SamplingMultitaskTrainer:
                 self.compute_embeddings_for_scorer(objective)
                 objective.target_embedder.prepare_index()  # need this to update sampler for the next epoch
 
+        self.profiler.start_trace()
+
         for epoch in range(self.epoch, self.epochs):
             self.epoch = epoch
 
             start = time()
+            self.profiler.reset_epoch()
 
             summary_dict = {}
-            num_batches = min([objective.num_train_batches for objective in self.objectives])
+            num_batches = [objective.num_train_batches for objective in self.objectives]
+            if self.distributed is not None:
+                # all processes should make the same number of steps
+                num_batches = self.distributed.all_reduce_min(num_batches)
+            schedule = self.objective_scheduler.epoch_schedule(num_batches, self.batch_size)
+            objective_steps = [0] * len(self.objectives)
 
             train_losses = defaultdict(list)
             train_accs = defaultdict(list)
@@ -530,48 +636,59 @@ class SamplingMultitaskTrainer:
             #         destination[name] = []
             #     destination[name].append(metric)
 
-            for step in tqdm(range(num_batches), total=num_batches, desc=f"Epoch {self.epoch}"):
+            for step, step_objectives in tqdm(
+                    enumerate(schedule), total=len(schedule), desc=f"Epoch {self.epoch}",
+                    disable=not self.is_main_process
+            ):
 
                 loss_accum = 0
 
                 summary = {}
 
-                try:
-                    loaders = [objective.loader_next("train") for objective in self.objectives]
-                except StopIteration:
-                    break
+                with self.profiler.stage("sampling"):
+                    loaders = [self.next_train_batch(self.objectives[ind]) for ind in step_objectives]
 
                 self.optimizer.zero_grad()
                 self.sparse_optimizer.zero_grad()
-                for ind, (objective, (input_nodes, seeds, blocks)) in enumerate(zip(self.objectives, loaders)):
-                    blocks = [blk.to(self.device) for blk in blocks]
-
-                    objective.target_embedder.prepare_index()
-
-                    do_break = False
-                    for block in blocks:
-                        if block.num_edges() == 0:
-                            do_break = True
-                    if do_break:
-                        break
+                index_refresh_time = {}
+                for ind, (input_nodes, seeds, blocks) in zip(step_objectives, loaders):
+                    objective = self.objectives[ind]
+                    with self.profiler.stage("to_device"):
+                        blocks = [blk.to(self.device) for blk in blocks]
+
+                    with self.profiler.stage("index_refresh"):
+                        index_refresh_time[objective.name] = self.index_refresh_schedulers[ind].step(
+                            objective.target_embedder, objective_steps[ind]
+                        )
+                    objective_steps[ind] += 1
+
+                    if any(block.num_edges() == 0 for block in blocks):
+                        # skip only this objective, other objectives scheduled for the step are still trained
+                        logging.warning(f"Zero edges in a block of {objective.name} in step {step}, skipping batch")
+                        continue
 
                     # try:
-                    loss, acc = objective(
-                        input_nodes, seeds, blocks, train_embeddings=self.finetune,
-                        neg_sampling_strategy="w2v" if self.trainer_params["force_w2v_ns"] else None
-                    )
+                    with self.profiler.stage("forward"):
+                        loss, acc = objective(
+                            input_nodes, seeds, blocks, train_embeddings=self.finetune,
+                            neg_sampling_strategy="w2v" if self.trainer_params["force_w2v_ns"] else None
+                        )
 
-                    loss = loss / len(self.objectives)  # assumes the same batch size for all objectives
+                    loss = loss / len(step_objectives)  # assumes the same batch size for all objectives
                     loss_accum += loss.item()
                     # for groups in self.optimizer.param_groups:
                     #     for param in groups["params"]:
                     #         torch.nn.utils.clip_grad_norm_(param, max_norm=1.)
-                    loss.backward()  # create_graph = True
+                    with self.profiler.stage("backward"):
+                        loss.backward()  # create_graph = True
                     
                     summary = {}
                     add_to_summary(
                         summary=summary, partition="train", objective_name=objective.name,
-                        scores={"Loss": loss.item(), "Accuracy": acc}, postfix=""
+                        scores={
+                            "Loss": loss.item(), "Accuracy": acc,
+                            "IndexRefreshTime": index_refresh_time[objective.name]
+                        }, postfix=""
                     )
 
                     train_losses[f"Loss/train_avg/{objective.name}"].append(loss.item())
@@ -582,12 +699,25 @@ class SamplingMultitaskTrainer:
                     # except Exception as e:
                     #     raise e
 
+                if self.distributed is not None:
+                    with self.profiler.stage("gradient_sync"):
+                        self.distributed.all_reduce_gradients(self._dense_parameters(), self._sparse_parameters())
+
                 grad_norms = {"grad_norm": self._get_grad_norms()}
 
-                self.optimizer.step()
-                self.sparse_optimizer.step()
+                with self.profiler.stage("optimizer_step"):
+                    self.optimizer.step()
+                with self.profiler.stage("sparse_optimizer_step"):
+                    self.sparse_optimizer.step()
+                if self.checkpoint_writer is not None:
+                    self.checkpoint_writer.mark_updated()
                 step += 1
 
+                step_times = self.profiler.end_step()
+                add_to_summary(summary=summary, partition="train", objective_name="", scores={
+                    f"ProfileStepTime/{stage}": elapsed for stage, elapsed in step_times.items()
+                }, postfix="")
+
                 self.write_summary(summary, self.batch)
                 summary_dict.update(summary)
 
@@ -607,12 +737,24 @@ class SamplingMultitaskTrainer:
             for objective in self.objectives:
                 objective.reset_iterator("train")
 
+            profile = self.profiler.epoch_report(self.epoch)
+            self.write_summary({
+                f"ProfileEpochTime/{stage}": stage_times["total"] for stage, stage_times in profile.get("stages", {}).items()
+            }, self.epoch)
+
+            early_stopping = False
             for objective in self.objectives:
                 objective.eval()
 
                 with torch.set_grad_enabled(False):
                     objective.target_embedder.prepare_index()  # need this to update sampler for the next epoch
 
+                if not self.is_main_process:
+                    # only the main process evaluates and stores the model
+                    objective.train()
+                    continue
+
+                with torch.set_grad_enabled(False):
                     val_scores = objective.evaluate("val")
                     test_scores = objective.evaluate("test")
                     
@@ -630,27 +772,48 @@ class SamplingMultitaskTrainer:
                     write_best_model = True
 
                 if self.do_save:
-                    self.save_checkpoint(self.model_base_path, write_best_model=write_best_model)
+                    self.save_checkpoint_async(self.model_base_path, write_best_model=write_best_model)
                 write_best_model = False
 
                 if objective.early_stopping_trigger is True:
-                    raise EarlyStopping()
+                    early_stopping = True
+                    break
 
                 objective.train()
 
+            if self.distributed is not None:
+                # fail the epoch instead of waiting in the next collective for a process that exited
+                self.distributed.check_worker_processes()
+                early_stopping = self.distributed.broadcast_flag(early_stopping)
+            if early_stopping:
+                self.flush_checkpoints()
+                raise EarlyStopping()
+
             # self.write_hyperparams({k.replace("vs_batch", "vs_epoch"): v for k, v in summary_dict.items()}, self.epoch)
 
             end = time()
 
-            print(f"Epoch: {self.epoch}, Time: {int(end - start)} s", end="\n")
-            pprint(summary_dict)
+            if self.is_main_process:
+                print(f"Epoch: {self.epoch}, Time: {int(end - start)} s", end="\n")
+                pprint(summary_dict)
 
             self.lr_scheduler.step()
 
-    def save_checkpoint(self, checkpoint_path=None, checkpoint_name=None, write_best_model=False, **kwargs):
+        self.profiler.stop_trace()
+        self.flush_checkpoints()
 
-        model_path = join(checkpoint_path, f"saved_state.pt")
+    def next_train_batch(self, objective):
+        """
+        Get the next training batch of an objective. When the loader is exhausted, it is restarted, so that
+        objectives with different numbers of batches can be trained within the same epoch.
+        """
+        try:
+            return objective.loader_next("train")
+        except StopIteration:
+            objective.reset_iterator("train")
+            return objective.loader_next("train")
 
+    def checkpoint_state(self, **kwargs):
         param_dict = {
             'graph_model': self.graph_model.state_dict(),
             'node_embedder': self.node_embedder.state_dict(),
@@ -664,15 +827,44 @@ class SamplingMultitaskTrainer:
         if len(kwargs) > 0:
             param_dict.update(kwargs)
 
-        torch.save(param_dict, model_path)
+        return param_dict
+
+    def save_checkpoint(self, checkpoint_path=None, checkpoint_name=None, write_best_model=False, **kwargs):
+
+        model_path = join(checkpoint_path, f"saved_state.pt")
+
+        # checkpoints scheduled in background should not overwrite this one
+        self.flush_checkpoints()
+
+        param_dict = self.checkpoint_state(**kwargs)
+
+        atomic_torch_save(param_dict, model_path)
         if self.trainer_params["save_each_epoch"]:
-            torch.save(param_dict, join(checkpoint_path, f"saved_state_{self.epoch}.pt"))
+            atomic_torch_save(param_dict, join(checkpoint_path, f"saved_state_{self.epoch}.pt"))
 
         if write_best_model:
-            torch.save(param_dict,  join(checkpoint_path, f"best_model.pt"))
+            atomic_torch_save(param_dict,  join(checkpoint_path, f"best_model.pt"))
+
+    def save_checkpoint_async(self, checkpoint_path=None, write_best_model=False, **kwargs):
+        """
+        Save checkpoint with the background writer when `async_checkpoints` is enabled. Falls back to
+        `save_checkpoint` otherwise.
+        """
+        if self.checkpoint_writer is None:
+            self.save_checkpoint(checkpoint_path, write_best_model=write_best_model, **kwargs)
+            return
+
+        copies = [f"saved_state_{self.epoch}.pt"] if self.trainer_params["save_each_epoch"] else None
+        self.checkpoint_writer.save(
+            self.checkpoint_state(**kwargs), write_best_model=write_best_model, copies=copies
+        )
+
+    def flush_checkpoints(self):
+        if getattr(self, "checkpoint_writer", None) is not None:
+            self.checkpoint_writer.flush()
 
     def restore_from_checkpoint(self, checkpoint_path):
-        checkpoint = torch.load(join(checkpoint_path, "saved_state.pt"), map_location=torch.device('cpu'))
+        checkpoint = load_checkpoint(checkpoint_path)
         self.graph_model.load_state_dict(checkpoint['graph_model'])
         self.node_embedder.load_state_dict(checkpoint['node_embedder'])
         for objective in self.objectives:
@@ -760,6 +952,39 @@ class SamplingMultitaskTrainer:
 
         return [Embedder(dict(zip(original_id, global_id)), embeddings)]
 
+    def save_embeddings(self, output_dir, dtype="float32"):
+        """
+        Compute embeddings for all nodes without keeping layer outputs in memory. Embeddings are stored as
+        `EmbeddingStore` in directory `embeddings` keyed by original node ids.
+        :param output_dir: directory for embedding store, also used for intermediate layer outputs
+        :param dtype: float32 or float16
+        :return: path to embedding store
+        """
+        nodes = self.graph_model.g.nodes
+
+        def embed_nodes(ntype, ids):
+            return self.node_embedder(
+                node_type=ntype, node_ids=nodes[ntype].data['typed_id'][ids], train_embeddings=False
+            )
+
+        logging.info("Computing all embeddings")
+        h = self.graph_model.inference(
+            batch_size=2048, device='cpu', num_workers=self.trainer_params.get("loader_workers", 0),
+            x=embed_nodes, output_dir=output_dir, dtype=dtype
+        )
+        del h
+
+        last_layer_path = join(output_dir, f"layer_{len(self.graph_model.layers) - 1}.npy")
+        original_id = np.concatenate([
+            nodes[ntype].data['original_id'].numpy() for ntype in self.graph_model.g.ntypes
+        ]).astype(np.int64)
+
+        store_path = join(output_dir, "embeddings")
+        EmbeddingStore.write(store_path, original_id, np.load(last_layer_path, mmap_mode="r"))
+        os.remove(last_layer_path)
+
+        return store_path
+
 
 def select_device(args):
     device = 'cpu'
@@ -827,7 +1052,7 @@ def training_procedure(
     #     "save_each_epoch": args.save_each_epoch
     # }
 
-    trainer = trainer(
+    trainer_kwargs = dict(
         dataset=dataset,
         model_name=model_name,
         model_params=model_params,
@@ -839,8 +1064,14 @@ def training_procedure(
         load_external_dataset=load_external_dataset
     )
 
+    num_processes = trainer_params.get("num_processes", 1)
+    if num_processes > 1:
+        trainer = distributed_training_procedure(trainer, trainer_kwargs, num_processes)
+    else:
+        trainer = trainer(**trainer_kwargs)
+        trainer.train_all()
+
     # try:
-    trainer.train_all()
     # except KeyboardInterrupt:
     #     logging.info("Training interrupted")
     # except EarlyStopping:
@@ -856,6 +1087,56 @@ def training_procedure(
     return trainer, scores
 
 
+def _distributed_worker(rank, world_size, master_port, trainer_class, trainer_kwargs):
+    distributed = DistributedContext.initialize(rank, world_size, master_port)
+    try:
+        trainer = trainer_class(**trainer_kwargs, distributed=distributed)
+        trainer.train_all()
+    except EarlyStopping:
+        pass
+    finally:
+        distributed.shutdown()
+
+
+def distributed_training_procedure(trainer_class, trainer_kwargs, num_processes):
+    """
+    Train with several CPU processes in data-parallel mode. The current process becomes the main process that
+    evaluates and stores the model, and the returned trainer can be used the same way as after single process
+    training.
+    :param trainer_class: trainer class
+    :param trainer_kwargs: arguments for the trainer
+    :param num_processes: total number of training processes
+    :return: trained trainer of the main process
+    """
+    assert torch.device(trainer_kwargs["device"]).type == "cpu", "Data-parallel training is supported only on CPU"
+
+    workers, master_port = start_worker_processes(
+        num_processes, target=_distributed_worker, args=(trainer_class, trainer_kwargs)
+    )
+    try:
+        distributed = DistributedContext.initialize(0, num_processes, master_port, workers=workers)
+    except:
+        join_worker_processes(workers, terminate=True)
+        raise
+
+    success = False
+    try:
+        trainer = trainer_class(**trainer_kwargs, distributed=distributed)
+        trainer.train_all()
+        success = True
+    except EarlyStopping:
+        # worker processes received the same decision and exit normally
+        success = True
+        raise
+    finally:
+        distributed.shutdown()
+        join_worker_processes(workers, terminate=not success)
+
+    # evaluation and saving happen in a single process
+    trainer.distributed = None
+    return trainer
+
+
 def evaluation_procedure(
         dataset, model_name, model_params, args, model_base_path, trainer=None
 ):
@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+
+from SourceCodeTools.models.graph.train.AnnIndex import FaissHNSWIndex, FaissIVFIndex, IVFIndex, \
+    create_approximate_index, parse_index_spec
+from SourceCodeTools.models.graph.train.Scorer import Brute, Scorer
+
+
+@pytest.mark.parametrize("spec,expected", [
+    ("ivf", ("ivf", {})),
+    ("faiss_hnsw:", ("faiss_hnsw", {})),
+    ("ivf:n_lists=1024,n_probe=16", ("ivf", {"n_lists": 1024, "n_probe": 16})),
+    (" faiss_ivfpq : pq_m = 8 , pq_bits=4 ", ("faiss_ivfpq", {"pq_m": 8, "pq_bits": 4})),
+    ("faiss_hnsw:max_outdated_fraction=0.5", ("faiss_hnsw", {"max_outdated_fraction": 0.5})),
+])
+def test_parse_index_spec(spec, expected):
+    assert parse_index_spec(spec) == expected
+
+
+@pytest.mark.parametrize("spec", ["ivf:n_lists", "ivf:n_lists=many", "ivf:n_lists=1=2"])
+def test_parse_invalid_index_spec(spec):
+    with pytest.raises(ValueError):
+        parse_index_spec(spec)
+
+
+def test_create_unsupported_index():
+    with pytest.raises(ValueError):
+        create_approximate_index("annoy", np.zeros((10, 4), dtype=np.float32))
+
+
+@pytest.mark.parametrize("spec,index_class", [
+    ("ivf", IVFIndex), ("faiss_ivf", FaissIVFIndex), ("faiss_ivfpq", FaissIVFIndex), ("faiss_hnsw", FaissHNSWIndex)
+])
+def test_exact_index_is_used_below_min_size_for_ann(spec, index_class):
+    num_embs = 300
+    src2dst = {src: [src] for src in range(num_embs)}
+
+    scorer = Scorer(num_embs, 16, src2dst, index_backend=spec, min_size_for_ann=num_embs + 1)
+    scorer.prepare_index()
+    assert isinstance(scorer.scorer_index, Brute)
+
+    scorer = Scorer(num_embs, 16, src2dst, index_backend=spec, min_size_for_ann=num_embs)
+    scorer.prepare_index()
+    assert isinstance(scorer.scorer_index, index_class)
+
+
+def create_clustered_vectors(num_vectors, num_queries, num_dims=32, num_clusters=100):
+    # embeddings are clustered, queries come from the same clusters
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(num_clusters, num_dims)) * 3
+    vectors = centers[rng.integers(0, num_clusters, num_vectors + num_queries)] + \
+        rng.normal(size=(num_vectors + num_queries, num_dims))
+    vectors = vectors.astype(np.float32)
+    return vectors[:num_vectors], vectors[num_vectors:]
+
+
+def recall_at_k(spec, method, k=10):
+    X, queries = create_clustered_vectors(10000, 200)
+    if method == "inner_prod":
+        expected = np.argsort(-(queries @ X.T), axis=1)[:, :k]
+    else:
+        expected = np.argsort(((queries[:, None, :] - X[None, :, :]) ** 2).sum(axis=2), axis=1)[:, :k]
+
+    _, ind = create_approximate_index(spec, X, method=method).query(queries, k)
+    return np.mean([len(set(found) & set(true)) / k for found, true in zip(ind.tolist(), expected.tolist())])
+
+
+@pytest.mark.parametrize("method", ["inner_prod", "l2"])
+@pytest.mark.parametrize("spec,min_recall", [
+    ("ivf", 0.95),
+    ("faiss_ivf", 0.95),
+    ("faiss_hnsw", 0.95),
+    # product quantization with default pq_m has low recall, see FaissIVFIndex
+    ("faiss_ivfpq", 0.3),
+    ("faiss_ivfpq:pq_m=32", 0.9),
+])
+def test_recall_against_brute_force(spec, min_recall, method):
+    assert recall_at_k(spec, method) >= min_recall
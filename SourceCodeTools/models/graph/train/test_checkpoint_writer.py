@@ -0,0 +1,51 @@
+import torch
+
+from SourceCodeTools.models.graph.train.CheckpointWriter import CheckpointWriter, load_checkpoint
+
+
+def sparse_step(embedding, rows):
+    embedding.weight.grad = torch.sparse_coo_tensor(
+        torch.LongTensor([rows]), torch.ones(len(rows), embedding.weight.shape[1]), embedding.weight.shape
+    )
+    with torch.no_grad():
+        embedding.weight[rows] += 1.
+
+
+def test_incremental_checkpoints_restore_full_state(tmp_path):
+    embedding = torch.nn.Embedding(20, 3, sparse=True)
+    linear = torch.nn.Linear(3, 1)
+
+    writer = CheckpointWriter(str(tmp_path), keep_last=2, full_every=3)
+    writer.track_rows(("node_embedder", "weight"), embedding.weight)
+
+    expected = {}
+    for batch, rows in enumerate([[0, 1], [5], [1, 7], [19], [2, 3]]):
+        sparse_step(embedding, rows)
+        writer.mark_updated()
+        with torch.no_grad():
+            linear.weight += 1.
+        writer.save(
+            {"node_embedder": embedding.state_dict(), "model": linear.state_dict(), "batch": batch},
+            write_best_model=batch == 1
+        )
+        expected[batch] = embedding.weight.detach().clone(), linear.weight.detach().clone()
+    writer.close()
+
+    manifest = CheckpointWriter.read_manifest(writer.path)
+    checkpoints = {checkpoint["batch"]: checkpoint for checkpoint in manifest["checkpoints"]}
+    # the last checkpoint is stored incrementally and depends on the full checkpoint before it
+    assert not checkpoints[4]["full"] and checkpoints[3]["full"]
+    # checkpoints that are not kept and not needed by kept checkpoints are removed
+    assert sorted(checkpoints) == [0, 1, 3, 4]
+
+    for batch in checkpoints:
+        state = CheckpointWriter.load_version(writer.path, checkpoints[batch]["version"], manifest)
+        assert torch.equal(state["node_embedder"]["weight"], expected[batch][0])
+        assert torch.equal(state["model"]["weight"], expected[batch][1])
+
+    latest = load_checkpoint(str(tmp_path))
+    assert latest["batch"] == 4
+    assert torch.equal(latest["node_embedder"]["weight"], expected[4][0])
+
+    best = torch.load(str(tmp_path / "best_model.pt"))
+    assert torch.equal(best["node_embedder"]["weight"], expected[1][0])
@@ -0,0 +1,113 @@
+import sys
+import time
+
+import pytest
+import torch
+import torch.multiprocessing as mp
+import torch.nn as nn
+
+from SourceCodeTools.models.graph.train.ObjectiveScheduler import ObjectiveScheduler
+from SourceCodeTools.models.graph.train.distributed_training import DistributedContext, WorkerProcessError, \
+    find_free_port, join_worker_processes, start_worker_processes
+
+
+def create_model(seed):
+    torch.manual_seed(seed)
+    return nn.Embedding(10, 4, sparse=True), nn.Linear(4, 1)
+
+
+def get_batch():
+    ids = torch.LongTensor([0, 1, 2, 3, 1, 5, 6, 2])
+    targets = torch.arange(8, dtype=torch.float32)
+    return ids, targets
+
+
+def train_step(embedding, linear, ids, targets, distributed=None):
+    dense_optimizer = torch.optim.Adam(linear.parameters(), lr=0.1)
+    sparse_optimizer = torch.optim.SparseAdam(embedding.parameters(), lr=0.1)
+
+    loss = ((linear(embedding(ids)).squeeze(1) - targets) ** 2).mean()
+    loss.backward()
+    if distributed is not None:
+        distributed.all_reduce_gradients(linear.parameters(), embedding.parameters())
+
+    dense_optimizer.step()
+    sparse_optimizer.step()
+
+
+def distributed_worker(rank, world_size, master_port, output_path):
+    distributed = DistributedContext.initialize(rank, world_size, master_port, num_threads=1)
+    try:
+        # replicas start from different values and are synchronized with the main process
+        embedding, linear = create_model(seed=rank)
+        distributed.broadcast_parameters(list(linear.parameters()) + list(embedding.parameters()))
+
+        ids, targets = get_batch()
+        train_step(embedding, linear, distributed.partition(ids), distributed.partition(targets), distributed)
+
+        scheduler = ObjectiveScheduler(mode="temperature", seed=distributed.broadcast_seed())
+        torch.save({
+            "embedding": embedding.weight.detach(),
+            "linear": [param.detach() for param in linear.parameters()],
+            "schedule": scheduler.epoch_schedule([3, 5, 1], batch_size=1),
+        }, output_path.format(rank=rank))
+    finally:
+        distributed.shutdown()
+
+
+def test_data_parallel_step_matches_single_process(tmp_path):
+    world_size = 2
+    output_path = str(tmp_path / "rank_{rank}.pt")
+    mp.spawn(distributed_worker, args=(world_size, find_free_port(), output_path), nprocs=world_size, join=True)
+
+    embedding, linear = create_model(seed=0)
+    train_step(embedding, linear, *get_batch())
+
+    results = [torch.load(output_path.format(rank=rank)) for rank in range(world_size)]
+    for result in results:
+        assert torch.allclose(result["embedding"], embedding.weight.detach(), atol=1e-6)
+        for param, expected in zip(result["linear"], linear.parameters()):
+            assert torch.allclose(param, expected.detach(), atol=1e-6)
+
+    # temperature schedule is sampled, every process should sample the same one
+    assert results[0]["schedule"] == results[1]["schedule"]
+
+
+def failing_before_joining(rank, world_size, master_port):
+    sys.exit(3)
+
+
+def failing_after_training(rank, world_size, master_port):
+    distributed = DistributedContext.initialize(rank, world_size, master_port, num_threads=1)
+    distributed.all_reduce_min([rank])
+    distributed.shutdown()
+    sys.exit(4)
+
+
+def test_failed_worker_interrupts_rendezvous():
+    workers, master_port = start_worker_processes(2, failing_before_joining, args=())
+
+    start = time.monotonic()
+    with pytest.raises(WorkerProcessError):
+        DistributedContext.initialize(0, 2, master_port, num_threads=1, workers=workers)
+    # does not wait for the timeout of collective operations
+    assert time.monotonic() - start < 60
+
+    with pytest.raises(WorkerProcessError):
+        join_worker_processes(workers, terminate=True)
+
+
+def test_failed_worker_is_reported_and_threads_are_restored():
+    num_threads = torch.get_num_threads()
+    workers, master_port = start_worker_processes(2, failing_after_training, args=())
+
+    distributed = DistributedContext.initialize(0, 2, master_port, num_threads=1, workers=workers)
+    assert torch.get_num_threads() == 1
+    assert distributed.all_reduce_min([5]) == [1]
+    distributed.shutdown()
+    assert torch.get_num_threads() == num_threads
+
+    with pytest.raises(WorkerProcessError):
+        join_worker_processes(workers)
+    with pytest.raises(WorkerProcessError):
+        distributed.check_worker_processes()
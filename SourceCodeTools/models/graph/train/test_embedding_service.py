@@ -0,0 +1,156 @@
+import threading
+
+import numpy as np
+import pytest
+
+from SourceCodeTools.models.Embedder import Embedder
+from SourceCodeTools.models.EmbeddingService import EmbeddingQueryEngine, MicroBatcher, create_server
+from SourceCodeTools.models.EmbeddingServiceClient import EmbeddingServiceClient
+from SourceCodeTools.models.EmbeddingStore import EmbeddingStore
+
+
+def create_embedder(num_embeddings=300, num_dims=8):
+    rng = np.random.default_rng(0)
+    ids = rng.permutation(10 * num_embeddings)[:num_embeddings].tolist()
+    embeddings = rng.normal(size=(num_embeddings, num_dims)).astype(np.float32)
+    return Embedder(dict(zip(ids, range(num_embeddings))), embeddings)
+
+
+def brute_force_knn(embeddings, vectors, k, method):
+    if method == "inner_prod":
+        # indices normalize query vectors
+        scores = (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)) @ embeddings.T
+        rows = np.argsort(-scores, axis=1, kind="stable")[:, :k]
+    else:
+        scores = np.linalg.norm(vectors[:, None, :] - embeddings[None, :, :], axis=2)
+        rows = np.argsort(scores, axis=1, kind="stable")[:, :k]
+    return rows, np.take_along_axis(scores, rows, axis=1)
+
+
+@pytest.mark.parametrize("index", ["brute", "faiss"])
+@pytest.mark.parametrize("method", ["inner_prod", "l2"])
+def test_query_engine_matches_brute_force(index, method, tmp_path):
+    embedder = create_embedder()
+    store = EmbeddingStore.from_embedder(embedder, str(tmp_path / "store"))
+    vectors = np.random.default_rng(1).normal(size=(20, embedder.e.shape[1])).astype(np.float32)
+
+    for source in [embedder, store]:
+        engine = EmbeddingQueryEngine(source, index=index, method=method)
+        neighbour_ids, scores = engine.knn(vectors, k=5)
+
+        rows, expected_scores = brute_force_knn(np.asarray(source.e), vectors, 5, method)
+        assert neighbour_ids.tolist() == [[source.inv[row] for row in query_rows] for query_rows in rows.tolist()]
+        # faiss returns squared l2 distances
+        if index == "faiss" and method == "l2":
+            expected_scores = expected_scores ** 2
+        assert np.allclose(scores, expected_scores, atol=1e-4)
+
+
+def test_query_engine_get_marks_missing_ids():
+    embedder = create_embedder()
+    engine = EmbeddingQueryEngine(embedder)
+    known = list(embedder.ind)[:2]
+
+    embeddings, found = engine.get([known[0], -1, known[1]])
+    assert found.tolist() == [True, False, True]
+    assert np.array_equal(embeddings[0], embedder.e[embedder.ind[known[0]]])
+    assert np.all(np.isnan(embeddings[1]))
+
+
+class RecordingEngine:
+    """
+    Query engine that returns inputs as results and records every batch.
+    """
+    def __init__(self):
+        self.get_batches = []
+        self.knn_batches = []
+
+    def get(self, ids):
+        self.get_batches.append(list(ids))
+        if "invalid" in ids:
+            raise ValueError("Invalid id")
+        return np.array(ids, dtype=object)[:, None], np.ones(len(ids), dtype=np.bool_)
+
+    def knn(self, vectors, k):
+        self.knn_batches.append((len(vectors), k))
+        neighbours = vectors[:, :1] + np.arange(k)[None, :]
+        return neighbours, -neighbours
+
+
+def submit_concurrently(batcher, requests):
+    futures = [None] * len(requests)
+    barrier = threading.Barrier(len(requests))
+
+    def submit(ind):
+        barrier.wait()
+        futures[ind] = batcher.submit(*requests[ind])
+
+    threads = [threading.Thread(target=submit, args=(ind,)) for ind in range(len(requests))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return [future.result(timeout=10) if future.exception(timeout=10) is None else future.exception()
+            for future in futures]
+
+
+def test_micro_batcher_groups_requests_and_routes_results():
+    engine = RecordingEngine()
+    batcher = MicroBatcher(engine, max_batch_size=1000, max_wait=1.)
+
+    requests = [("get", [f"{client}_{ind}" for ind in range(client + 1)]) for client in range(4)]
+    requests += [("knn", np.full((2, 3), 10. * client), client + 1) for client in range(3)]
+    results = submit_concurrently(batcher, requests)
+
+    # requests of the same kind are executed together
+    assert len(engine.get_batches) == 1 and sorted(engine.get_batches[0]) == sorted(
+        id_ for _, ids in requests[:4] for id_ in ids
+    )
+    assert engine.knn_batches == [(6, 3)]
+
+    for (_, ids), (embeddings, found) in zip(requests[:4], results[:4]):
+        assert embeddings[:, 0].tolist() == ids
+        assert found.tolist() == [True] * len(ids)
+    for (_, vectors, k), (neighbours, scores) in zip(requests[4:], results[4:]):
+        # every client receives its own rows with its own number of neighbours
+        assert neighbours.tolist() == (vectors[:, :1] + np.arange(k)[None, :]).tolist()
+        assert scores.tolist() == (-neighbours).tolist()
+
+
+def test_micro_batcher_isolates_failed_requests():
+    engine = RecordingEngine()
+    batcher = MicroBatcher(engine, max_batch_size=1000, max_wait=1.)
+
+    results = submit_concurrently(batcher, [("get", ["a"]), ("get", ["invalid"]), ("get", ["b", "c"])])
+
+    assert isinstance(results[1], ValueError)
+    assert results[0][0][:, 0].tolist() == ["a"]
+    assert results[2][0][:, 0].tolist() == ["b", "c"]
+
+
+def test_client_round_trip_over_unix_socket(tmp_path):
+    embedder = create_embedder()
+    server = create_server(EmbeddingQueryEngine(embedder), socket_path=str(tmp_path / "embeddings.sock"))
+    server_thread = threading.Thread(target=server.serve_forever, daemon=True)
+    server_thread.start()
+
+    try:
+        with EmbeddingServiceClient(socket_path=str(tmp_path / "embeddings.sock"), timeout=10) as client:
+            assert client.info() == {"n_embs": 300, "n_dims": 8}
+
+            ids = list(embedder.ind)[:3]
+            embeddings = client.get(ids + [-1])
+            assert np.allclose(embeddings[:3], embedder.e[[embedder.ind[id_] for id_ in ids]])
+            assert embeddings[3] is None
+
+            neighbour_ids, scores = client.knn(ids=ids, k=4)
+            rows, expected_scores = brute_force_knn(embedder.e, embedder.e[[embedder.ind[id_] for id_ in ids]], 4,
+                                                    "inner_prod")
+            assert neighbour_ids == [[embedder.inv[row] for row in query_rows] for query_rows in rows.tolist()]
+            assert np.allclose(scores, expected_scores, atol=1e-4)
+
+            with pytest.raises(ValueError):
+                client.knn(ids=[-1], k=4)
+    finally:
+        server.shutdown()
+        server.server_close()
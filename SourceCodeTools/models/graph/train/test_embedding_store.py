@@ -0,0 +1,62 @@
+import pickle
+
+import numpy as np
+import pytest
+
+from SourceCodeTools.models.Embedder import Embedder
+from SourceCodeTools.models.EmbeddingStore import EmbeddingStore, load_embedder
+
+
+def create_embedder():
+    ids = [42, 7, 1000, -3, 15]
+    rows = [3, 0, 4, 1, 2]
+    embeddings = np.random.default_rng(0).normal(size=(len(ids), 4)).astype(np.float32)
+    return Embedder(dict(zip(ids, rows)), embeddings)
+
+
+def test_store_matches_embedder(tmp_path):
+    embedder = create_embedder()
+    store = EmbeddingStore.from_embedder(embedder, str(tmp_path / "store"))
+
+    assert store.n_embs == len(embedder.ind)
+    assert store.n_dims == embedder.e.shape[1]
+
+    for id_, row in embedder.ind.items():
+        assert id_ in store
+        assert np.array_equal(store[id_], embedder.e[row])
+        assert store.inv[store.ind[id_]] == id_
+
+    keys = np.array([15, 42, -3, 15])
+    assert np.array_equal(store[keys], embedder.e[[embedder.ind[key] for key in keys]])
+
+
+def test_missing_ids(tmp_path):
+    store = EmbeddingStore.from_embedder(create_embedder(), str(tmp_path / "store"))
+
+    for missing in [0, 2000, -100, "42"]:
+        assert missing not in store
+        assert store.ind.get(missing) is None
+    with pytest.raises(KeyError):
+        store[8]
+    with pytest.raises(KeyError):
+        store.lookup([42, 8])
+
+    default = np.full(store.n_dims, -1., dtype=np.float32)
+    embeddings = store.lookup([42, 8], default=default)
+    assert np.array_equal(embeddings[0], store[42])
+    assert np.array_equal(embeddings[1], default)
+
+
+def test_duplicate_ids_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        EmbeddingStore.write(str(tmp_path / "store"), [1, 2, 1], np.zeros((3, 2)))
+
+
+def test_store_is_pickled_by_location(tmp_path):
+    path = str(tmp_path / "store")
+    store = EmbeddingStore.from_embedder(create_embedder(), path)
+    restored = pickle.loads(pickle.dumps(store))
+    assert restored.path == path
+    assert np.array_equal(restored[42], store[42])
+
+    assert isinstance(load_embedder(path), EmbeddingStore)
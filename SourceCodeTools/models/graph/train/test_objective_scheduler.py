@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from SourceCodeTools.models.graph.train.ObjectiveScheduler import ObjectiveScheduler
+
+
+def count_steps(schedule, num_objectives):
+    counts = [0] * num_objectives
+    for step in schedule:
+        for ind in step:
+            counts[ind] += 1
+    return counts
+
+
+def test_lockstep_trains_every_objective_until_shortest_is_exhausted():
+    schedule = ObjectiveScheduler(mode="lockstep").epoch_schedule([3, 5, 2], batch_size=1)
+    assert schedule == [[0, 1, 2]] * 2
+
+
+def test_round_robin_alternates_objectives():
+    schedule = ObjectiveScheduler(mode="round_robin").epoch_schedule([1, 1, 4], batch_size=1)
+    assert schedule == [[0], [1], [2], [0], [1], [2]]
+
+
+def test_proportional_follows_number_of_batches():
+    schedule = ObjectiveScheduler(mode="proportional").epoch_schedule([2, 6], batch_size=1)
+    assert count_steps(schedule, 2) == [2, 6]
+    # objectives are interleaved, not trained one after another
+    assert schedule[:4].count([0]) == 1
+
+
+def test_epoch_examples_define_epoch_length():
+    scheduler = ObjectiveScheduler(mode="round_robin", epoch_examples=100)
+    assert len(scheduler.epoch_schedule([1, 1], batch_size=10)) == 10
+    assert len(scheduler.epoch_schedule([1, 1], batch_size=1000)) == 1
+
+
+def test_temperature_weights():
+    num_batches = [1, 4, 16]
+    assert np.allclose(ObjectiveScheduler(mode="temperature", temperature=1.).weights(num_batches), [1 / 21, 4 / 21, 16 / 21])
+    assert np.allclose(ObjectiveScheduler(mode="temperature", temperature=2.).weights(num_batches), [1 / 7, 2 / 7, 4 / 7])
+
+
+def test_temperature_schedule_is_reproducible():
+    first = ObjectiveScheduler(mode="temperature", seed=1).epoch_schedule([3, 5, 1], batch_size=1)
+    second = ObjectiveScheduler(mode="temperature", seed=1).epoch_schedule([3, 5, 1], batch_size=1)
+    assert first == second
+    assert len(first) == 9
+
+
+@pytest.mark.parametrize("mode", ["round_robin", "proportional", "temperature"])
+def test_weights_without_batches_are_uniform(mode):
+    scheduler = ObjectiveScheduler(mode=mode, epoch_examples=4, seed=0)
+    weights = scheduler.weights([0, 0])
+    assert not np.any(np.isnan(weights))
+    assert np.allclose(weights, [0.5, 0.5])
+    assert len(scheduler.epoch_schedule([0, 0], batch_size=1)) == 4
+
+
+def test_unsupported_mode():
+    with pytest.raises(ValueError):
+        ObjectiveScheduler(mode="random")
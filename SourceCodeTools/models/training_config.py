@@ -27,6 +27,10 @@ config_specification = {
         "pretraining_phase": 0,
 
         "sampling_neighbourhood_size": 10,
+        "neighbour_sampling": "full",
+        "loader_workers": 0,
+        "prefetch_batches": 2,
+        "num_processes": 1,
         "neg_sampling_factor": 3,
         "use_layer_scheduling": False,
         "schedule_layers_every": 10,
@@ -41,12 +45,27 @@ config_specification = {
         "objectives": None,
         "save_each_epoch": False,
         "save_checkpoints": True,
+        "async_checkpoints": False,
+        "checkpoint_keep_last": 3,
+        "checkpoint_full_every": 10,
         "early_stopping": False,
         "early_stopping_tolerance": 20,
 
         "force_w2v_ns": False,
         "use_ns_groups": False,
         "nn_index": "brute",
+        "index_refresh": "steps",
+        "index_refresh_interval": 50,
+        "index_refresh_drift": 0.05,
+        "min_size_for_ann": 10000,
+        "profile": False,
+        "profiler_trace_start": None,
+        "profiler_trace_steps": 5,
+        "objective_schedule": "lockstep",
+        "objective_temperature": 2.,
+        "epoch_examples": None,
+        "streaming_inference": False,
+        "inference_dtype": "float32",
 
         "metric": "inner_prod",
 
@@ -56,6 +75,7 @@ config_specification = {
         "gpu": -1,
 
         "external_dataset": None,
+        "dataset_cache": None,
 
         "restore_state": False,
     },
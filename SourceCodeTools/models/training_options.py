@@ -29,6 +29,10 @@ def add_training_arguments(parser):
     parser.add_argument('--node_emb_size', dest='node_emb_size', default=100, type=int, help='Dimensionality of node embeddings')
     parser.add_argument('--elem_emb_size', dest='elem_emb_size', default=100, type=int, help='Dimensionality of target embeddings (node names). Should match node embeddings when cosine distance loss is used')
     parser.add_argument('--sampling_neighbourhood_size', dest='sampling_neighbourhood_size', default=10, type=int, help='Number of dependencies to sample per node')
+    parser.add_argument('--neighbour_sampling', dest='neighbour_sampling', default='full', type=str, help='Neighbourhood used for computing node embeddings: full|fanout. With fanout, at most sampling_neighbourhood_size neighbours are sampled per node on every layer')
+    parser.add_argument('--loader_workers', dest='loader_workers', default=0, type=int, help='Number of worker processes that sample subgraphs in background')
+    parser.add_argument('--prefetch_batches', dest='prefetch_batches', default=2, type=int, help='Number of batches sampled ahead of time by loader workers')
+    parser.add_argument('--num_processes', dest='num_processes', default=1, type=int, help='Number of data-parallel CPU training processes. Processes share the dataset, train on disjoint partitions of training targets, and average gradients after every step')
     parser.add_argument('--neg_sampling_factor', dest='neg_sampling_factor', default=3, type=int, help='Number of negative samples for each positive')
 
     parser.add_argument('--use_layer_scheduling', action='store_true', help='???')
@@ -42,15 +46,31 @@ def add_training_arguments(parser):
     parser.add_argument("--objectives", dest="objectives", default=None, type=str, help='???')
 
     parser.add_argument("--save_each_epoch", action="store_true", help='Save checkpoints for each epoch (high disk space utilization)')
+    parser.add_argument("--async_checkpoints", action="store_true", help='Write checkpoints during training in background. Node embedding buckets are stored incrementally between full checkpoints')
+    parser.add_argument("--checkpoint_keep_last", default=3, type=int, help='Number of latest background checkpoints to keep')
+    parser.add_argument("--checkpoint_full_every", default=10, type=int, help='Number of background checkpoints between full copies of node embedding buckets')
     parser.add_argument("--early_stopping", action="store_true", help='???')
     parser.add_argument("--early_stopping_tolerance", default=20, type=int, help='???')
     parser.add_argument("--force_w2v_ns", action="store_true", help='Use w2v negative sampling strategy p_unigram^(3/4)')
     parser.add_argument("--use_ns_groups", action="store_true", help='Perform negative sampling only from closest neighbours???')
 
     parser.add_argument("--metric", default="inner_prod", type=str, help='???')
-    parser.add_argument("--nn_index", default="brute", type=str, help='Index backend for generating negative samples???')
+    parser.add_argument("--nn_index", default="brute", type=str, help='Index backend for generating negative samples: brute|faiss|sklearn|ivf|faiss_ivf|faiss_ivfpq|faiss_hnsw. Parameters of approximate indices are passed as name:param=value,... e.g. faiss_ivf:n_lists=1024,n_probe=16')
+    parser.add_argument("--index_refresh", default="steps", type=str, help='When to rebuild nearest neighbour index: steps|epoch|drift')
+    parser.add_argument("--index_refresh_interval", default=50, type=int, help='Number of steps between index rebuilds or drift measurements')
+    parser.add_argument("--index_refresh_drift", default=0.05, type=float, help='Average cosine distance between stored and current target embeddings that triggers index rebuild')
+    parser.add_argument("--min_size_for_ann", default=10000, type=int, help='Approximate indices from `--nn_index` are replaced with exact search when there are fewer candidates')
+    parser.add_argument("--profile", action="store_true", help='Measure time of training stages and store per epoch reports in the model directory')
+    parser.add_argument("--profiler_trace_start", default=None, type=int, help='Training step when torch.profiler trace starts. Trace is not recorded when not set')
+    parser.add_argument("--profiler_trace_steps", default=5, type=int, help='Number of training steps recorded in torch.profiler trace')
+    parser.add_argument("--objective_schedule", default="lockstep", type=str, help='How objectives share training steps: lockstep|round_robin|proportional|temperature. Except for lockstep, one objective is trained per step and loaders are consumed independently')
+    parser.add_argument("--objective_temperature", default=2., type=float, help='Temperature for sampling objectives with probability proportional to num_batches^(1/T)')
+    parser.add_argument("--epoch_examples", default=None, type=int, help='Number of training examples in one epoch when objectives are not trained in lockstep. Total number of training examples of all objectives when not set')
+    parser.add_argument("--streaming_inference", action="store_true", help='Write layer outputs to memory-mapped files during inference and store final embeddings as memory-mapped embedding store instead of embeddings.pkl')
+    parser.add_argument("--inference_dtype", default="float32", type=str, help='Data type of embeddings stored with streaming inference: float32|float16')
 
     parser.add_argument("--external_dataset", default=None, type=str, help='Path to external graph, use for inference')
+    parser.add_argument("--dataset_cache", default=None, type=str, help='Directory for preprocessed datasets shared between runs')
 
 
 def add_scoring_arguments(parser):
@@ -14,6 +14,7 @@ from pathlib import Path
 
 import tensorflow
 
+from SourceCodeTools.models.EmbeddingStore import load_embedder
 from SourceCodeTools.nlp.batchers import PythonBatcher
 from SourceCodeTools.nlp.entity import parse_biluo
 from SourceCodeTools.nlp.entity.tf_models.params import cnn_params
@@ -23,15 +24,12 @@ from SourceCodeTools.nlp.entity.utils.data import read_data
 
 def load_pkl_emb(path):
     """
-    Load graph embeddings from a pickle file. Embeddigns are stored in class Embedder or in a list of Embedders. The
-        last embedder in the list is returned.
-    :param path: path to graph embeddigs stored as Embedder pickle
-    :return: Embedder object
+    Load graph embeddings from a pickle file or from an embedding store directory. Embeddigns are stored in class
+        Embedder or in a list of Embedders. The last embedder in the list is returned.
+    :param path: path to graph embeddigs stored as Embedder pickle or EmbeddingStore
+    :return: Embedder or EmbeddingStore object
     """
-    embedder = pickle.load(open(path, "rb"))
-    if isinstance(embedder, list):
-        embedder = embedder[-1]
-    return embedder
+    return load_embedder(path, layer=-1)
 
 
 def compute_precision_recall_f1(tp, fp, fn, eps=1e-8):
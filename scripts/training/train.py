@@ -1,5 +1,6 @@
 import json
 import logging
+import os
 from copy import copy
 from datetime import datetime
 from os import mkdir
@@ -9,11 +10,21 @@ from SourceCodeTools.code.data.dataset.Dataset import read_or_create_gnn_dataset
 from SourceCodeTools.models.graph import RGGAN
 from SourceCodeTools.models.graph.train.sampling_multitask2 import training_procedure
 from SourceCodeTools.models.graph.train.utils import get_name, get_model_base
-from SourceCodeTools.models.training_config import get_config, load_config, update_config, save_config
+from SourceCodeTools.models.training_config import get_config, load_config, update_config, save_config, \
+    config_specification
 from SourceCodeTools.models.training_options import add_gnn_train_args, verify_arguments
 from params import rggan_params
 
 
+def write_embeddings(trainer, model_base, metadata, streaming_inference=False, inference_dtype="float32"):
+    if streaming_inference:
+        store_path = trainer.save_embeddings(model_base, dtype=inference_dtype)
+        metadata["layers"] = os.path.basename(store_path)
+    else:
+        import pickle
+        pickle.dump(trainer.get_embeddings(), open(join(model_base, metadata['layers']), "wb"))
+
+
 def train_grid(models, args):
 
     for model, param_grid in models.items():
@@ -35,7 +46,13 @@ def train_grid(models, args):
 
             model_base = get_model_base(args, model_attempt)
 
-            dataset = read_or_create_gnn_dataset(args=args, model_base=model_base)
+            dataset_args = {
+                key: value for key, value in vars(args).items()
+                if key in config_specification["DATASET"] or key in config_specification["TOKENIZER"]
+            }
+            dataset = read_or_create_gnn_dataset(
+                args=dataset_args, model_base=model_base, dataset_cache=args.dataset_cache
+            )
 
             def write_params(args, params):
                 args = copy(args.__dict__)
@@ -72,8 +89,7 @@ def train_grid(models, args):
             metadata.update(args.__dict__)
 
             # pickle.dump(dataset, open(join(model_base, "dataset.pkl"), "wb"))
-            import pickle
-            pickle.dump(trainer.get_embeddings(), open(join(model_base, metadata['layers']), "wb"))
+            write_embeddings(trainer, model_base, metadata, args.streaming_inference, args.inference_dtype)
 
             with open(join(model_base, "metadata.json"), "w") as mdata:
                 mdata.write(json.dumps(metadata, indent=4))
@@ -105,7 +121,8 @@ def main(args):
 
     dataset = read_or_create_gnn_dataset(
         args={**config["DATASET"], **config["TOKENIZER"]},
-        model_base=model_base, restore_state=restore_state
+        model_base=model_base, restore_state=restore_state,
+        dataset_cache=config["TRAINING"]["dataset_cache"]
     )
 
     if not restore_state:
@@ -137,8 +154,9 @@ def main(args):
     metadata["config"] = args
 
     # pickle.dump(dataset, open(join(model_base, "dataset.pkl"), "wb"))
-    import pickle
-    pickle.dump(trainer.get_embeddings(), open(join(model_base, metadata['layers']), "wb"))
+    write_embeddings(
+        trainer, model_base, metadata, config["TRAINING"]["streaming_inference"], config["TRAINING"]["inference_dtype"]
+    )
 
     with open(join(model_base, "metadata.json"), "w") as mdata:
         mdata.write(json.dumps(metadata, indent=4))
@@ -16,7 +16,9 @@ requirements = [
       'spacy==2.3.2',
       'pytest==6.1.2',
       'faiss-cpu==1.7.0',
-      'tqdm==4.49.0'
+      'pyarrow==5.0.0',
+      'tqdm==4.49.0',
+      'xxhash==2.0.2'
       # 'pygraphviz'
       # 'javac_parser'
 ]